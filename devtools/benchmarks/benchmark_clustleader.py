@@ -0,0 +1,107 @@
+"""
+Benchmark the leader clustering against the exact RMSD clustering.
+
+Synthetic models are noisy copies of a number of structures. The exact
+clustering calculates the full RMSD matrix and cuts the average linkage
+dendrogram at the cutoff, as ``clustrmsd`` does with the ``distance``
+criterion, and is only timed up to ``--max-exact`` models.
+
+Usage::
+
+    python devtools/benchmarks/benchmark_clustleader.py
+    python devtools/benchmarks/benchmark_clustleader.py -n 2000 50000 -k 50
+"""
+import argparse
+import logging
+import time
+
+import numpy as np
+
+from haddock.modules.analysis.clustleader.clustleader import (
+    adjusted_rand_index,
+    exact_clustering,
+    leader_clustering,
+    )
+
+
+def make_models(nmodels, nstructures, natoms, noise, rng):
+    """Return noisy copies of random structures and their structure."""
+    structures = rng.normal(scale=10.0, size=(nstructures, natoms, 3))
+    labels = rng.integers(nstructures, size=nmodels)
+    xyz = structures[labels] + rng.normal(
+        scale=noise,
+        size=(nmodels, natoms, 3),
+        )
+    return xyz, np.ones((nmodels, natoms), dtype=bool), labels
+
+
+def timeit(func, *args):
+    """Return the time of `func`, in seconds, and its result."""
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main(sizes, nstructures, natoms, noise, cutoff, max_exact):
+    """Print the time and agreement of each clustering per size."""
+    rng = np.random.default_rng(42)
+    for nmodels in sizes:
+        xyz, mask, labels = make_models(
+            nmodels, nstructures, natoms, noise, rng)
+        t_leader, (leader, leaders, ncalc) = timeit(
+            leader_clustering, xyz, mask, cutoff)
+        line = (
+            f"{nmodels:>7} models: leader {t_leader:8.2f} s, "
+            f"{len(leaders):>4} clusters, {ncalc:>10} RMSD "
+            f"({2 * ncalc / (nmodels * (nmodels - 1)):.4f} of the matrix), "
+            f"ARI to truth {adjusted_rand_index(leader, labels):.3f}"
+            )
+        if nmodels <= max_exact:
+            t_exact, exact = timeit(exact_clustering, xyz, mask, cutoff)
+            line += (
+                f"; exact {t_exact:8.2f} s, {t_exact / t_leader:6.1f}x, "
+                f"ARI to exact {adjusted_rand_index(leader, exact):.3f}"
+                )
+        print(line)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument(
+        "-n",
+        "--nmodels",
+        nargs="+",
+        type=int,
+        default=[1000, 2000, 5000, 20000],
+        )
+    ap.add_argument(
+        "-k",
+        "--structures",
+        type=int,
+        default=20,
+        help="Number of structures the models are copies of.",
+        )
+    ap.add_argument("--natoms", type=int, default=200)
+    ap.add_argument(
+        "--noise",
+        type=float,
+        default=1.0,
+        help="Standard deviation of the noise of the models, in A.",
+        )
+    ap.add_argument("-c", "--cutoff", type=float, default=3.0)
+    ap.add_argument(
+        "--max-exact",
+        type=int,
+        default=5000,
+        help="Largest number of models clustered exactly.",
+        )
+    args = ap.parse_args()
+    logging.disable(logging.INFO)
+    main(
+        args.nmodels,
+        args.structures,
+        args.natoms,
+        args.noise,
+        args.cutoff,
+        args.max_exact,
+        )
@@ -0,0 +1,125 @@
+"""
+Benchmark the clustrmsd cluster centres and threshold against the loops.
+
+The RMSD matrix of the larger sizes does not fit in memory, so distances
+are generated on the fly from their condensed index. The per-pair loops
+are only timed up to ``--max-loop`` cluster members.
+
+Usage::
+
+    python devtools/benchmarks/benchmark_clustrmsd.py
+    python devtools/benchmarks/benchmark_clustrmsd.py -n 10000 50000 -s 0.2
+"""
+import argparse
+import logging
+import time
+
+import numpy as np
+
+from haddock.modules.analysis.clustrmsd.clustrmsd import (
+    apply_threshold,
+    get_cluster_center,
+    )
+
+
+class SyntheticMatrix:
+    """A condensed matrix whose values are derived from their index."""
+
+    def __getitem__(self, idx):
+        idx = np.asarray(idx, dtype=np.uint64)
+        return (idx * np.uint64(2654435761) % np.uint64(10007)) / 1000.0
+
+
+def get_cluster_center_loop(npw, n_obs, rmsd_matrix):
+    """Sum the distances one pair at a time, as done before."""
+    intra_cl_distances = {el: 0.0 for el in npw}
+    for m_idx in range(len(npw)):
+        npws = npw[m_idx + 1:]
+        pairs = [
+            int(n_obs * (n_obs - 1) / 2 - (n_obs - npw[m_idx])
+                * (n_obs - npw[m_idx] - 1) / 2 + el - npw[m_idx] - 1)
+            for el in npws
+            ]
+        for pair_idx in range(len(pairs)):
+            value = float(rmsd_matrix[pairs[pair_idx]])
+            intra_cl_distances[npw[m_idx]] += value
+            intra_cl_distances[npws[pair_idx]] += value
+    return min(intra_cl_distances, key=intra_cl_distances.get)
+
+
+def apply_threshold_loop(cluster_arr, threshold):
+    """Test the membership of each model, as done before."""
+    new_cluster_arr = cluster_arr.copy()
+    cluster_pops = np.unique(cluster_arr, return_counts=True)
+    invalid_clusters = cluster_pops[0][cluster_pops[1] < threshold]
+    for cl_idx, cl_id in enumerate(new_cluster_arr):
+        if cl_id in invalid_clusters:
+            new_cluster_arr[cl_idx] = -1
+    return new_cluster_arr
+
+
+def timeit(func, *args):
+    """Return the time of `func`, in milliseconds, and its result."""
+    start = time.perf_counter()
+    result = func(*args)
+    return 1000 * (time.perf_counter() - start), result
+
+
+def main(sizes, cluster_fraction, max_loop):
+    """Print the time of each implementation per number of models."""
+    rng = np.random.default_rng(42)
+    rmsd_matrix = SyntheticMatrix()
+    for n_obs in sizes:
+        npw = np.sort(rng.choice(
+            n_obs,
+            int(n_obs * cluster_fraction),
+            replace=False,
+            ))
+        t_new, center = timeit(get_cluster_center, npw, n_obs, rmsd_matrix)
+        if len(npw) <= max_loop:
+            t_old, old_center = timeit(
+                get_cluster_center_loop, list(npw), n_obs, rmsd_matrix)
+            assert old_center == center, "cluster centres differ"
+            loop = f"loop {t_old:10.1f} ms, {t_old / t_new:6.1f}x"
+        else:
+            loop = "loop skipped"
+        print(
+            f"{n_obs:>6} models, centre of {len(npw):>6} members: "
+            f"vectorised {t_new:8.1f} ms, {loop}"
+            )
+
+        cluster_arr = rng.zipf(1.5, n_obs) % (n_obs // 4) + 1
+        t_new, new = timeit(apply_threshold, cluster_arr, 4)
+        t_old, old = timeit(apply_threshold_loop, cluster_arr, 4)
+        assert (old == new).all(), "thresholded clusters differ"
+        print(
+            f"{n_obs:>6} models, threshold: vectorised {t_new:8.1f} ms, "
+            f"loop {t_old:10.1f} ms, {t_old / t_new:6.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument(
+        "-n",
+        "--nmodels",
+        nargs="+",
+        type=int,
+        default=[10000, 20000, 50000],
+        )
+    ap.add_argument(
+        "-s",
+        "--cluster-fraction",
+        type=float,
+        default=0.05,
+        help="Fraction of the models in the cluster.",
+        )
+    ap.add_argument(
+        "--max-loop",
+        type=int,
+        default=2500,
+        help="Largest cluster for which the loop is timed.",
+        )
+    args = ap.parse_args()
+    logging.disable(logging.INFO)
+    main(args.nmodels, args.cluster_fraction, args.max_loop)
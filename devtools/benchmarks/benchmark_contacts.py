@@ -0,0 +1,78 @@
+"""
+Benchmark the KD-tree contact detection against the per-atom cdist loop.
+
+Usage::
+
+    python devtools/benchmarks/benchmark_contacts.py
+    python devtools/benchmarks/benchmark_contacts.py complex.pdb -c 10
+"""
+import argparse
+import time
+from itertools import combinations
+from pathlib import Path
+
+import numpy as np
+from scipy.spatial.distance import cdist
+
+from haddock.libs.libalign import get_atoms, load_coords
+from haddock.modules.analysis.caprieval.capri import load_contacts
+
+
+golden_data = Path(__file__).resolve().parents[2] / "tests" / "golden_data"
+
+
+def load_contacts_cdist(pdb_f, cutoff):
+    """Find contacts one atom at a time, as done before the KD-tree."""
+    coord_dic, _ = load_coords(pdb_f, get_atoms(pdb_f, full=True))
+    coord_arrays, coord_ids = {}, {}
+    for (chain, resnum, _), xyz in coord_dic.items():
+        coord_arrays.setdefault(chain, []).append(xyz)
+        coord_ids.setdefault(chain, []).append(resnum)
+    coord_arrays = {k: np.array(v) for k, v in coord_arrays.items()}
+
+    con_list = []
+    for first, second in combinations(coord_arrays, 2):
+        for s, s_xyz in enumerate(coord_arrays[first]):
+            dist = cdist(s_xyz.reshape(1, 3), coord_arrays[second])
+            for k in np.where(dist < cutoff)[1]:
+                con_list.append(
+                    (first, coord_ids[first][s], second, coord_ids[second][k])
+                    )
+    return set(con_list)
+
+
+def timeit(func, *args, repeats=3):
+    """Return the best time of `func`, in milliseconds, and its result."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return 1000 * best, result
+
+
+def main(pdb_files, cutoff):
+    """Print the time of each contact finder per file."""
+    for pdb_f in pdb_files:
+        t_old, old = timeit(load_contacts_cdist, pdb_f, cutoff)
+        t_new, new = timeit(load_contacts, pdb_f, cutoff)
+        assert old == new, f"contacts differ for {pdb_f}"
+        print(
+            f"{pdb_f.name:>28}: {len(new):6d} contacts, "
+            f"cdist loop {t_old:9.1f} ms, KD-tree {t_new:7.1f} ms, "
+            f"{t_old / t_new:5.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument(
+        "pdb_files",
+        nargs="*",
+        type=Path,
+        default=sorted(golden_data.glob("prot*_complex_1.pdb"))
+        + [golden_data / "protprot_1bkd_1.pdb"],
+        )
+    ap.add_argument("-c", "--cutoff", type=float, default=5.0)
+    args = ap.parse_args()
+    main(args.pdb_files, args.cutoff)
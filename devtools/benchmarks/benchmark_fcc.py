@@ -0,0 +1,100 @@
+"""
+Benchmark the sparse FCC neighbours against the comparison of sets.
+
+Synthetic models draw their contacts from a few interfaces. The comparison
+of the sets of contacts of every pair, as done by ``calc_fcc_matrix``, is only
+timed up to ``--max-loop`` models.
+
+Usage::
+
+    python devtools/benchmarks/benchmark_fcc.py
+    python devtools/benchmarks/benchmark_fcc.py -n 5000 20000 --ncores 4
+"""
+import argparse
+import time
+
+import numpy as np
+
+from haddock.modules.analysis.clustfcc.clustfcc import (
+    contact_matrix,
+    fcc_neighbours,
+    )
+
+
+def make_contacts(nmodels, ninterfaces, rng):
+    """Return the contacts of models drawn from random interfaces."""
+    interfaces = [
+        rng.choice(5000, size=150, replace=False)
+        for _ in range(ninterfaces)
+        ]
+    return [
+        np.unique(rng.choice(
+            interfaces[rng.integers(ninterfaces)],
+            size=rng.integers(30, 120),
+            ))
+        for _ in range(nmodels)
+        ]
+
+
+def fcc_neighbours_loop(contacts, cutoff, strictness):
+    """Compare the sets of contacts of each pair, as done before."""
+    sets = [set(c.tolist()) for c in contacts]
+    found = 0
+    for i in range(len(sets)):
+        for j in range(i + 1, len(sets)):
+            common = len(sets[i] & sets[j])
+            fcc = float(f"{common / len(sets[i]):.2f}")
+            fcc_v = float(f"{common / len(sets[j]):.3f}")
+            found += fcc >= cutoff and fcc_v >= cutoff * strictness
+            found += fcc_v >= cutoff and fcc >= cutoff * strictness
+    return found
+
+
+def timeit(func, *args, **kwargs):
+    """Return the time of `func`, in seconds, and its result."""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main(sizes, ninterfaces, ncores, max_loop):
+    """Print the time of each implementation per number of models."""
+    rng = np.random.default_rng(42)
+    for nmodels in sizes:
+        contacts = make_contacts(nmodels, ninterfaces, rng)
+        t_new, (ref, _) = timeit(
+            lambda: fcc_neighbours(
+                contact_matrix(contacts), 0.6, 0.75, ncores=ncores))
+        line = f"{nmodels:>6} models: sparse {t_new:8.2f} s"
+        if nmodels <= max_loop:
+            t_old, found = timeit(fcc_neighbours_loop, contacts, 0.6, 0.75)
+            assert found == len(ref), "neighbours differ"
+            line += f", sets {t_old:8.2f} s, {t_old / t_new:6.1f}x"
+        print(line)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument(
+        "-n",
+        "--nmodels",
+        nargs="+",
+        type=int,
+        default=[1000, 2000, 5000, 20000],
+        )
+    ap.add_argument(
+        "-i",
+        "--interfaces",
+        type=int,
+        default=10,
+        help="Number of interfaces the contacts are drawn from.",
+        )
+    ap.add_argument("--ncores", type=int, default=1)
+    ap.add_argument(
+        "--max-loop",
+        type=int,
+        default=5000,
+        help="Largest number of models for which the sets are compared.",
+        )
+    args = ap.parse_args()
+    main(args.nmodels, args.interfaces, args.ncores, args.max_loop)
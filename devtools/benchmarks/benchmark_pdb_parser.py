@@ -0,0 +1,69 @@
+"""
+Benchmark the vectorised PDB parser against line-by-line parsing.
+
+Usage::
+
+    python devtools/benchmarks/benchmark_pdb_parser.py
+    python devtools/benchmarks/benchmark_pdb_parser.py m1.pdb m2.pdb -n 20
+"""
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+from haddock.libs.libalign import get_atoms, load_coords, pdb2fastadic
+from haddock.libs.libpdb import parse_atoms
+
+
+golden_data = Path(__file__).resolve().parents[2] / "tests" / "golden_data"
+
+
+def parse_lines(pdb_f):
+    """Parse coordinates line by line, as done before the vectorised parser."""
+    coords = {}
+    with open(pdb_f) as fh:
+        for line in fh.readlines():
+            if line.startswith("ATOM"):
+                identifier = (line[21], int(line[22:26]), line[12:16].strip())
+                coords[identifier] = np.asarray([
+                    float(line[30:38]),
+                    float(line[38:46]),
+                    float(line[46:54]),
+                    ])
+    return coords
+
+
+def timeit(func, pdb_files, repeats):
+    """Return the mean time per file of `func`, in milliseconds."""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for pdb_f in pdb_files:
+            func(pdb_f)
+    return 1000 * (time.perf_counter() - start) / (repeats * len(pdb_files))
+
+
+def main(pdb_files, repeats):
+    """Print the time per file of each parser."""
+    benchmarks = {
+        "line-by-line parsing": parse_lines,
+        "parse_atoms": parse_atoms,
+        "get_atoms": get_atoms,
+        "load_coords": lambda f: load_coords(f, get_atoms(f)),
+        "pdb2fastadic": pdb2fastadic,
+        }
+    for name, func in benchmarks.items():
+        print(f"{name:>22}: {timeit(func, pdb_files, repeats):8.2f} ms/file")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument(
+        "pdb_files",
+        nargs="*",
+        type=Path,
+        default=sorted(golden_data.glob("prot*_complex_*.pdb")),
+        )
+    ap.add_argument("-n", "--repeats", type=int, default=10)
+    args = ap.parse_args()
+    main(args.pdb_files, args.repeats)
@@ -78,9 +78,11 @@ setup(
             'haddock3-copy = haddock.clis.cli_cp:maincli',
             'haddock3-dmn = haddock.clis.cli_dmn:maincli',
             'haddock3-pp = haddock.clis.cli_pp:maincli',
+            'haddock3-registry = haddock.clis.cli_registry:maincli',
             'haddock3-score = haddock.clis.cli_score:maincli',
             'haddock3-unpack = haddock.clis.cli_unpack:maincli',
             'haddock3-analyse = haddock.clis.cli_analyse:maincli',
+            'haddock3-re = haddock.clis.cli_re:maincli',
             ]
         },
     # cmdclass={'build_ext': optional_build_ext},
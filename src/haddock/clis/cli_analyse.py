@@ -15,10 +15,16 @@ USAGE::
 
     haddock3-analyse -r <run_dir> -m <num_modules>
     haddock3-analyse -r run1 -m 1 3
+    haddock3-analyse -r run1 -m 1 3 --ncores 8
 
 
 Where, ``-m 1 3`` means that the analysis will be performed on ``1_rigidbody``
- and ``3_flexref``.
+ and ``3_flexref``. The steps are analysed in parallel, and the cores left
+ render the figures of each step concurrently.
+
+Steps with more models than ``--max-points`` are summarised: the scatter
+ plots draw the number of models in the bins of a grid, and the box plots
+ are drawn from their statistics, without outliers.
 """
 import argparse
 import os
@@ -30,13 +36,18 @@ from haddock import log
 from haddock.gear.yaml2cfg import read_from_yaml_config
 from haddock.libs.libcli import _ParamsToDict
 from haddock.libs.libontology import ModuleIO
+from haddock.libs.libparallel import Scheduler
 from haddock.libs.libplots import (
+    MAX_POINTS,
     box_plot_handler,
     clt_table_handler,
+    load_capri_table,
     read_capri_table,
     report_generator,
     scatter_plot_handler,
     )
+from haddock.libs.libregistry import get_run_registry
+from haddock.libs.libutil import parse_ncores
 from haddock.modules import get_module_steps_folders
 from haddock.modules.analysis.caprieval import \
     DEFAULT_CONFIG as caprieval_params
@@ -52,8 +63,8 @@ def get_cluster_ranking(capri_clt_filename, top_cluster):
 
     Parameters
     ----------
-    capri_clt_filename : str or Path
-        capri cluster filename
+    capri_clt_filename : str, Path or pandas DataFrame
+        capri cluster filename, or its table
     top_cluster : int
         Number of clusters to be considered
 
@@ -63,7 +74,7 @@ def get_cluster_ranking(capri_clt_filename, top_cluster):
         {cluster_id : cluster_rank} dictionary
     """
     cl_ranking = {}
-    dfcl = read_capri_table(capri_clt_filename)
+    dfcl = load_capri_table(capri_clt_filename)
     for n in range(min(top_cluster, dfcl.shape[0])):
         cl_ranking[dfcl["cluster_id"].iloc[n]] = dfcl["caprieval_rank"].iloc[n]
     return cl_ranking
@@ -143,6 +154,29 @@ ap.add_argument(
     default=1.0
     )
 
+ap.add_argument(
+    "-n",
+    "--ncores",
+    help=(
+        "The number of cores used to analyse the steps and render their "
+        "figures. Defaults to the number of CPUs minus one."
+        ),
+    required=False,
+    type=int,
+    default=None,
+    )
+
+ap.add_argument(
+    "--max-points",
+    help=(
+        "The number of models above which the plots summarise the models "
+        f"instead of drawing each of them. Default: {MAX_POINTS}."
+        ),
+    required=False,
+    type=int,
+    default=MAX_POINTS,
+    )
+
 ap.add_argument(
     "-p",
     "--other-params",
@@ -183,6 +217,9 @@ def run_capri_analysis(step, run_dir, capri_dict):
     """
     Run the caprieval analysis.
 
+    Only the models without CAPRI metrics in the registry of the run, for
+    the same references and parameters, are evaluated.
+
     Parameters
     ----------
     step : str
@@ -205,6 +242,10 @@ def run_capri_analysis(step, run_dir, capri_dict):
     caprieval_module.update_params(**capri_dict)
     # update model info
     caprieval_module.previous_io = io
+    # models with the content of models evaluated by the caprieval steps of
+    #  the run, for example those selected by seletop, take their metrics
+    #  from the run registry
+    caprieval_module.cache_registry = get_run_registry(Path(".."))
     # run capri module
     caprieval_module._run()
 
@@ -268,7 +309,7 @@ def update_paths_in_capri_dict(capri_dict, target_path):
     return new_capri_dict
 
 
-def analyse_step(step, run_dir, capri_dict, target_path, top_cluster, format, scale):  # noqa:E501
+def analyse_step(step, run_dir, capri_dict, target_path, top_cluster, format, scale, ncores=1, max_points=MAX_POINTS):  # noqa:E501
     """
     Analyse a step.
 
@@ -291,6 +332,10 @@ def analyse_step(step, run_dir, capri_dict, target_path, top_cluster, format, sc
         Produce images in the selected format.
     scale : int
         scale for images.
+    ncores : int
+        Number of processes rendering the figures.
+    max_points : int
+        Number of models above which the plots summarise the models.
     """
     log.info(f"Analysing step {step}")
 
@@ -315,18 +360,85 @@ def analyse_step(step, run_dir, capri_dict, target_path, top_cluster, format, sc
     ss_file = Path("capri_ss.tsv")
     clt_file = Path("capri_clt.tsv")
     if clt_file.exists():
-        cluster_ranking = get_cluster_ranking(clt_file, top_cluster)
+        # the tables are read once and shared by all the plots
+        clt_df = read_capri_table(clt_file)
+        cluster_ranking = get_cluster_ranking(clt_df, top_cluster)
     else:
         raise Exception(f"clustering file {clt_file} does not exist")
     if ss_file.exists():
         log.info("Plotting results..")
-        scatters = scatter_plot_handler(ss_file, cluster_ranking, format, scale)
-        boxes = box_plot_handler(ss_file, cluster_ranking, format, scale)
-        table = clt_table_handler(clt_file, ss_file)
+        ss_df = read_capri_table(ss_file)
+        scatters = scatter_plot_handler(
+            ss_df,
+            cluster_ranking,
+            format,
+            scale,
+            ncores=ncores,
+            max_points=max_points,
+            )
+        boxes = box_plot_handler(
+            ss_df,
+            cluster_ranking,
+            format,
+            scale,
+            ncores=ncores,
+            max_points=max_points,
+            )
+        table = clt_table_handler(clt_df, ss_df)
         report_generator(boxes, scatters, table, step)
 
 
-def main(run_dir, modules, top_cluster, format, scale, **kwargs):
+class StepAnalysis:
+    """Analyse a step, as a task of :py:class:`libparallel.Scheduler`."""
+
+    def __init__(self, step, run_dir, capri_dict, target_path, top_cluster,
+                 format, scale, ncores=1, max_points=MAX_POINTS):
+        self.step = step
+        self.run_dir = run_dir
+        self.capri_dict = capri_dict
+        self.target_path = target_path
+        self.top_cluster = top_cluster
+        self.format = format
+        self.scale = scale
+        self.ncores = ncores
+        self.max_points = max_points
+        # used by the Scheduler to sort and report the tasks
+        self.output = Path(run_dir, ANA_FOLDER, f"{step}_analysis")
+
+    def run(self):
+        """
+        Analyse the step.
+
+        Returns
+        -------
+        bool
+            Whether the analysis succeeded.
+        """
+        ori_cwd = os.getcwd()
+        try:
+            analyse_step(
+                self.step,
+                self.run_dir,
+                self.capri_dict,
+                self.target_path,
+                self.top_cluster,
+                self.format,
+                self.scale,
+                ncores=self.ncores,
+                max_points=self.max_points,
+                )
+        except Exception as e:
+            log.warning(
+                f"""Could not execute the analysis for step {self.step}.
+                The following error occurred {e}"""
+                )
+            return False
+        finally:
+            os.chdir(ori_cwd)
+        return True
+
+
+def main(run_dir, modules, top_cluster, format, scale, ncores=None, max_points=MAX_POINTS, **kwargs):  # noqa:E501
     """
     Analyse CLI.
 
@@ -346,6 +458,13 @@ def main(run_dir, modules, top_cluster, format, scale, **kwargs):
     
     scale : int
         scale for images.
+
+    ncores : int
+        Number of cores used to analyse the steps and render their figures.
+        If `None`, uses the number of CPUs minus one.
+
+    max_points : int
+        Number of models above which the plots summarise the models.
     """
     log.level = 20
     log.info(f"Running haddock3-analyse on {run_dir}, modules {modules}, "
@@ -357,7 +476,6 @@ def main(run_dir, modules, top_cluster, format, scale, **kwargs):
     
     os.chdir(run_dir)
     # Create analysis folder
-    rundir_cwd = os.getcwd()
     outdir = Path(ANA_FOLDER)
     try:
         outdir.mkdir(exist_ok=False)
@@ -372,7 +490,7 @@ def main(run_dir, modules, top_cluster, format, scale, **kwargs):
     log.info(f"selected steps: {', '.join(selected_steps)}")
 
     # analysis
-    good_folder_paths, bad_folder_paths = [], []
+    steps_to_analyse = []
     for step in selected_steps:
         subfolder_name = f"{step}_analysis"
         target_path = Path(Path("./"), subfolder_name)
@@ -388,29 +506,38 @@ def main(run_dir, modules, top_cluster, format, scale, **kwargs):
                 log.info(f"Removing empty folder {dest_path}.")
                 shutil.rmtree(dest_path)
 
-        # run the analysis
-        error = False
-        try:
-            analyse_step(step,
-                         Path("./"),
-                         capri_dict,
-                         target_path,
-                         top_cluster,
-                         format,
-                         scale)
-        except Exception as e:
-            error = True
-            log.warning(
-                f"""Could not execute the analysis for step {step}.
-                The following error occurred {e}"""
-                )
-        if error:
-            bad_folder_paths.append(target_path)
-        else:
-            good_folder_paths.append(target_path)
-
-        # going back
-        os.chdir(rundir_cwd)
+        steps_to_analyse.append((step, target_path))
+
+    # the steps are analysed in parallel, the cores left over render
+    #  the figures of each step
+    ncores = parse_ncores(ncores)
+    nsteps = max(len(steps_to_analyse), 1)
+    analyses = [
+        StepAnalysis(
+            step,
+            Path("./"),
+            capri_dict,
+            target_path,
+            top_cluster,
+            format,
+            scale,
+            ncores=max(ncores // nsteps, 1),
+            max_points=max_points,
+            )
+        for step, target_path in steps_to_analyse
+        ]
+    good_folder_paths, bad_folder_paths = [], []
+    if analyses:
+        scheduler = Scheduler(analyses, ncores=ncores, collect_results=True)
+        scheduler.run()
+        for (_, target_path), success in zip(
+                steps_to_analyse,
+                scheduler.results,
+                ):
+            if success:
+                good_folder_paths.append(target_path)
+            else:
+                bad_folder_paths.append(target_path)
 
     # moving files into analysis folder
     if good_folder_paths != []:
@@ -0,0 +1,331 @@
+"""
+Apply new parameters to a finished step.
+
+The clustering of a ``clustrmsd`` step is cut again with new parameters,
+reusing the dendrogram saved next to the RMSD matrix. The clusters of a
+``clustfcc`` step are taken for another population threshold from those the
+step found for all the thresholds. ``cluster.out``, the ``.tsv`` and ``.txt``
+outputs of the module and the clusters of the exported models are replaced.
+Parameters not given keep the values of the step. The ``params.cfg`` of the
+step is kept as it ran; the parameters applied are saved in ``params_re.cfg``,
+read back by the next ``haddock3-re`` of the step.
+
+Usage::
+
+    haddock3-re clustrmsd run1/5_clustrmsd --criterion maxclust --tolerance 10
+    haddock3-re clustrmsd run1/5_clustrmsd -c distance -t 7.5 --threshold 4
+    haddock3-re clustfcc run1/4_clustfcc --threshold 2
+"""
+import argparse
+import sys
+
+from haddock.libs import libcli
+
+
+# Command line interface parser
+ap = argparse.ArgumentParser(
+    prog="haddock3-re",
+    description=__doc__,
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+subparsers = ap.add_subparsers(dest="command", required=True)
+
+ap_clustrmsd = subparsers.add_parser(
+    "clustrmsd",
+    help="Cut the dendrogram of a clustrmsd step again.",
+    )
+
+ap_clustrmsd.add_argument(
+    "step_dir",
+    help="The clustrmsd step folder.",
+    type=libcli.arg_folder_exist,
+    )
+
+ap_clustrmsd.add_argument(
+    "-c",
+    "--criterion",
+    help="The criterion used to cut the dendrogram.",
+    choices=["maxclust", "distance"],
+    default=None,
+    )
+
+ap_clustrmsd.add_argument(
+    "-t",
+    "--tolerance",
+    help="The number of clusters (maxclust) or the distance (distance).",
+    type=float,
+    default=None,
+    )
+
+ap_clustrmsd.add_argument(
+    "--threshold",
+    help="The minimum number of models in a cluster.",
+    type=int,
+    default=None,
+    )
+
+ap_clustfcc = subparsers.add_parser(
+    "clustfcc",
+    help="Take the clusters of a clustfcc step for another threshold.",
+    )
+
+ap_clustfcc.add_argument(
+    "step_dir",
+    help="The clustfcc step folder.",
+    type=libcli.arg_folder_exist,
+    )
+
+ap_clustfcc.add_argument(
+    "--threshold",
+    help="The minimum number of models in a cluster.",
+    type=int,
+    required=True,
+    )
+
+libcli.add_version_arg(ap)
+
+RE_PARAMS = "params_re.cfg"
+
+
+def _ap():
+    return ap
+
+
+def load_args(ap):
+    """Load argument parser args."""
+    return ap.parse_args()
+
+
+def cli(ap, main):
+    """Command-line interface entry point."""
+    cmd = load_args(ap)
+    main(**vars(cmd))
+
+
+def maincli():
+    """Execute main client."""
+    cli(ap, main)
+
+
+def main(command, step_dir, **params):
+    """
+    Apply new parameters to a finished step.
+
+    Parameters
+    ----------
+    command : str
+        The module of the step, ``clustrmsd`` or ``clustfcc``.
+
+    step_dir : str or :external:py:class:`pathlib.Path`.
+        The path to the step folder.
+
+    **params
+        The new parameters of the step. `None` values are ignored.
+    """
+    if command == "clustrmsd":
+        return reclustrmsd(step_dir, **params)
+    elif command == "clustfcc":
+        return reclustfcc(step_dir, **params)
+
+
+def _load_step(step_dir, module):
+    """
+    Load the parameters and the input models of a step.
+
+    The parameters are read from :py:data:`RE_PARAMS` if the step was
+    clustered again before, from ``params.cfg`` otherwise.
+
+    Raises
+    ------
+    ValueError
+        If the step is the first of the run, it has no input models.
+
+    Returns
+    -------
+    module_key : str
+        The key of the module in ``params.cfg``.
+    step_params : dict
+        The parameters of the step.
+    previous_io : :py:class:`haddock.libs.libontology.ModuleIO`
+        The outputs of the previous step.
+    """
+    # anti-pattern to speed up CLI initiation
+    from pathlib import Path
+
+    from haddock.gear.config import load as read_config
+    from haddock.libs.libontology import ModuleIO
+    from haddock.modules import get_module_steps_folders
+
+    run_dir = step_dir.parent
+    steps = get_module_steps_folders(run_dir)
+    if steps.index(step_dir.name) == 0:
+        raise ValueError(
+            f"{step_dir.name} is the first step of the run, "
+            "there are no input models to cluster again."
+            )
+    previous = steps[steps.index(step_dir.name) - 1]
+
+    params_f = Path(step_dir, RE_PARAMS)
+    if not params_f.exists():
+        params_f = Path(step_dir, "params.cfg")
+    config = read_config(params_f)
+    module_key = next(k for k in config if k.split(".")[0] == module)
+
+    previous_io = ModuleIO()
+    previous_io.load(Path(run_dir, previous, "io.json"))
+    return module_key, config[module_key], previous_io
+
+
+def _save_step(step_dir, module_key, step_params, output_models, changed):
+    """Save the outputs and the parameters of a step clustered again."""
+    # anti-pattern to speed up CLI initiation
+    from haddock import log
+    from haddock.gear.config import save as save_config
+    from haddock.libs.libio import working_directory
+    from haddock.libs.libontology import ModuleIO
+    from haddock.libs.libregistry import get_run_registry
+
+    with working_directory(step_dir):
+        io = ModuleIO()
+        io.add(output_models, "o")
+        io.save()
+        save_config({module_key: step_params}, RE_PARAMS)
+
+    run_dir = step_dir.parent
+    registry = get_run_registry(run_dir)
+    if registry is not None:
+        step_idx = int(step_dir.name.split("_")[0])
+        registry.register_models(
+            step_idx,
+            module_key.split(".")[0],
+            output_models,
+            )
+
+    log.info(f"{step_dir.name} clustered again with {changed}")
+    log.warning(
+        "Steps after the reclustered step used the previous clusters, "
+        "run them again if needed."
+        )
+
+
+def reclustrmsd(step_dir, criterion=None, tolerance=None, threshold=None):
+    """
+    Cut the dendrogram of a clustrmsd step with new parameters.
+
+    Parameters
+    ----------
+    step_dir : str or :external:py:class:`pathlib.Path`.
+        The path to the clustrmsd step folder.
+
+    criterion : str, optional
+        The criterion used to cut the dendrogram.
+
+    tolerance : float, optional
+        The number of clusters or the distance.
+
+    threshold : int, optional
+        The minimum number of models in a cluster.
+    """
+    # anti-pattern to speed up CLI initiation
+    from pathlib import Path
+
+    from haddock.libs.libio import working_directory
+    from haddock.libs.libontology import ModuleIO
+    from haddock.modules.analysis.clustrmsd.clustrmsd import (
+        cluster_models,
+        get_tolerance,
+        load_linkage,
+        read_matrix,
+        )
+
+    step_dir = Path(step_dir).resolve()
+    module_key, step_params, previous_io = _load_step(step_dir, "clustrmsd")
+    new_params = {
+        "criterion": criterion,
+        "tolerance": tolerance,
+        "threshold": threshold,
+        }
+    step_params.update({k: v for k, v in new_params.items() if v is not None})
+    if criterion is not None and tolerance is None:
+        # the tolerance of the step does not apply to another criterion
+        step_params["tolerance"] = float("nan")
+
+    models = previous_io.retrieve_models()
+    matrix_io = ModuleIO()
+    matrix_io.load(Path(step_dir, "rmsd_matrix.json"))
+    rmsd_file = matrix_io.input[0]
+
+    with working_directory(step_dir):
+        rmsd_matrix = read_matrix(rmsd_file)
+        dendrogram = load_linkage(
+            rmsd_file,
+            step_params["linkage"],
+            rmsd_matrix,
+            )
+        # saves the tolerance calculated for a new criterion, not NaN
+        tolerance = get_tolerance(
+            float(step_params["tolerance"]),
+            step_params["criterion"],
+            dendrogram,
+            len(models),
+            )
+        step_params["tolerance"] = float(tolerance)
+        output_models = cluster_models(
+            models,
+            dendrogram,
+            rmsd_matrix,
+            step_params["linkage"],
+            step_params["criterion"],
+            step_params["tolerance"],
+            int(step_params["threshold"]),
+            )
+    _save_step(step_dir, module_key, step_params, output_models, new_params)
+
+
+def reclustfcc(step_dir, threshold):
+    """
+    Take the clusters of a clustfcc step for another threshold.
+
+    Parameters
+    ----------
+    step_dir : str or :external:py:class:`pathlib.Path`.
+        The path to the clustfcc step folder.
+
+    threshold : int
+        The minimum number of models in a cluster.
+    """
+    # anti-pattern to speed up CLI initiation
+    from pathlib import Path
+
+    from haddock.libs.libio import working_directory
+    from haddock.modules.analysis.clustfcc.clustfcc import (
+        find_threshold,
+        get_clusters,
+        load_sweep,
+        write_clusters,
+        )
+
+    step_dir = Path(step_dir).resolve()
+    module_key, step_params, previous_io = _load_step(step_dir, "clustfcc")
+    models = previous_io.retrieve_models(individualize=True)
+
+    with working_directory(step_dir):
+        sweep = load_sweep()
+        step_params["threshold"] = find_threshold(sweep[1], threshold)
+        output_models = write_clusters(
+            models,
+            get_clusters(*sweep, step_params["threshold"]),
+            step_params,
+            )
+    _save_step(
+        step_dir,
+        module_key,
+        step_params,
+        output_models,
+        {"threshold": threshold},
+        )
+
+
+if __name__ == "__main__":
+    sys.exit(maincli())
@@ -0,0 +1,180 @@
+"""
+Query the registry of models of a run.
+
+The registry of models is populated while the workflow runs and keeps,
+for each step, the exported models with their scores, energies, cluster
+assignments and CAPRI metrics. Filters are given as ``<column><op><value>``
+expressions, where ``<op>`` is one of ``<``, ``<=``, ``>``, ``>=``, ``=`` or
+``!=``. Energy terms can be used as columns.
+
+Usage::
+
+    haddock3-registry run1 --steps
+    haddock3-registry run1 -s 7 -n 200
+    haddock3-registry run1 -s 7 -n 200 -f "irmsd<4"
+    haddock3-registry run1 -s 7 --sortby dockq --descending -f "fnat>=0.3"
+"""
+import argparse
+import os
+import sys
+
+from haddock.libs import libcli
+
+
+# Command line interface parser
+ap = argparse.ArgumentParser(
+    prog="haddock3-registry",
+    description=__doc__,
+    formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+
+libcli.add_rundir_arg(ap)
+
+ap.add_argument(
+    "-s",
+    "--step",
+    help="The number of the step to query. Queries all steps if not given.",
+    type=int,
+    default=None,
+    )
+
+ap.add_argument(
+    "-n",
+    "--top",
+    help="The maximum number of models to show.",
+    type=int,
+    default=None,
+    )
+
+ap.add_argument(
+    "-f",
+    "--filters",
+    help="Filter expressions, for example: -f 'irmsd<4' 'fnat>=0.3'.",
+    nargs="+",
+    default=[],
+    )
+
+ap.add_argument(
+    "--sortby",
+    help="The column used to sort the models.",
+    default="score",
+    )
+
+ap.add_argument(
+    "--descending",
+    help="Sort in descending order.",
+    action="store_true",
+    )
+
+ap.add_argument(
+    "--steps",
+    dest="list_steps",
+    help="List the registered steps and exit.",
+    action="store_true",
+    )
+
+libcli.add_version_arg(ap)
+
+
+def _ap():
+    return ap
+
+
+def load_args(ap):
+    """Load argument parser args."""
+    return ap.parse_args()
+
+
+def cli(ap, main):
+    """Command-line interface entry point."""
+    cmd = load_args(ap)
+    main(**vars(cmd))
+
+
+def maincli():
+    """Execute main client."""
+    cli(ap, main)
+
+
+def main(
+        run_dir,
+        step=None,
+        top=None,
+        filters=None,
+        sortby="score",
+        descending=False,
+        list_steps=False,
+        ):
+    """
+    Query the registry of models of a run.
+
+    The result is written to the standard output as a tab-separated table.
+
+    Parameters
+    ----------
+    run_dir : str or :external:py:class:`pathlib.Path`.
+        The path to the run directory.
+
+    step : int, optional
+        The number of the step to query.
+
+    top : int, optional
+        The maximum number of models to show.
+
+    filters : list of str, optional
+        Filter expressions.
+
+    sortby : str
+        The column used to sort the models.
+
+    descending : bool
+        Whether to sort in descending order.
+
+    list_steps : bool
+        List the registered steps instead of the models.
+    """
+    # anti-pattern to speed up CLI initiation
+    from pathlib import Path
+
+    from haddock import log
+    from haddock.core.defaults import MODEL_REGISTRY_FILE
+    from haddock.libs.libregistry import ModelRegistry, RegistryError
+
+    db_path = Path(run_dir, MODEL_REGISTRY_FILE)
+    if not db_path.exists():
+        log.error(f"No registry of models found in {str(run_dir)!r}.")
+        return 1
+
+    registry = ModelRegistry(db_path)
+
+    if list_steps:
+        for step_idx, step_name in registry.steps():
+            print(f"{step_idx}\t{step_name}")
+        return
+
+    try:
+        rows = registry.query(
+            step=step,
+            filters=filters,
+            sortby=sortby,
+            ascending=not descending,
+            limit=top,
+            )
+    except RegistryError as err:
+        log.error(err)
+        return 1
+
+    if not rows:
+        log.warning("No models match the query.")
+        return
+
+    header = list(rows[0].keys())
+    lines = ["\t".join(header)]
+    for row in rows:
+        lines.append("\t".join(
+            "-" if row[k] is None else str(row[k]) for k in header))
+    print(os.linesep.join(lines))
+
+
+if __name__ == "__main__":
+    sys.exit(maincli())
@@ -25,6 +25,12 @@ MODULE_PATH_NAME = "step_"
 # Default name for exchange module information file
 MODULE_IO_FILE = "io.json"
 
+# Default name for the run-wide registry of models
+MODEL_REGISTRY_FILE = "registry.db"
+
+# Default folder of the run-wide coordinate store
+COORDINATE_STORE_DIR = "coordinates"
+
 # Temptative number of max allowed number of modules to execute
 MAX_NUM_MODULES = 10000
 
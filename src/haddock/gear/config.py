@@ -234,7 +234,10 @@ def convert_variables_to_paths(cfg):
             cfg[param] = [convert_to_path(v) for v in transform_to_list(value)]
 
         elif match_path_criteria(param):
-            cfg[param] = convert_to_path(value)
+            if isinstance(value, (list, tuple)):
+                cfg[param] = [convert_to_path(v) for v in value]
+            else:
+                cfg[param] = convert_to_path(value)
 
         elif isinstance(value, collections.abc.Mapping):
             cfg[param] = convert_variables_to_paths(value)
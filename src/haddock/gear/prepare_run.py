@@ -553,28 +553,72 @@ def copy_input_files_to_data_dir(data_dir, modules_params, start=0):
 
     start : int, default to 0
         The starting number of the step folders prefix.
+
+    Notes
+    -----
+    The files of a list are copied as ``ref<n>_<name>``, ``n`` being their
+    position in the list starting at 1, so that files with the same name
+    in different folders do not overwrite each other.
     """
-    rel_data_dir = data_dir.name
     for i, (module, params) in enumerate(modules_params.items(), start=start):
         end_path = Path(zero_fill.fill(get_module_name(module), i))
         for parameter, value in params.items():
             if parameter.endswith('_fname'):
-                if value:
-                    name = Path(value).name
-                    # path is created here to avoid creating empty folders
-                    # for those modules without '_fname' parameters
-                    pf = Path(data_dir, end_path)
-                    pf.mkdir(exist_ok=True)
-                    check_if_path_exists(value)
-                    target_path = Path(pf, name)
-                    shutil.copy(value, target_path)
-                    _p = Path(rel_data_dir, end_path, name)
-                    modules_params[module][parameter] = _p
-                    # account for input .tgz files
-                    if name.endswith("tgz"):
-                        log.info(f"Uncompressing tar {value}")
-                        with tarfile.open(target_path) as fin:
-                            fin.extractall(pf)
+                if isinstance(value, (list, tuple)):
+                    modules_params[module][parameter] = [
+                        copy_input_file(
+                            v,
+                            data_dir,
+                            end_path,
+                            name=f"ref{n}_{Path(v).name}",
+                            )
+                        for n, v in enumerate(value, start=1)
+                        ]
+                elif value:
+                    modules_params[module][parameter] = copy_input_file(
+                        value,
+                        data_dir,
+                        end_path,
+                        )
+
+
+def copy_input_file(value, data_dir, end_path, name=None):
+    """
+    Copy an input file to the data directory.
+
+    Parameters
+    ----------
+    value : str or Path
+        The input file.
+
+    data_dir : Path
+        The data/ directory inside the run directory.
+
+    end_path : Path
+        The folder of the step in the data/ directory.
+
+    name : str, optional
+        The name of the copy. Defaults to the name of the input file.
+
+    Returns
+    -------
+    Path
+        The path of the copy, relative to the run directory.
+    """
+    name = name or Path(value).name
+    # path is created here to avoid creating empty folders
+    # for those modules without '_fname' parameters
+    pf = Path(data_dir, end_path)
+    pf.mkdir(exist_ok=True)
+    check_if_path_exists(value)
+    target_path = Path(pf, name)
+    shutil.copy(value, target_path)
+    # account for input .tgz files
+    if name.endswith("tgz"):
+        log.info(f"Uncompressing tar {value}")
+        with tarfile.open(target_path) as fin:
+            fin.extractall(pf)
+    return Path(data_dir.name, end_path, name)
 
 
 def check_run_dir_exists(run_dir):
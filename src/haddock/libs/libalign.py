@@ -6,17 +6,26 @@ Main functions
 --------------
 
 * :py:func:`calc_rmsd`
+* :py:func:`batch_rmsd`
+* :py:func:`batch_kabsch`
 * :py:func:`centroid`
 * :py:func:`kabsch`
 * :py:func:`load_coords`
+* :py:func:`load_coords_stack`
+* :py:func:`select_atoms`
 * :py:func:`pdb2fastadic`
 * :py:func:`get_atoms`
 * :py:func:`get_align`
 * :py:func:`align_struct`
+* :py:func:`structural_alignment`
 * :py:func:`align_seq`
+* :py:func:`identity_numbering`
+* :py:func:`numbering_key`
 * :py:func:`make_range`
 * :py:func:`dump_as_izone`
 """
+import hashlib
+import json
 import os
 import shlex
 import subprocess
@@ -29,6 +38,7 @@ from Bio.Align import substitution_matrices
 from Bio.Seq import Seq
 
 from haddock import log
+from haddock.libs.libcoords import load_atoms
 from haddock.libs.libio import pdb_path_exists
 from haddock.libs.libontology import PDBFile
 from haddock.libs.libpdb import split_by_chain
@@ -131,6 +141,9 @@ RNA_FULL_DICT = {
           "O2'", "C1'", "N1", "C2", "O2", "N3", "C4", "O4", "C5", "C6"]
     }
 
+# one atom per residue used in the structural alignment
+TRACE_ATOMS = ["CA", "C4'"]
+
 
 class ALIGNError(Exception):
     """Raised when something goes wrong with the ALIGNMENT library."""
@@ -204,7 +217,126 @@ def centroid(X):
     return C
 
 
-def load_coords(pdb_f, atoms, filter_resdic=None, numbering_dic=None):
+def batch_kabsch(P, Q):
+    """
+    Find the rotation matrices of many pairs using the Kabsch algorithm.
+
+    The same convention as :py:func:`kabsch` is used: ``P @ U``
+    superposes `P` on `Q`. Both sets of coordinates must be centered.
+
+    Parameters
+    ----------
+    P : np.array dtype=float, shape=(..., n_atoms, 3)
+    Q : np.array dtype=float, shape=(..., n_atoms, 3)
+        The leading dimensions are broadcast, so one reference can be
+        given for a stack of models.
+
+    Returns
+    -------
+    U : np.array dtype=float, shape=(..., 3, 3)
+    """
+    P = np.asarray(P)
+    Q = np.asarray(Q)
+    C = np.matmul(np.swapaxes(P, -1, -2), Q)
+    V, _, W = np.linalg.svd(C)
+    d = (np.linalg.det(V) * np.linalg.det(W)) < 0.0
+    V[..., -1] = np.where(d[..., np.newaxis], -V[..., -1], V[..., -1])
+    return np.matmul(V, W)
+
+
+def batch_rmsd(P, Q, superpose=True, dtype=np.float64):
+    """
+    Calculate the RMSD of many pairs of structures.
+
+    With `superpose`, each pair is centered and optimally superposed
+    before the RMSD is calculated. The RMSD after superposition is
+    obtained from the singular values of the covariance matrices, so the
+    rotated coordinates are never built.
+
+    Parameters
+    ----------
+    P : np.array dtype=float, shape=(..., n_atoms, 3)
+    Q : np.array dtype=float, shape=(..., n_atoms, 3)
+        The leading dimensions are broadcast, so one reference can be
+        given for a stack of models.
+
+    superpose : bool
+        Whether to superpose the structures. If `False` the coordinates are
+        compared as given, like :py:func:`calc_rmsd`.
+
+    dtype : np.dtype
+        The precision of the calculation. `np.float32` halves the memory
+        and is accurate to about 1e-3 Angstrom.
+
+    Returns
+    -------
+    rmsd : np.array dtype=float, shape=(...)
+    """
+    P = np.asarray(P, dtype=dtype)
+    Q = np.asarray(Q, dtype=dtype)
+    n_atoms = P.shape[-2]
+    if not superpose:
+        diff = P - Q
+        return np.sqrt((diff * diff).sum(axis=(-2, -1)) / n_atoms)
+
+    P = P - P.mean(axis=-2, keepdims=True)
+    Q = Q - Q.mean(axis=-2, keepdims=True)
+    C = np.matmul(np.swapaxes(P, -1, -2), Q)
+    S = np.linalg.svd(C, compute_uv=False)
+    # a reflection is corrected by inverting the smallest singular value
+    S[..., -1] *= np.sign(np.linalg.det(C))
+    e0 = (P * P).sum(axis=(-2, -1)) + (Q * Q).sum(axis=(-2, -1))
+    msd = (e0 - 2 * S.sum(axis=-1)) / n_atoms
+    return np.sqrt(np.maximum(msd, 0))
+
+
+def select_atoms(pdb_atoms, atoms):
+    """
+    Select the atoms considered by :py:func:`load_coords`.
+
+    ``HETATM`` records, residues in ``RES_TO_BE_IGNORED`` and atoms not
+    listed in `atoms` for their residue are not selected.
+
+    Parameters
+    ----------
+    pdb_atoms : np.ndarray
+        Atom identity array, see :py:func:`haddock.libs.libpdb.parse_atoms`.
+
+    atoms : dict
+        dictionary of atoms, as returned by :py:func:`get_atoms`
+
+    Returns
+    -------
+    np.ndarray
+        Boolean mask of the selected atoms.
+    """
+    keep = ~pdb_atoms["hetatm"] & ~np.isin(
+        pdb_atoms["resname"],
+        list(RES_TO_BE_IGNORED),
+        )
+    # check each distinct residue/atom name pair once
+    pairs = np.char.add(
+        np.char.add(pdb_atoms["resname"], " "),
+        pdb_atoms["name"],
+        )
+    unique_pairs, inverse = np.unique(pairs, return_inverse=True)
+    allowed = np.array(
+        [
+            name in atoms.get(resname, ())
+            for resname, name in (p.split(" ") for p in unique_pairs.tolist())
+            ],
+        dtype=bool,
+        )
+    return keep & allowed[inverse.ravel()]
+
+
+def load_coords(
+        pdb_f,
+        atoms,
+        filter_resdic=None,
+        numbering_dic=None,
+        parsed=None,
+        ):
     """
     Load coordinates from PDB.
 
@@ -221,6 +353,10 @@ def load_coords(pdb_f, atoms, filter_resdic=None, numbering_dic=None):
     numbering_dic : dict
         dict of numbering dictionaries (one dictionary per chain)
 
+    parsed : tuple, optional
+        The atoms and coordinates of `pdb_f`, as returned by
+        :py:func:`haddock.libs.libcoords.load_atoms`, if already loaded.
+
     Returns
     -------
     coord_dic : dict
@@ -234,50 +370,36 @@ def load_coords(pdb_f, atoms, filter_resdic=None, numbering_dic=None):
     idx = 0
     if isinstance(pdb_f, PDBFile):
         pdb_f = pdb_f.rel_path
-    with open(pdb_f, "r") as fh:
-        for line in fh.readlines():
-            if line.startswith("ATOM"):
-                atom_name = line[12:16].strip()
-                resname = line[17:20].strip()
-                if resname in RES_TO_BE_IGNORED:
-                    continue
-                chain = line[21]
-                resnum = int(line[22:26])
-                x = float(line[30:38])
-                y = float(line[38:46])
-                z = float(line[46:54])
-                coords = np.asarray([x, y, z])
-                if numbering_dic:
-                    try:
-                        resnum = numbering_dic[chain][resnum]
-                    except KeyError:
-                        # this residue is not matched, and so it should
-                        #  not be considered
-                        # self.log(
-                        #     f"WARNING: {chain}.{resnum}.{atom_name}"
-                        #     " was not matched!"
-                        #     )
-                        continue
-                # identifier = f"{chain}.{resnum}.{atom_name}"
-                identifier = (chain, resnum, atom_name)
-                if atom_name not in atoms[resname]:
-                    continue
-                if chain not in chain_dic:
-                    chain_dic[chain] = []
-                if filter_resdic:
-                    # Only retrieve coordinates from the filter_resdic
-                    if (
-                            chain in filter_resdic
-                            and resnum in filter_resdic[chain]
-                            ):
-                        coord_dic[identifier] = coords
-                        chain_dic[chain].append(idx)
-                        idx += 1
-                else:
-                    # retrieve everything
-                    coord_dic[identifier] = coords
-                    chain_dic[chain].append(idx)
-                    idx += 1
+    pdb_atoms, pdb_xyz = parsed if parsed is not None else load_atoms(pdb_f)
+    selected = np.flatnonzero(select_atoms(pdb_atoms, atoms))
+    records = zip(
+        pdb_atoms["chain"][selected].tolist(),
+        pdb_atoms["resnum"][selected].tolist(),
+        pdb_atoms["name"][selected].tolist(),
+        np.asarray(pdb_xyz[selected], dtype=np.float64),
+        )
+    for chain, resnum, atom_name, coords in records:
+        if numbering_dic:
+            try:
+                resnum = numbering_dic[chain][resnum]
+            except KeyError:
+                # this residue is not matched, and so it should
+                #  not be considered
+                continue
+        identifier = (chain, resnum, atom_name)
+        if chain not in chain_dic:
+            chain_dic[chain] = []
+        if filter_resdic:
+            # Only retrieve coordinates from the filter_resdic
+            if chain in filter_resdic and resnum in filter_resdic[chain]:
+                coord_dic[identifier] = coords
+                chain_dic[chain].append(idx)
+                idx += 1
+        else:
+            # retrieve everything
+            coord_dic[identifier] = coords
+            chain_dic[chain].append(idx)
+            idx += 1
     chain_ranges = {}
     for chain in chain_dic:
         if not chain_dic[chain]:
@@ -291,6 +413,54 @@ def load_coords(pdb_f, atoms, filter_resdic=None, numbering_dic=None):
     return coord_dic, chain_ranges
 
 
+def load_coords_stack(models, atoms, filter_resdic=None, dtype=np.float32):
+    """
+    Load the coordinates of several models in a single array.
+
+    Each model is read once. The atoms are the union of the atoms of all
+    models, in order of appearance, and a mask tells which atoms each
+    model actually has.
+
+    Parameters
+    ----------
+    models : list
+        List of :py:class:`haddock.libs.libontology.PDBFile` or paths.
+
+    atoms : dict
+        dictionary of atoms
+
+    filter_resdic : dict
+        dictionary of residues to be loaded (one list per chain)
+
+    dtype : np.dtype
+        The type of the coordinates array.
+
+    Returns
+    -------
+    keys : list
+        The (chain, resnum, atom name) identifier of each atom.
+
+    xyz : np.ndarray
+        The coordinates, shape (n_models, n_atoms, 3). Missing atoms are
+        set to zero.
+
+    mask : np.ndarray
+        Whether each model has each atom, shape (n_models, n_atoms).
+    """
+    coord_dics = [load_coords(m, atoms, filter_resdic)[0] for m in models]
+    keys = list(dict.fromkeys(k for dic in coord_dics for k in dic))
+    index = {key: i for i, key in enumerate(keys)}
+    xyz = np.zeros((len(models), len(keys), 3), dtype=dtype)
+    mask = np.zeros((len(models), len(keys)), dtype=bool)
+    for n, coord_dic in enumerate(coord_dics):
+        if not coord_dic:
+            continue
+        idx = [index[key] for key in coord_dic]
+        xyz[n, idx] = list(coord_dic.values())
+        mask[n, idx] = True
+    return keys, xyz, mask
+
+
 def get_atoms(pdb, full=False):
     """
     Identify what is the molecule type of each PDB.
@@ -321,31 +491,32 @@ def get_atoms(pdb, full=False):
     if not exists:
         raise Exception(msg)
 
-    with open(pdb) as fh:
-        for line in fh.readlines():
-            if line.startswith(("ATOM", "HETATM")):
-                resname = line[17:20].strip()
-                atom_name = line[12:16].strip()
-                element = line[76:78].strip()
-                if (
-                        resname not in PROT_RES
-                        and resname not in DNA_RES
-                        and resname not in RNA_RES
-                        and resname not in RES_TO_BE_IGNORED
-                        ):
-                    # its neither DNA/RNA nor protein, use the heavy atoms
-                    # WARNING: Atoms that belong to unknown residues must
-                    #  be bound to a residue name;
-                    #   For example: residue NEP, also contains
-                    #  CB and CG atoms, if we do not bind it to the
-                    #  residue name, the next functions will include
-                    #  CG and CG atoms in the calculations for all
-                    #  other residue names
-                    if element != "H":
-                        if resname not in atom_dic:
-                            atom_dic[resname] = []
-                        if atom_name not in atom_dic[resname]:
-                            atom_dic[resname].append(atom_name)
+    pdb_atoms, _ = load_atoms(pdb)
+    records = zip(
+        pdb_atoms["resname"].tolist(),
+        pdb_atoms["name"].tolist(),
+        pdb_atoms["element"].tolist(),
+        )
+    for resname, atom_name, element in records:
+        if (
+                resname not in PROT_RES
+                and resname not in DNA_RES
+                and resname not in RNA_RES
+                and resname not in RES_TO_BE_IGNORED
+                ):
+            # its neither DNA/RNA nor protein, use the heavy atoms
+            # WARNING: Atoms that belong to unknown residues must
+            #  be bound to a residue name;
+            #   For example: residue NEP, also contains
+            #  CB and CG atoms, if we do not bind it to the
+            #  residue name, the next functions will include
+            #  CG and CG atoms in the calculations for all
+            #  other residue names
+            if element != "H":
+                if resname not in atom_dic:
+                    atom_dic[resname] = []
+                if atom_name not in atom_dic[resname]:
+                    atom_dic[resname].append(atom_name)
     return atom_dic
 
 
@@ -395,21 +566,25 @@ def pdb2fastadic(pdb_f):
     if isinstance(pdb_f, PDBFile):
         pdb_f = pdb_f.rel_path
 
-    with open(pdb_f) as fh:
-        for line in fh.readlines():
-            if line.startswith("ATOM"):
-                res_num = int(line[22:26])
-                res_name = line[17:20].strip()
-                chain = line[21]
-                if res_name in RES_TO_BE_IGNORED:
-                    continue
-                try:
-                    one_letter = res_codes[res_name]
-                except KeyError:
-                    one_letter = "X"
-                if chain not in seq_dic:
-                    seq_dic[chain] = {}
-                seq_dic[chain][res_num] = one_letter
+    pdb_atoms, _ = load_atoms(pdb_f)
+    pdb_atoms = pdb_atoms[
+        ~pdb_atoms["hetatm"]
+        & ~np.isin(pdb_atoms["resname"], list(RES_TO_BE_IGNORED))
+        ]
+    chains = pdb_atoms["chain"]
+    resnums = pdb_atoms["resnum"]
+    # first atom of each residue
+    first = np.ones(len(pdb_atoms), dtype=bool)
+    first[1:] = (chains[1:] != chains[:-1]) | (resnums[1:] != resnums[:-1])
+    residues = zip(
+        chains[first].tolist(),
+        resnums[first].tolist(),
+        pdb_atoms["resname"][first].tolist(),
+        )
+    for chain, res_num, res_name in residues:
+        if chain not in seq_dic:
+            seq_dic[chain] = {}
+        seq_dic[chain][res_num] = res_codes.get(res_name, "X")
     return seq_dic
 
 
@@ -451,6 +626,10 @@ def align_strct(reference, model, output_path, lovoalign_exec=None):
     """
     Structuraly align and get numbering relationship.
 
+    The chains are aligned in-process with :py:func:`structural_alignment`.
+    If `lovoalign_exec` is given, the external LovoAlign program is used
+    instead.
+
     Parameters
     ----------
     reference : :py:class:`haddock.libs.libontology.PDBFile`
@@ -459,7 +638,7 @@ def align_strct(reference, model, output_path, lovoalign_exec=None):
 
     output_path : Path
 
-    lovoalign_exec : Path
+    lovoalign_exec : Path, optional
         lovoalign executable
 
     Returns
@@ -467,16 +646,291 @@ def align_strct(reference, model, output_path, lovoalign_exec=None):
     numbering_dic : dict
         dict of numbering dictionaries (one dictionary per chain)
     """
-    if lovoalign_exec is None:
-        log.error(
-            "Structural alignment needs LovoAlign "
-            "get it at github.com/m3g/lovoalign"
+    if lovoalign_exec:
+        return align_lovoalign(reference, model, output_path, lovoalign_exec)
+
+    seqdic_ref = pdb2fastadic(reference)
+    seqdic_model = pdb2fastadic(model)
+    ref_traces = get_traces(reference)
+    model_traces = get_traces(model)
+
+    numbering_dic = {}
+    # check if chain ids match
+    if seqdic_ref.keys() != seqdic_model.keys():
+        return numbering_dic
+
+    aln_lines = []
+    for chain in seqdic_ref:
+        ref_res, ref_xyz = ref_traces.get(chain, ([], np.empty((0, 3))))
+        model_res, model_xyz = model_traces.get(chain, ([], np.empty((0, 3))))
+        if min(len(ref_res), len(model_res)) < 3:
+            # ligands and very short chains are matched sequentially
+            log.warning(
+                f"Chain {chain} cannot be structurally aligned, "
+                "used sequential matching"
+                )
+            numbering_dic[chain] = {res: res for res in seqdic_ref[chain]}
+            continue
+
+        ref_seq = "".join(seqdic_ref[chain][r] for r in ref_res)
+        model_seq = "".join(seqdic_model[chain][r] for r in model_res)
+        pairs = structural_alignment(
+            ref_xyz,
+            model_xyz,
+            initial_pairs=_sequence_pairs(ref_seq, model_seq),
             )
-        raise ALIGNError("Path to LovoAlign executable required.")
 
-    if not lovoalign_exec:
-        raise ALIGNError("lovoalign_exec parameter not defined ")
+        identical = sum(ref_seq[i] == model_seq[j] for i, j in pairs)
+        identity = identical / min(len(ref_seq), len(model_seq)) * 100
+        if identity <= 40.0:
+            log.warning(
+                f"\"Structural\" identity of chain {chain} is {identity:.2f}%,"
+                " please check the results carefully"
+                )
+        else:
+            log.info(
+                f"\"Structural\" identity of chain {chain} is {identity:.2f}%"
+                )
+
+        numbering_dic[chain] = {
+            model_res[j]: ref_res[i] for i, j in pairs
+            }
+        aln_lines.extend(_format_alignment(chain, ref_seq, model_seq, pairs))
 
+    aln_fname = Path(output_path, "structure.aln")
+    log.debug(f"Writing alignment to {aln_fname.name}")
+    with open(aln_fname, "w") as fh:
+        fh.write(os.linesep.join(aln_lines))
+
+    izone_fname = Path(output_path, "structure.izone")
+    log.debug(f"Saving .izone to {izone_fname.name}")
+    dump_as_izone(izone_fname, numbering_dic)
+
+    return numbering_dic
+
+
+def get_traces(pdb_f):
+    """
+    Get the trace of each chain: one atom per residue.
+
+    The trace atom is ``CA`` for amino acids and ``C4'`` for nucleotides.
+
+    Parameters
+    ----------
+    pdb_f : PosixPath or :py:class:`haddock.libs.libontology.PDBFile`
+
+    Returns
+    -------
+    traces : dict
+        The residue numbers and the trace coordinates of each chain.
+    """
+    if isinstance(pdb_f, PDBFile):
+        pdb_f = pdb_f.rel_path
+    pdb_atoms, pdb_xyz = load_atoms(pdb_f)
+    trace = ~pdb_atoms["hetatm"] & np.isin(pdb_atoms["name"], TRACE_ATOMS)
+    chains = pdb_atoms["chain"][trace]
+    resnums = pdb_atoms["resnum"][trace]
+    xyz = np.asarray(pdb_xyz[trace], dtype=np.float64)
+
+    traces = {}
+    for chain in dict.fromkeys(chains.tolist()):
+        idx = np.flatnonzero(chains == chain)
+        # first trace atom of each residue
+        _, first = np.unique(resnums[idx], return_index=True)
+        idx = idx[np.sort(first)]
+        traces[chain] = (resnums[idx].tolist(), xyz[idx])
+    return traces
+
+
+def _sequence_pairs(ref_seq, model_seq):
+    """Get the positions matched by a BLOSUM62 sequence alignment."""
+    aligner = Align.PairwiseAligner()
+    aligner.substitution_matrix = substitution_matrices.load("BLOSUM62")
+    top_aln = aligner.align(Seq(ref_seq), Seq(model_seq))[0]
+    pairs = []
+    for (ref_start, ref_end), (mod_start, mod_end) in zip(*top_aln.aligned):
+        pairs.extend(zip(range(ref_start, ref_end), range(mod_start, mod_end)))
+    return pairs
+
+
+def _format_alignment(chain, ref_seq, model_seq, pairs):
+    """Format an alignment as reference, match and model lines."""
+    ref_line, match_line, model_line = [], [], []
+    last_i, last_j = -1, -1
+    for i, j in list(pairs) + [(len(ref_seq), len(model_seq))]:
+        gap_ref = ref_seq[last_i + 1:i]
+        gap_model = model_seq[last_j + 1:j]
+        ref_line.append(gap_ref + "-" * len(gap_model))
+        model_line.append("-" * len(gap_ref) + gap_model)
+        match_line.append(" " * (len(gap_ref) + len(gap_model)))
+        if i < len(ref_seq):
+            ref_line.append(ref_seq[i])
+            model_line.append(model_seq[j])
+            match_line.append("|" if ref_seq[i] == model_seq[j] else ".")
+        last_i, last_j = i, j
+    return [
+        f"chain {chain}",
+        "".join(ref_line),
+        "".join(match_line),
+        "".join(model_line),
+        "",
+        ]
+
+
+def _dp_alignment(score, gap):
+    """
+    Align two sequences given a position score matrix.
+
+    Global alignment with a linear gap penalty and free end gaps. Each row
+    of the dynamic programming matrix is computed at once.
+
+    Parameters
+    ----------
+    score : np.ndarray
+        Score of matching each position of the first sequence (rows) with
+        each position of the second (columns).
+
+    gap : float
+        Penalty of each gap position.
+
+    Returns
+    -------
+    pairs : list of tuples
+        The matched positions.
+    """
+    n, m = score.shape
+    H = np.zeros((n + 1, m + 1))
+    # 0: diagonal, 1: up, 2: left
+    moves = np.zeros((n + 1, m + 1), dtype=np.int8)
+    moves[1:, 0] = 1
+    moves[0, 1:] = 2
+    cols = np.arange(1, m + 1) * gap
+    for i in range(1, n + 1):
+        diag = H[i - 1, :-1] + score[i - 1]
+        up = H[i - 1, 1:] - gap
+        best = np.maximum(diag, up)
+        # the left moves are a running maximum along the row
+        left = np.maximum.accumulate(
+            np.concatenate(([H[i, 0]], best)) + np.concatenate(([0], cols))
+            )[1:] - cols
+        left_prev = np.concatenate(([H[i, 0]], left[:-1])) - gap
+        H[i, 1:] = np.maximum(best, left_prev)
+        moves[i, 1:] = np.where(
+            left_prev > best,
+            2,
+            np.where(diag >= up, 0, 1),
+            )
+
+    # free end gaps: start from the best cell of the last row or column
+    if H[n, 1:].max(initial=0) >= H[1:, m].max(initial=0):
+        i, j = n, int(np.argmax(H[n])) if m else 0
+    else:
+        i, j = int(np.argmax(H[:, m])), m
+    pairs = []
+    while i > 0 and j > 0:
+        move = moves[i, j]
+        if move == 0:
+            pairs.append((i - 1, j - 1))
+            i, j = i - 1, j - 1
+        elif move == 1:
+            i -= 1
+        else:
+            j -= 1
+    return pairs[::-1]
+
+
+def structural_alignment(
+        ref_xyz,
+        model_xyz,
+        initial_pairs=None,
+        d0=3.0,
+        gap=0.2,
+        cutoff=5.0,
+        max_iter=20,
+        ):
+    """
+    Align two chain traces by iterative superposition.
+
+    The model is superposed on the reference using the current residue
+    correspondence (:py:func:`kabsch`), then a new correspondence is found
+    by dynamic programming on the score ``1 / (1 + (d / d0) ** 2)`` of the
+    distances between the superposed traces. Only pairs closer than
+    `cutoff` drive the next superposition. Iterations stop when the
+    correspondence does not change.
+
+    Parameters
+    ----------
+    ref_xyz : np.ndarray
+        Trace of the reference, shape (n_residues, 3).
+
+    model_xyz : np.ndarray
+        Trace of the model, shape (n_residues, 3).
+
+    initial_pairs : list of tuples, optional
+        Initial correspondence, for example from a sequence alignment.
+        The residues are matched in order if not given.
+
+    d0 : float
+        Distance scale of the score, in Angstrom.
+
+    gap : float
+        Penalty of each gap position.
+
+    cutoff : float
+        Maximum distance of the pairs used in the superposition.
+
+    max_iter : int
+        Maximum number of iterations.
+
+    Returns
+    -------
+    pairs : list of tuples
+        The matched (reference, model) positions.
+    """
+    ref_xyz = np.asarray(ref_xyz, dtype=np.float64)
+    model_xyz = np.asarray(model_xyz, dtype=np.float64)
+    if not initial_pairs or len(initial_pairs) < 3:
+        n = min(len(ref_xyz), len(model_xyz))
+        initial_pairs = list(zip(range(n), range(n)))
+
+    pairs = list(initial_pairs)
+    fit = np.array(pairs)
+    for _ in range(max_iter):
+        Q = ref_xyz[fit[:, 0]]
+        P = model_xyz[fit[:, 1]]
+        U = kabsch(P - centroid(P), Q - centroid(Q))
+        moved = np.dot(model_xyz - centroid(P), U) + centroid(Q)
+
+        dist = np.linalg.norm(ref_xyz[:, None, :] - moved[None, :, :], axis=-1)
+        new_pairs = _dp_alignment(1 / (1 + (dist / d0) ** 2), gap)
+        if new_pairs == pairs:
+            break
+        pairs = new_pairs
+        close = [p for p in pairs if dist[p] < cutoff]
+        fit = np.array(close if len(close) >= 3 else pairs)
+    return pairs
+
+
+def align_lovoalign(reference, model, output_path, lovoalign_exec):
+    """
+    Structuraly align with LovoAlign and get numbering relationship.
+
+    Parameters
+    ----------
+    reference : :py:class:`haddock.libs.libontology.PDBFile`
+
+    model : :py:class:`haddock.libs.libontology.PDBFile`
+
+    output_path : Path
+
+    lovoalign_exec : Path
+        lovoalign executable
+
+    Returns
+    -------
+    numbering_dic : dict
+        dict of numbering dictionaries (one dictionary per chain)
+    """
     if not os.access(lovoalign_exec, os.X_OK):
         raise ALIGNError(f"{lovoalign_exec!r} for LovoAlign is not executable")
 
@@ -596,7 +1050,7 @@ def align_strct(reference, model, output_path, lovoalign_exec=None):
     return numbering_dic
 
 
-def align_seq(reference, model, output_path):
+def align_seq(reference, model, output_path, seqdic_ref=None):
     """
     Sequence align and get the numbering relationship.
 
@@ -608,12 +1062,17 @@ def align_seq(reference, model, output_path):
 
     output_path : Path
 
+    seqdic_ref : dict, optional
+        The sequences of the reference, as returned by
+        :py:func:`pdb2fastadic`. Read from `reference` if not given.
+
     Returns
     -------
     align_dic : dict
         dictionary of sequence alignments (one per chain)
     """
-    seqdic_ref = pdb2fastadic(reference)
+    if seqdic_ref is None:
+        seqdic_ref = pdb2fastadic(reference)
     seqdic_model = pdb2fastadic(model)
 
     if seqdic_ref.keys() != seqdic_model.keys():
@@ -651,7 +1110,7 @@ def align_seq(reference, model, output_path):
             str(top_aln).count("|") / float(min(len(seq_ref), len(seq_model)))
             ) * 100
 
-        if not any(e for e in top_aln.aligned):
+        if not any(len(e) for e in top_aln.aligned):
             # No alignment!
             log.warning(
                 f"No alignment for chain {ref_chain} is it protein/dna-rna? "
@@ -705,6 +1164,74 @@ def align_seq(reference, model, output_path):
     return align_dic
 
 
+def identity_numbering(seqdic_ref, seqdic_model):
+    """
+    Match residues without alignment when the sequences are identical.
+
+    Parameters
+    ----------
+    seqdic_ref : dict
+        sequences of the reference, as returned by :py:func:`pdb2fastadic`
+
+    seqdic_model : dict
+        sequences of the model, as returned by :py:func:`pdb2fastadic`
+
+    Returns
+    -------
+    numbering_dic : dict or None
+        dict of numbering dictionaries (one dictionary per chain), matching
+        the residues in order. `None` if the chains or the sequences differ.
+    """
+    if list(seqdic_ref) != list(seqdic_model):
+        return None
+    numbering_dic = {}
+    for chain, ref_seq in seqdic_ref.items():
+        model_seq = seqdic_model[chain]
+        if list(ref_seq.values()) != list(model_seq.values()):
+            return None
+        numbering_dic[chain] = dict(zip(model_seq, ref_seq))
+    return numbering_dic
+
+
+def numbering_key(method, seqdic_ref, seqdic_model, structure_id=""):
+    """
+    Identify a model-to-reference numbering.
+
+    Models with the same sequences and residue numbers share the same
+    sequence alignment to a reference, so the alignment needs to be done
+    once. Structural alignments also depend on the coordinates, given by
+    `structure_id`.
+
+    Parameters
+    ----------
+    method : str
+        The alignment method, see :py:func:`get_align`.
+
+    seqdic_ref : dict
+        sequences of the reference, as returned by :py:func:`pdb2fastadic`
+
+    seqdic_model : dict
+        sequences of the model, as returned by :py:func:`pdb2fastadic`
+
+    structure_id : str
+        Additional identifier of the structures, for example the checksums
+        of the reference and the model when the alignment depends on their
+        coordinates.
+
+    Returns
+    -------
+    str
+        The md5 hexdigest identifying the numbering.
+    """
+    content = json.dumps([
+        method,
+        structure_id,
+        list(seqdic_ref.items()),
+        list(seqdic_model.items()),
+        ])
+    return hashlib.md5(content.encode()).hexdigest()
+
+
 def make_range(chain_range_dic):
     """
     Expand a chain dictionary into ranges.
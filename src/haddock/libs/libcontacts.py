@@ -0,0 +1,182 @@
+"""
+Detection of intermolecular contacts.
+
+Contacts are found with a KD-tree (:py:class:`scipy.spatial.cKDTree`), so
+only atoms closer than the cutoff are ever compared. Residue contacts are
+returned as structured arrays, shared by the CAPRI metrics (fnat and the
+interface detection of i-RMSD and i-L-RMSD) and by contact maps.
+
+Main functions
+--------------
+
+* :py:func:`atom_contacts`
+* :py:func:`residue_contacts`
+* :py:func:`contact_codes`
+"""
+from itertools import combinations
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+CONTACT_DTYPE = np.dtype([
+    ("chain_a", "U1"),
+    ("resnum_a", "i4"),
+    ("chain_b", "U1"),
+    ("resnum_b", "i4"),
+    ])
+"""Residue contact between chain ``a`` and chain ``b``."""
+
+_RESNUM_BITS = 20
+_RESIDUE_BITS = 28
+
+
+def atom_contacts(xyz_a, xyz_b, cutoff):
+    """
+    Find the pairs of atoms closer than a cutoff.
+
+    Parameters
+    ----------
+    xyz_a : np.ndarray
+        Coordinates of the first set of atoms, shape (n_atoms_a, 3).
+
+    xyz_b : np.ndarray
+        Coordinates of the second set of atoms, shape (n_atoms_b, 3).
+
+    cutoff : float
+        The distance cutoff, in Angstrom. Pairs at exactly the cutoff
+        distance are not in contact.
+
+    Returns
+    -------
+    idx_a, idx_b : np.ndarray
+        The indices of the atoms in contact in each set.
+    """
+    if len(xyz_a) == 0 or len(xyz_b) == 0:
+        empty = np.empty(0, dtype=np.intp)
+        return empty, empty
+    pairs = cKDTree(xyz_a).sparse_distance_matrix(
+        cKDTree(xyz_b),
+        cutoff,
+        output_type="ndarray",
+        )
+    pairs = pairs[pairs["v"] < cutoff]
+    return pairs["i"].astype(np.intp), pairs["j"].astype(np.intp)
+
+
+def residue_contacts(chains, resnums, xyz, cutoff=5.0):
+    """
+    Find the residue contacts between chains.
+
+    Every pair of chains is considered, in order of appearance of the
+    chains.
+
+    Parameters
+    ----------
+    chains : np.ndarray
+        The chain of each atom.
+
+    resnums : np.ndarray
+        The residue number of each atom.
+
+    xyz : np.ndarray
+        The coordinates of the atoms, shape (n_atoms, 3).
+
+    cutoff : float
+        The distance cutoff, in Angstrom.
+
+    Returns
+    -------
+    np.ndarray
+        The unique residue contacts, with :py:data:`CONTACT_DTYPE`.
+    """
+    chains = np.asarray(chains)
+    resnums = np.asarray(resnums)
+    xyz = np.asarray(xyz, dtype=np.float64)
+    chain_idx = {
+        chain: np.flatnonzero(chains == chain)
+        for chain in dict.fromkeys(chains.tolist())
+        }
+
+    found = []
+    for chain_a, chain_b in combinations(chain_idx, 2):
+        idx_a, idx_b = chain_idx[chain_a], chain_idx[chain_b]
+        i, j = atom_contacts(xyz[idx_a], xyz[idx_b], cutoff)
+        if not len(i):
+            continue
+        # residue pairs are made unique as integer codes
+        res_a = resnums[idx_a[i]].astype(np.int64)
+        res_b = resnums[idx_b[j]].astype(np.int64)
+        min_b = res_b.min()
+        span_b = res_b.max() - min_b + 1
+        codes = np.unique(res_a * span_b + (res_b - min_b))
+        contacts = np.empty(len(codes), dtype=CONTACT_DTYPE)
+        contacts["chain_a"] = chain_a
+        contacts["resnum_a"] = codes // span_b
+        contacts["chain_b"] = chain_b
+        contacts["resnum_b"] = codes % span_b + min_b
+        found.append(contacts)
+
+    if not found:
+        return np.empty(0, dtype=CONTACT_DTYPE)
+    return np.concatenate(found)
+
+
+def _residue_codes(chains, resnums):
+    chain_codes = np.array([ord(c) for c in chains.tolist()], dtype=np.int64)
+    if (chain_codes >= 2**(_RESIDUE_BITS - _RESNUM_BITS)).any():
+        raise ValueError("Chain IDs must be ASCII characters.")
+    return (
+        chain_codes << _RESNUM_BITS
+        | (resnums.astype(np.int64) + 2**(_RESNUM_BITS - 1))
+        )
+
+
+def contact_codes(contacts):
+    """
+    Encode residue contacts as integers.
+
+    Each contact is packed in one 64 bit integer, so the contacts of many
+    models are kept in compact arrays and compared with integer operations.
+    The codes do not depend on the model: the same contact has the same
+    code in all the models.
+
+    Parameters
+    ----------
+    contacts : np.ndarray
+        The contacts, with :py:data:`CONTACT_DTYPE`.
+
+    Returns
+    -------
+    np.ndarray
+        The sorted unique codes, dtype int64.
+    """
+    res_a = _residue_codes(contacts["chain_a"], contacts["resnum_a"])
+    res_b = _residue_codes(contacts["chain_b"], contacts["resnum_b"])
+    return np.unique(res_a << _RESIDUE_BITS | res_b)
+
+
+def decode_contacts(codes):
+    """
+    Decode residue contacts encoded by :py:func:`contact_codes`.
+
+    Parameters
+    ----------
+    codes : np.ndarray
+        The contact codes.
+
+    Returns
+    -------
+    np.ndarray
+        The contacts, with :py:data:`CONTACT_DTYPE`.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    contacts = np.empty(len(codes), dtype=CONTACT_DTYPE)
+    resnum_mask = 2**_RESNUM_BITS - 1
+    offset = 2**(_RESNUM_BITS - 1)
+    for side, res in (("a", codes >> _RESIDUE_BITS), ("b", codes)):
+        contacts[f"chain_{side}"] = [
+            chr(c) for c in (res >> _RESNUM_BITS) & 0xFF
+            ]
+        contacts[f"resnum_{side}"] = (res & resnum_mask) - offset
+    return contacts
@@ -0,0 +1,351 @@
+"""
+Run-wide store of model coordinates.
+
+Parsing the same PDB files again and again is a large part of the cost of
+the analysis modules. The coordinate store parses each model once, when it
+is exported by the step that produced it, and keeps:
+
+* the identity of the atoms (see :py:data:`haddock.libs.libpdb.ATOM_DTYPE`),
+  stored once per topology, that is, per distinct list of atoms;
+* the coordinates of each model, as a float32 block appended to a single
+  binary file that readers map in memory. A model stored again with the
+  same number of atoms, after its file changed, is written over its block.
+
+Coordinates read from the store are float32, not the float64 values parsed
+from the text. The rounding is below 1e-4 A for coordinates under 1000 A,
+within the three decimals of the PDB format, but RMSDs and other values
+calculated from the store can differ from those of the parsed files by
+about 1e-5 A.
+
+The store lives in the ``coordinates`` folder of the run directory.
+Consumers should use :py:func:`load_atoms`, which reads a model from the
+store of the run it belongs to, and parses the PDB file only when the model
+is not in the store or the file changed since it was stored.
+
+Main functions
+--------------
+
+* :py:class:`CoordinateStore`
+* :py:func:`get_run_store`
+* :py:func:`load_atoms`
+"""
+import hashlib
+import json
+import os
+from functools import lru_cache
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+
+from haddock.core.defaults import COORDINATE_STORE_DIR
+from haddock.libs.libontology import Format, PDBFile
+from haddock.libs.libpdb import ATOM_DTYPE, parse_atoms
+
+
+INDEX_FILE = "index.json"
+COORDS_FILE = "coordinates.f32"
+TOPOLOGY_FOLDER = "topologies"
+
+
+def model_key(pdb_f):
+    """
+    Get the run directory and the store key of a model.
+
+    The key is the name of the model's folder, usually the step folder,
+    and the model's file name, for example ``1_rigidbody/rigidbody_1.pdb``.
+
+    Parameters
+    ----------
+    pdb_f : str, pathlib.Path or :py:class:`haddock.libs.libontology.PDBFile`
+        The model.
+
+    Returns
+    -------
+    run_dir : pathlib.Path
+        The folder containing the model's folder.
+
+    key : str
+        The key of the model in the store.
+    """
+    if isinstance(pdb_f, PDBFile):
+        pdb_f = pdb_f.rel_path
+    path = Path(pdb_f).resolve()
+    return path.parent.parent, f"{path.parent.name}/{path.name}"
+
+
+def _file_signature(path):
+    """Return the size and modification time of a file, or None."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _topology_id(atoms):
+    """Identify a topology by the hash of its atom identity array."""
+    return hashlib.md5(atoms.tobytes()).hexdigest()
+
+
+class CoordinateStore:
+    """Store of the coordinates of the models of a run."""
+
+    def __init__(self, path):
+        """
+        Open a coordinate store.
+
+        Parameters
+        ----------
+        path : str or pathlib.Path
+            The folder of the store. It is created when models are added.
+        """
+        self.path = Path(path)
+        self.index_file = Path(self.path, INDEX_FILE)
+        self.coords_file = Path(self.path, COORDS_FILE)
+        self.topology_folder = Path(self.path, TOPOLOGY_FOLDER)
+        self._index = {}
+        self._index_signature = None
+        self._topologies = {}
+        self._coords = None
+
+    def __contains__(self, key):
+        self._refresh_index()
+        return key in self._index
+
+    def __len__(self):
+        self._refresh_index()
+        return len(self._index)
+
+    def _refresh_index(self):
+        """Reload the index if it changed on disk."""
+        signature = _file_signature(self.index_file)
+        if signature != self._index_signature:
+            self._index = (
+                json.loads(self.index_file.read_text()) if signature else {}
+                )
+            self._index_signature = signature
+
+    def _save_index(self):
+        """Save the index atomically."""
+        tmp_file = Path(self.path, INDEX_FILE + ".tmp")
+        tmp_file.write_text(json.dumps(self._index))
+        os.replace(tmp_file, self.index_file)
+        self._index_signature = _file_signature(self.index_file)
+
+    def _topology(self, topology_id):
+        """Load the atom identity array of a topology."""
+        if topology_id not in self._topologies:
+            self._topologies[topology_id] = np.load(
+                Path(self.topology_folder, f"{topology_id}.npy"),
+                allow_pickle=False,
+                )
+        return self._topologies[topology_id]
+
+    def _coords_map(self, end):
+        """Map the coordinates file, remapping it if it grew."""
+        if self._coords is None or self._coords.shape[0] < end:
+            self._coords = np.memmap(
+                self.coords_file,
+                dtype="<f4",
+                mode="r",
+                ).reshape(-1, 3)
+        return self._coords
+
+    def add(self, key, atoms, xyz, signature=None):
+        """
+        Add a model to the store.
+
+        A model already stored with the same number of atoms reuses its
+        block of the coordinates file, other models are appended to it.
+        The index is not saved, call :py:meth:`add_models` to add and
+        save several models.
+
+        Parameters
+        ----------
+        key : str
+            The key of the model, see :py:func:`model_key`.
+
+        atoms : np.ndarray
+            The atom identity array.
+
+        xyz : np.ndarray
+            The coordinates, shape (n_atoms, 3).
+
+        signature : list, optional
+            The size and modification time of the model file when it was
+            parsed.
+        """
+        self.topology_folder.mkdir(parents=True, exist_ok=True)
+        topology_id = _topology_id(atoms)
+        topology_file = Path(self.topology_folder, f"{topology_id}.npy")
+        if not topology_file.exists():
+            np.save(topology_file, atoms, allow_pickle=False)
+
+        data = np.ascontiguousarray(xyz, dtype="<f4").tobytes()
+        entry = self._index.get(key)
+        if entry is not None and entry["natoms"] == len(atoms):
+            offset = entry["offset"]
+            with open(self.coords_file, "r+b") as fout:
+                fout.seek(offset * 12)
+                fout.write(data)
+        else:
+            with open(self.coords_file, "ab") as fout:
+                offset = fout.tell() // 12
+                fout.write(data)
+
+        self._index[key] = {
+            "topology": topology_id,
+            "offset": offset,
+            "natoms": len(atoms),
+            "signature": signature,
+            }
+
+    def add_models(self, models, ncores=1):
+        """
+        Parse models and add them to the store.
+
+        Models already stored and not modified since are skipped.
+
+        Parameters
+        ----------
+        models : list
+            The :py:class:`haddock.libs.libontology.PDBFile` objects or
+            paths to PDB files. Lists of dictionaries, as exported by the
+            topology modules, are accepted.
+
+        ncores : int
+            The number of processes used to parse the models.
+        """
+        self._refresh_index()
+        to_parse = {}
+        for model in models:
+            ensemble = model.values() if isinstance(model, dict) else [model]
+            for pdb in ensemble:
+                if isinstance(pdb, PDBFile) and pdb.file_type != Format.PDB:
+                    continue
+                _, key = model_key(pdb)
+                path = pdb.rel_path if isinstance(pdb, PDBFile) else pdb
+                signature = _file_signature(path)
+                entry = self._index.get(key)
+                if signature and (not entry or entry["signature"] != signature):  # noqa: E501
+                    to_parse[key] = (str(path), signature)
+
+        if not to_parse:
+            return
+
+        paths = [path for path, _ in to_parse.values()]
+        if ncores > 1 and len(paths) > 1:
+            with Pool(min(ncores, len(paths))) as pool:
+                parsed = pool.map(parse_atoms, paths)
+        else:
+            parsed = list(map(parse_atoms, paths))
+
+        for (key, (_, signature)), (atoms, xyz) in zip(to_parse.items(), parsed):  # noqa: E501
+            self.add(key, atoms, xyz, signature)
+        self._save_index()
+
+    def get(self, key, signature=None):
+        """
+        Get a model from the store.
+
+        Parameters
+        ----------
+        key : str
+            The key of the model, see :py:func:`model_key`.
+
+        signature : list, optional
+            The current size and modification time of the model file. If
+            given and different from the stored one, the model is
+            considered not stored.
+
+        Returns
+        -------
+        tuple or None
+            The atom identity array and a read-only float32 view of the
+            coordinates, shape (n_atoms, 3). `None` if the model is not
+            stored.
+        """
+        self._refresh_index()
+        entry = self._index.get(key)
+        if entry is None:
+            return None
+        if signature and entry["signature"] != signature:
+            return None
+        start = entry["offset"]
+        end = start + entry["natoms"]
+        xyz = self._coords_map(end)[start:end]
+        return self._topology(entry["topology"]), xyz
+
+
+@lru_cache(maxsize=None)
+def _open_store(store_path):
+    return CoordinateStore(store_path)
+
+
+def get_run_store(run_dir, create=False):
+    """
+    Get the coordinate store of a run.
+
+    Stores are opened once per process.
+
+    Parameters
+    ----------
+    run_dir : str or pathlib.Path
+        The run directory.
+
+    create : bool
+        Whether to return the store even if it has no models yet.
+
+    Returns
+    -------
+    :py:class:`CoordinateStore` or None
+        `None` if `run_dir` is not a run directory, that is, it does not
+        have a ``data`` folder, or if the store does not exist and
+        `create` is `False`.
+    """
+    run_dir = Path(run_dir)
+    store_path = Path(run_dir, COORDINATE_STORE_DIR)
+    if not Path(run_dir, "data").is_dir():
+        return None
+    if not create and not store_path.is_dir():
+        return None
+    return _open_store(str(store_path.resolve()))
+
+
+def load_atoms(pdb_f):
+    """
+    Load the atoms of a model, from the coordinate store when possible.
+
+    Parameters
+    ----------
+    pdb_f : str, pathlib.Path or :py:class:`haddock.libs.libontology.PDBFile`
+        The model.
+
+    Returns
+    -------
+    atoms : np.ndarray
+        Structured array with :py:data:`haddock.libs.libpdb.ATOM_DTYPE`.
+
+    xyz : np.ndarray
+        The coordinates, shape (n_atoms, 3). Read-only float32 if read from
+        the store, float64 if parsed from the PDB file.
+    """
+    if isinstance(pdb_f, PDBFile):
+        pdb_f = pdb_f.rel_path
+    run_dir, key = model_key(pdb_f)
+    store = get_run_store(run_dir)
+    if store is not None:
+        stored = store.get(key, _file_signature(pdb_f))
+        if stored is not None:
+            return stored
+    return parse_atoms(pdb_f)
+
+
+__all__ = [
+    "ATOM_DTYPE",
+    "CoordinateStore",
+    "get_run_store",
+    "load_atoms",
+    "model_key",
+    ]
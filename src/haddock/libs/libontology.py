@@ -1,13 +1,16 @@
 """Describe the Haddock3 ontology used for communicating between modules."""
 import datetime
 import itertools
+import os
 from enum import Enum
+from multiprocessing import Pool
 from os import linesep
 from pathlib import Path
 
 import jsonpickle
 
 from haddock.core.defaults import MODULE_IO_FILE
+from haddock.libs.libutil import file_checksum
 
 
 NaN = float('nan')
@@ -45,6 +48,7 @@ class Persistent:
         self.rel_path = Path('..', Path(self.path).name, file_name)
         self.md5 = md5
         self.restr_fname = restr_fname
+        self.checksum = None
 
     def __repr__(self):
         rep = (f"[{self.file_type}|{self.created}] "
@@ -181,50 +185,167 @@ class ModuleIO:
 
         return model_list
 
-    def check_faulty(self):
-        """Check how many of the output exists."""
-        total = 0.0
-        present = 0.0
-        for element in self.output:
-            if isinstance(element, dict):
-                total += len(element.values())
-                present += sum(j.is_present() for j in element.values())
-            else:
-                total += 1
-                if element.is_present():
-                    present += 1
+    def check_faulty(self, min_size=0, checksum=False, ncores=1):
+        """
+        Check how many of the output exists.
+
+        Output folders are listed once each with :py:func:`os.scandir`
+        and the outputs are looked up in the listing, instead of querying
+        the file system for every output.
+
+        Parameters
+        ----------
+        min_size : int
+            Outputs smaller than `min_size` bytes are considered missing.
+            Defaults to 0, which skips the size check.
+
+        checksum : bool
+            Whether to compute the checksum of the present outputs and
+            store it in their `checksum` attribute.
+
+        ncores : int
+            The number of processes used for the size check and the
+            checksums.
+
+        Returns
+        -------
+        float
+            The percentage of missing output.
+        """
+        elements = list(self._iter_output())
+        total = len(elements)
 
         if total == 0:
             _msg = ("No expected output was passed to ModuleIO")
             raise Exception(_msg)
 
-        faulty_per = (1 - (present / total)) * 100
+        present = _find_present(elements, min_size=min_size, ncores=ncores)
+
+        if checksum:
+            found = [e for e in elements if id(e) in present]
+            paths = [str(e.rel_path) for e in found]
+            checksums = _pool_map(file_checksum, paths, ncores)
+            for element, checksum_ in zip(found, checksums):
+                element.checksum = checksum_
+
+        faulty_per = (1 - (len(present) / total)) * 100
 
         # added this method here to avoid modifying all calls in the
         # modules' run method. We can think about restructure this part
         # in the future.
-        self.remove_missing()
+        self.remove_missing(present=present)
 
         return faulty_per
 
-    def remove_missing(self):
-        """Remove missing structure from `output`."""
-        # can't modify a list/dictionary within a loop
-        idxs = []
-        for idx, element in enumerate(self.output):
+    def remove_missing(self, present=None):
+        """
+        Remove missing structure from `output`.
+
+        Parameters
+        ----------
+        present : set, optional
+            The `id` of the output elements known to be present. If not
+            given, the output folders are scanned.
+        """
+        if present is None:
+            present = _find_present(self._iter_output())
+
+        output = []
+        for element in self.output:
             if isinstance(element, dict):
                 for key2 in list(element.keys()):
-                    if not element[key2].is_present():
+                    if id(element[key2]) not in present:
                         element.pop(key2)
-            else:
-                if not element.is_present():
-                    idxs.append(idx)
+                output.append(element)
+            elif id(element) in present:
+                output.append(element)
+
+        self.output = output
 
-        self.output = [
-            value
-            for i, value in enumerate(self.output)
-            if i not in idxs
-            ]
+    def _iter_output(self):
+        """Iterate over the persistent objects in `output`."""
+        for element in self.output:
+            if isinstance(element, dict):
+                yield from element.values()
+            else:
+                yield element
 
     def __repr__(self):
         return f"Input: {self.input}{linesep}Output: {self.output}"
+
+
+def _scan_folder(folder):
+    """
+    List the entries of a folder with a single directory read.
+
+    Broken symbolic links are not listed.
+
+    Parameters
+    ----------
+    folder : str or pathlib.Path
+        The folder to scan.
+
+    Returns
+    -------
+    set of str
+        The names of the entries. Empty if `folder` does not exist.
+    """
+    names = set()
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_symlink() and not os.path.exists(entry.path):
+                    continue
+                names.add(entry.name)
+    except (FileNotFoundError, NotADirectoryError):
+        pass
+    return names
+
+
+def _find_present(elements, min_size=0, ncores=1):
+    """
+    Find which persistent objects exist on disk.
+
+    Each folder is scanned only once, regardless of the number of
+    objects it holds.
+
+    Parameters
+    ----------
+    elements : iterable of :py:class:`Persistent`
+        The objects to check.
+
+    min_size : int
+        Objects whose files are smaller than `min_size` bytes are
+        considered missing.
+
+    ncores : int
+        The number of processes used to check the file sizes.
+
+    Returns
+    -------
+    set of int
+        The `id` of the objects present on disk.
+    """
+    listings = {}
+    found = []
+    for element in elements:
+        folder = element.rel_path.parent
+        if folder not in listings:
+            listings[folder] = _scan_folder(folder)
+        if element.rel_path.name in listings[folder]:
+            found.append(element)
+
+    if min_size > 0 and found:
+        paths = [str(e.rel_path) for e in found]
+        sizes = _pool_map(os.path.getsize, paths, ncores)
+        found = [e for e, size in zip(found, sizes) if size >= min_size]
+
+    return {id(e) for e in found}
+
+
+def _pool_map(func, items, ncores=1):
+    """Map `func` over `items`, with a process pool if `ncores` > 1."""
+    if ncores > 1 and len(items) > 1:
+        with Pool(min(ncores, len(items))) as pool:
+            return pool.map(func, items)
+    return list(map(func, items))
@@ -1,6 +1,7 @@
 """Module in charge of parallelizing the execution of tasks."""
 import math
-from multiprocessing import Process
+import queue
+from multiprocessing import Process, Queue
 
 from haddock import log
 from haddock.libs.libutil import parse_ncores
@@ -17,22 +18,31 @@ def split_tasks(lst, n):
 class Worker(Process):
     """Work on tasks."""
 
-    def __init__(self, tasks):
+    def __init__(self, tasks, index=0, results=None):
         super(Worker, self).__init__()
         self.tasks = tasks
+        self.index = index
+        self.results = results
         log.debug(f"Worker ready with {len(self.tasks)} tasks")
 
     def run(self):
-        """Execute tasks."""
-        for task in self.tasks:
-            task.run()
+        """Execute tasks, sending their return values to `results`."""
+        outputs = [task.run() for task in self.tasks]
+        if self.results is not None:
+            self.results.put((self.index, outputs))
         log.debug(f"{self.name} executed")
 
 
 class Scheduler:
     """Schedules tasks to run in multiprocessing."""
 
-    def __init__(self, tasks, ncores=None, max_cpus=False):
+    def __init__(
+            self,
+            tasks,
+            ncores=None,
+            max_cpus=False,
+            collect_results=False,
+            ):
         """
         Schedule tasks to a defined number of processes.
 
@@ -46,6 +56,12 @@ class Scheduler:
             The number of cores to use. If `None` is given uses the
             maximum number of CPUs allowed by
             `libs.libututil.parse_ncores` function.
+
+        collect_results : bool
+            Whether the return values of the tasks' `run` are sent back to
+            the main process. They are available in :py:attr:`results`,
+            in the order of `tasks`, after :py:meth:`run`. The values must
+            be picklable.
         """
         self.max_cpus = max_cpus
         self.num_tasks = len(tasks)
@@ -63,12 +79,22 @@ class Scheduler:
                 task_name_dic[i] = (t.output, len(str(t.output)))
 
         sorted_task_list = []
+        sorted_idx = []
         for e in sorted(task_name_dic.items(), key=lambda x: (x[0], x[1])):
             idx = e[0]
             sorted_task_list.append(tasks[idx])
+            sorted_idx.append(idx)
+
+        # the return value of each task, filled by `run`
+        self.results = [None] * self.num_tasks
+        self._results_queue = Queue() if collect_results else None
+        self._task_idx = list(split_tasks(sorted_idx, self.num_processes))
 
         job_list = split_tasks(sorted_task_list, self.num_processes)
-        self.worker_list = [Worker(jobs) for jobs in job_list]
+        self.worker_list = [
+            Worker(jobs, index=i, results=self._results_queue)
+            for i, jobs in enumerate(job_list)
+            ]
 
         log.info(f"Using {self.num_processes} cores")
         log.debug(f"{self.num_tasks} tasks ready.")
@@ -94,6 +120,11 @@ class Scheduler:
                 # Start the worker
                 worker.start()
 
+            if self._results_queue is not None:
+                # read the results before joining, workers sending large
+                #  results do not exit until they are read
+                self._collect_results()
+
             c = 1
             for worker in self.worker_list:
                 # Wait for the worker to finish
@@ -124,6 +155,27 @@ class Scheduler:
             # whichever has to catch it
             raise err
 
+    def _collect_results(self):
+        """Receive the results of the workers."""
+        pending = len(self.worker_list)
+        while pending:
+            try:
+                index, outputs = self._results_queue.get(timeout=1)
+            except queue.Empty:
+                if any(worker.is_alive() for worker in self.worker_list):
+                    continue
+                try:
+                    # sent just before the worker exited
+                    index, outputs = self._results_queue.get_nowait()
+                except queue.Empty:
+                    log.warning(
+                        f"{pending} workers exited without results"
+                        )
+                    break
+            for idx, output in zip(self._task_idx[index], outputs):
+                self.results[idx] = output
+            pending -= 1
+
     def terminate(self):
         """Terminate tasks in a controlled way."""
         for worker in self.worker_list:
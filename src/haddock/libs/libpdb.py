@@ -3,6 +3,7 @@ import os
 from functools import partial
 from pathlib import Path
 
+import numpy as np
 from pdbtools.pdb_segxchain import run as place_seg_on_chain
 from pdbtools.pdb_splitchain import run as split_chain
 from pdbtools.pdb_splitmodel import run as split_model
@@ -30,6 +31,22 @@ slc_segid = slice(72, 76)
 slc_element = slice(76, 78)
 slc_charge = slice(78, 80)
 
+ATOM_DTYPE = np.dtype([
+    ("hetatm", "?"),
+    ("name", "U4"),
+    ("resname", "U4"),
+    ("chain", "U1"),
+    ("resnum", "i4"),
+    ("segid", "U4"),
+    ("element", "U2"),
+    ])
+"""
+Identity of the atoms of a structure, see :py:func:`parse_atoms`.
+
+``hetatm`` is ``True`` for ``HETATM`` records. The string fields are
+stripped of blanks except ``chain``, which is kept as in the file.
+"""
+
 
 def format_atom_name(atom, element):
     """
@@ -185,31 +202,17 @@ def sanitize(pdb_file_path, overwrite=True, custom_topology=False):
 
 def identify_chainseg(pdb_file_path, sort=True):
     """Return segID OR chainID."""
-    segids = []
-    chains = []
-    with open(pdb_file_path) as input_handler:
-        for line in input_handler:
-            if line.startswith(("ATOM  ", "HETATM")):
-                try:
-                    segid = line[72:76].strip()[:1]
-                except IndexError:
-                    segid = ""
-                try:
-                    chainid = line[21].strip()
-                except IndexError:
-                    chainid = ""
-
-                if segid:
-                    segids.append(segid)
-                if chainid:
-                    chains.append(chainid)
+    atoms, _ = parse_atoms(pdb_file_path)
+    # only the first character of the segid is considered
+    segids = set(atoms["segid"].astype("U1").tolist()) - {""}
+    chains = set(np.char.strip(atoms["chain"]).tolist()) - {""}
 
     if sort:
-        segids = sorted(list(set(segids)))
-        chains = sorted(list(set(chains)))
+        segids = sorted(segids)
+        chains = sorted(chains)
     else:
-        segids = list(set(segids))
-        chains = list(set(chains))
+        segids = list(segids)
+        chains = list(chains)
     return segids, chains
 
 
@@ -272,3 +275,55 @@ def read_RECORD_section(lines, section_slice, func=set):
 
 read_chainids = partial(read_RECORD_section, section_slice=slc_chainid, func=list)  # noqa: E501
 read_segids = partial(read_RECORD_section, section_slice=slc_segid, func=list)
+
+
+def _column(records, slc):
+    """Slice a fixed-width column out of an (n, 80) array of bytes."""
+    width = slc.stop - slc.start
+    return np.ascontiguousarray(records[:, slc]).view(f"S{width}").ravel()
+
+
+def parse_atoms(pdb_f):
+    """
+    Parse the ``ATOM`` and ``HETATM`` records of a PDB file.
+
+    The file is read at once and the fixed-width columns are sliced and
+    converted with NumPy, without a Python loop over the atoms.
+
+    Parameters
+    ----------
+    pdb_f : str or pathlib.Path
+        Path to the PDB file.
+
+    Returns
+    -------
+    atoms : np.ndarray
+        Structured array with :py:data:`ATOM_DTYPE` describing each atom.
+
+    xyz : np.ndarray
+        The coordinates of the atoms, shape (n_atoms, 3), dtype float64.
+    """
+    with open(pdb_f, "rb") as fh:
+        # lines shorter than 80 columns are padded with blanks
+        lines = [
+            line.ljust(80)[:80]
+            for line in fh.read().splitlines()
+            if line.startswith((b"ATOM", b"HETATM"))
+            ]
+
+    atoms = np.empty(len(lines), dtype=ATOM_DTYPE)
+    xyz = np.empty((len(lines), 3), dtype=np.float64)
+    if not lines:
+        return atoms, xyz
+
+    records = np.frombuffer(b"".join(lines), dtype=np.uint8).reshape(-1, 80)
+    atoms["hetatm"] = records[:, 0] == ord("H")
+    atoms["name"] = np.char.strip(_column(records, slc_name))
+    atoms["resname"] = np.char.strip(_column(records, slc_resname))
+    atoms["chain"] = _column(records, slc_chainid)
+    atoms["resnum"] = _column(records, slc_resseq).astype(np.int32)
+    atoms["segid"] = np.char.strip(_column(records, slc_segid))
+    atoms["element"] = np.char.strip(_column(records, slc_element))
+    for i, slc in enumerate((slc_x, slc_y, slc_z)):
+        xyz[:, i] = _column(records, slc).astype(np.float64)
+    return atoms, xyz
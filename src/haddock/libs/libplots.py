@@ -1,5 +1,6 @@
 """Plotting functionalities."""
 
+from multiprocessing import Pool
 from pathlib import Path
 
 import numpy as np
@@ -64,6 +65,12 @@ AXIS_NAMES = {
     "dockq": "DOCKQ",
     }
 
+# above this number of models, the plots summarise the models instead of
+#  drawing each of them
+MAX_POINTS = 5000
+# number of bins of each axis of the summarised scatter plots
+DENSITY_BINS = 50
+
 
 def read_capri_table(capri_filename, comment="#"):
     """
@@ -85,6 +92,80 @@ def read_capri_table(capri_filename, comment="#"):
     return capri_df
 
 
+def load_capri_table(capri_table, comment="#"):
+    """
+    Load a capri table, unless it is already loaded.
+
+    Parameters
+    ----------
+    capri_table : str, Path or pandas DataFrame
+        capri table filename, or the table read with `read_capri_table`
+    comment : str
+        the string used to denote a commented line in capri tables
+
+    Returns
+    -------
+    capri_df : pandas DataFrame
+        dataframe of capri values
+    """
+    if isinstance(capri_table, pd.DataFrame):
+        return capri_table
+    return read_capri_table(capri_table, comment=comment)
+
+
+# data of the figures rendered by a `render_figures` pool
+_FIGURE_DATA = {}
+
+
+def _share_figure_data(data):
+    _FIGURE_DATA.clear()
+    _FIGURE_DATA.update(data)
+
+
+def render_figures(plot_func, axes, data, ncores=1):
+    """
+    Render figures, concurrently if more than one core is given.
+
+    The `data` common to all the figures is sent once to each process of
+    the pool, not once per figure.
+
+    Parameters
+    ----------
+    plot_func : function
+        function creating a figure, called with the `data` and the items of
+        each `axes` element as keyword arguments
+    axes : list of dict
+        the arguments specific to each figure
+    data : dict
+        the arguments common to all figures
+    ncores : int
+        number of processes rendering the figures
+
+    Returns
+    -------
+    fig_list : list
+        the figures, in the order of `axes`
+    """
+    jobs = [(plot_func, ax) for ax in axes]
+    ncores = min(ncores, len(jobs))
+    if ncores > 1:
+        with Pool(
+                ncores,
+                initializer=_share_figure_data,
+                initargs=(data,),
+                ) as pool:
+            return pool.starmap(_render_figure, jobs)
+    _share_figure_data(data)
+    try:
+        return [_render_figure(*job) for job in jobs]
+    finally:
+        _FIGURE_DATA.clear()
+
+
+def _render_figure(plot_func, ax):
+    return plot_func(**_FIGURE_DATA, **ax)
+
+
 def in_capri(column, df_columns):
     """
     Check if the selected column is in the set of available columns.
@@ -142,7 +223,150 @@ def update_layout_plotly(fig, x_label, y_label, title=None):
     return fig
 
 
-def box_plot_plotly(gb_full, y_ax, cl_rank, format, scale):
+def density_edges(capri_df, columns, nbins=DENSITY_BINS):
+    """
+    Define the bins of the summarised scatter plots.
+
+    Parameters
+    ----------
+    capri_df : pandas DataFrame
+        capri table dataframe
+    columns : list
+        the columns to bin
+    nbins : int
+        the number of bins of each column
+
+    Returns
+    -------
+    edges : dict
+        {column : bin edges} dictionary
+    """
+    edges = {}
+    for column in columns:
+        values = capri_df[column].to_numpy(dtype=float)
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            low, high = 0.0, 1.0
+        else:
+            low, high = values.min(), values.max()
+        if low == high:
+            low, high = low - 0.5, high + 0.5
+        edges[column] = np.linspace(low, high, nbins + 1)
+    return edges
+
+
+def density_bins(x, y, x_edges, y_edges):
+    """
+    Count the models in each bin of a scatter plot.
+
+    Parameters
+    ----------
+    x : array-like
+        the x values of the models
+    y : array-like
+        the y values of the models
+    x_edges : np.ndarray
+        the bin edges of the x axis
+    y_edges : np.ndarray
+        the bin edges of the y axis
+
+    Returns
+    -------
+    x_centres : np.ndarray
+        the x value of the centre of the non-empty bins
+    y_centres : np.ndarray
+        the y value of the centre of the non-empty bins
+    counts : np.ndarray
+        the number of models in the non-empty bins
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    finite = np.isfinite(x) & np.isfinite(y)
+    counts, _, _ = np.histogram2d(
+        x[finite],
+        y[finite],
+        bins=(x_edges, y_edges),
+        )
+    x_idx, y_idx = np.nonzero(counts)
+    x_centres = (x_edges[:-1] + x_edges[1:]) / 2
+    y_centres = (y_edges[:-1] + y_edges[1:]) / 2
+    return x_centres[x_idx], y_centres[y_idx], counts[x_idx, y_idx]
+
+
+def density_trace(cl_df, x_ax, y_ax, edges, **kwargs):
+    """
+    Create a WebGL trace of the binned models of a cluster.
+
+    The markers are the centres of the non-empty bins, sized by the number
+    of models in the bin.
+
+    Parameters
+    ----------
+    cl_df : pandas DataFrame
+        the models of the cluster
+    x_ax : str
+        name of the x column
+    y_ax : str
+        name of the y column
+    edges : dict
+        {column : bin edges} dictionary, see `density_edges`
+    **kwargs
+        other parameters of the trace
+
+    Returns
+    -------
+    trace : plotly.graph_objects.Scattergl
+    """
+    x, y, counts = density_bins(
+        cl_df[x_ax],
+        cl_df[y_ax],
+        edges[x_ax],
+        edges[y_ax],
+        )
+    sizes = 4 + 12 * np.sqrt(counts / max(counts.max(initial=0), 1))
+    marker = kwargs.pop("marker", {})
+    return go.Scattergl(
+        x=x,
+        y=y,
+        mode="markers",
+        text=[f"Models: {count:.0f}" for count in counts],
+        marker=dict(size=sizes, **marker),
+        **kwargs,
+        )
+
+
+def box_plot_stats(values):
+    """
+    Calculate the statistics drawn in a box plot.
+
+    The whiskers reach the furthest values within 1.5 interquartile ranges
+    of the box, as for the box plots made from all the values.
+
+    Parameters
+    ----------
+    values : pandas Series
+        the values of the box
+
+    Returns
+    -------
+    stats : dict
+        the `q1`, `median`, `q3`, `lowerfence` and `upperfence` values
+    """
+    values = values.dropna().to_numpy(dtype=float)
+    if values.size == 0:
+        return None
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    iqr = q3 - q1
+    return {
+        "q1": [q1],
+        "median": [median],
+        "q3": [q3],
+        "lowerfence": [values[values >= q1 - 1.5 * iqr].min()],
+        "upperfence": [values[values <= q3 + 1.5 * iqr].max()],
+        }
+
+
+def box_plot_plotly(gb_full, y_ax, cl_rank, format, scale, summarise=False):
     """
     Create a scatter plot in plotly.
 
@@ -158,6 +382,9 @@ def box_plot_plotly(gb_full, y_ax, cl_rank, format, scale):
         Produce images in the selected format.
     scale : int
         scale of image
+    summarise : bool
+        Whether the boxes are drawn from their precomputed statistics,
+        instead of all the values. The outliers are not drawn.
 
     Returns
     -------
@@ -172,16 +399,34 @@ def box_plot_plotly(gb_full, y_ax, cl_rank, format, scale):
     # to use color_discrete_map, cluster-id column should be str not int
     gb_full_string = gb_full.astype({"cluster-id": "string"})
 
-    fig = px.box(gb_full_string,
-                 x="capri_rank",
-                 y=f"{y_ax}",
-                 color="cluster-id",
-                 color_discrete_map=color_map,
-                 boxmode="overlay",
-                 points="outliers",
-                 width=1000,
-                 height=800,
-                 )
+    if summarise:
+        fig = go.Figure(layout={"width": 1000, "height": 800})
+        groups = gb_full_string.groupby("cluster-id", sort=False)
+        for cl_id, cl_df in groups:
+            stats = box_plot_stats(cl_df[y_ax])
+            if stats is None:
+                continue
+            fig.add_trace(
+                go.Box(
+                    x=[cl_df["capri_rank"].iloc[0]],
+                    name=cl_id,
+                    legendgroup=cl_id,
+                    marker_color=color_map.get(cl_id, "DarkSlateGrey"),
+                    **stats,
+                    )
+                )
+        fig.update_layout(boxmode="overlay", legend_title_text="cluster-id")
+    else:
+        fig = px.box(gb_full_string,
+                     x="capri_rank",
+                     y=f"{y_ax}",
+                     color="cluster-id",
+                     color_discrete_map=color_map,
+                     boxmode="overlay",
+                     points="outliers",
+                     width=1000,
+                     height=800,
+                     )
     # layout
     update_layout_plotly(fig, "Cluster rank", AXIS_NAMES[y_ax])
     # save figure
@@ -225,7 +470,14 @@ def box_plot_data(capri_df, cl_rank):
     return gb_full
 
 
-def box_plot_handler(capri_filename, cl_rank, format, scale):
+def box_plot_handler(
+        capri_filename,
+        cl_rank,
+        format,
+        scale,
+        ncores=1,
+        max_points=MAX_POINTS,
+        ):
     """
     Create box plots.
 
@@ -234,30 +486,46 @@ def box_plot_handler(capri_filename, cl_rank, format, scale):
 
     Parameters
     ----------
-    capri_filename : str or Path
-        capri single structure filename
+    capri_filename : str, Path or pandas DataFrame
+        capri single structure filename, or its table
     cl_rank : dict
         {cluster_id : cluster_rank} dictionary
     format : str
         Produce images in the selected format.
     scale : int
         scale for images.
+    ncores : int
+        number of processes rendering the plots.
+    max_points : int
+        number of models above which the boxes are drawn from their
+        statistics, without outliers.
+
+    Returns
+    -------
+    fig_list : list
+        a list of figures
     """
     # generating the correct dataframe
-    capri_df = read_capri_table(capri_filename, comment="#")
+    capri_df = load_capri_table(capri_filename, comment="#")
     gb_full = box_plot_data(capri_df, cl_rank)
 
     # iterate over the variables
-    fig_list = []
-    for y_ax in AXIS_NAMES.keys():
-        if not in_capri(y_ax, capri_df.columns):
-            continue
-        fig = box_plot_plotly(gb_full, y_ax, cl_rank, format, scale)
-        fig_list.append(fig)
-    return fig_list
+    axes = [
+        {"y_ax": y_ax}
+        for y_ax in AXIS_NAMES.keys()
+        if in_capri(y_ax, capri_df.columns)
+        ]
+    data = {
+        "gb_full": gb_full,
+        "cl_rank": cl_rank,
+        "format": format,
+        "scale": scale,
+        "summarise": len(capri_df) > max_points,
+        }
+    return render_figures(box_plot_plotly, axes, data, ncores=ncores)
 
 
-def scatter_plot_plotly(gb_cluster, gb_other, cl_rank, x_ax, y_ax, colors, format, scale):  # noqa:E501
+def scatter_plot_plotly(gb_cluster, gb_other, cl_rank, x_ax, y_ax, colors, format, scale, edges=None):  # noqa:E501
     """
     Create a scatter plot in plotly.
 
@@ -279,6 +547,9 @@ def scatter_plot_plotly(gb_cluster, gb_other, cl_rank, x_ax, y_ax, colors, forma
         Produce images in the selected format.
     scale : int
         scale for images.
+    edges : dict, optional
+        {column : bin edges} dictionary. If given, the models are binned
+        and drawn with WebGL, see `density_trace`.
 
     Returns
     -------
@@ -297,14 +568,34 @@ def scatter_plot_plotly(gb_cluster, gb_other, cl_rank, x_ax, y_ax, colors, forma
             color_idx = (cl_rank[cl_id] - 1) % n_colors  # color index
             x_mean = np.mean(cl_df[x_ax])
             y_mean = np.mean(cl_df[y_ax])
-            # refactored due to E501 line too long
-            text_list = []
-            for n in range(cl_df.shape[0]):
-                model_text = cl_df['model'].iloc[n].split('/')[-1]
-                score_text = cl_df['score'].iloc[n]
-                text_list.append(f"Model: {model_text}<br>Score: {score_text}")
-            traces.append(
-                go.Scatter(
+            hoverlabel = dict(
+                bgcolor=colors[color_idx],
+                font_size=16,
+                font_family="Helvetica",
+                )
+            if edges is not None:
+                traces.append(
+                    density_trace(
+                        cl_df,
+                        x_ax,
+                        y_ax,
+                        edges,
+                        name=cl_name,
+                        legendgroup=cl_name,
+                        marker=dict(color=colors[color_idx]),
+                        hoverlabel=hoverlabel,
+                        )
+                    )
+            else:
+                # refactored due to E501 line too long
+                text_list = []
+                for n in range(cl_df.shape[0]):
+                    model_text = cl_df['model'].iloc[n].split('/')[-1]
+                    score_text = cl_df['score'].iloc[n]
+                    text_list.append(
+                        f"Model: {model_text}<br>Score: {score_text}"
+                        )
+                traces.append(go.Scatter(
                     x=cl_df[x_ax],
                     y=cl_df[y_ax],
                     name=cl_name,
@@ -312,13 +603,8 @@ def scatter_plot_plotly(gb_cluster, gb_other, cl_rank, x_ax, y_ax, colors, forma
                     text=text_list,
                     legendgroup=cl_name,
                     marker_color=colors[color_idx],
-                    hoverlabel=dict(
-                        bgcolor=colors[color_idx],
-                        font_size=16,
-                        font_family="Helvetica",
-                        ),
-                    )
-                )
+                    hoverlabel=hoverlabel,
+                    ))
             clt_text = f"{cl_name}<br>"
             if "score" not in [x_ax, y_ax]:
                 clt_text += f"Score: {np.mean(cl_df['score']):.3f}<br>"
@@ -351,7 +637,24 @@ def scatter_plot_plotly(gb_cluster, gb_other, cl_rank, x_ax, y_ax, colors, forma
                     )
                 )
     # append trace other
-    if not gb_other.empty:
+    if not gb_other.empty and edges is not None:
+        traces.append(
+            density_trace(
+                gb_other,
+                x_ax,
+                y_ax,
+                edges,
+                name="Other",
+                legendgroup="Other",
+                marker=dict(
+                    color="white", line=dict(width=2, color="DarkSlateGrey")
+                    ),
+                hoverlabel=dict(
+                    bgcolor="white", font_size=16, font_family="Helvetica",
+                    ),
+                )
+            )
+    elif not gb_other.empty:
         # refactored due to E501 line too long
         text_list_other = []
         for n in range(gb_other.shape[0]):
@@ -416,51 +719,67 @@ def scatter_plot_data(capri_df, cl_rank):
     return gb_cluster, gb_other
 
 
-def scatter_plot_handler(capri_filename, cl_rank, format, scale):
+def scatter_plot_handler(
+        capri_filename,
+        cl_rank,
+        format,
+        scale,
+        ncores=1,
+        max_points=MAX_POINTS,
+        ):
     """
     Create scatter plots.
 
     The idea is that for each pair of variables of interest (SCATTER_PAIRS,
      declared as global) we create a scatter plot.
     If available, each scatter plot containts cluster information.
+    Above `max_points` models, the models are binned on a grid common to
+    all the clusters, so that the size of the plots does not depend on the
+    number of models.
 
     Parameters
     ----------
-    capri_filename : str or Path
-        capri single structure filename
+    capri_filename : str, Path or pandas DataFrame
+        capri single structure filename, or its table
     cl_rank : dict
         {cluster_id : cluster_rank} dictionary
     format : str
         Produce images in the selected format.
     scale : int
         scale for images.
+    ncores : int
+        number of processes rendering the plots.
+    max_points : int
+        number of models above which the models are binned.
 
     Returns
     -------
     fig_list : list
         a list of figures
     """
-    capri_df = read_capri_table(capri_filename, comment="#")
+    capri_df = load_capri_table(capri_filename, comment="#")
     gb_cluster, gb_other = scatter_plot_data(capri_df, cl_rank)
 
-    # defining colors
-    colors = px_colors.qualitative.Alphabet
-    fig_list = []
-    for x_ax, y_ax in SCATTER_PAIRS:
-        if not in_capri(x_ax, capri_df.columns):
-            continue
-        if not in_capri(y_ax, capri_df.columns):
-            continue
-        fig = scatter_plot_plotly(gb_cluster,
-                                  gb_other,
-                                  cl_rank,
-                                  x_ax,
-                                  y_ax,
-                                  colors,
-                                  format,
-                                  scale)
-        fig_list.append(fig)
-    return fig_list
+    axes = [
+        {"x_ax": x_ax, "y_ax": y_ax}
+        for x_ax, y_ax in SCATTER_PAIRS
+        if in_capri(x_ax, capri_df.columns)
+        and in_capri(y_ax, capri_df.columns)
+        ]
+    data = {
+        "gb_cluster": gb_cluster,
+        "gb_other": gb_other,
+        "cl_rank": cl_rank,
+        # defining colors
+        "colors": px_colors.qualitative.Alphabet,
+        "format": format,
+        "scale": scale,
+        }
+    if len(capri_df) > max_points:
+        log.info(f"Binning the {len(capri_df)} models of the scatter plots")
+        columns = {ax for pair in axes for ax in pair.values()}
+        data["edges"] = density_edges(capri_df, sorted(columns))
+    return render_figures(scatter_plot_plotly, axes, data, ncores=ncores)
 
 
 def _report_grid_size(plot_list):
@@ -584,8 +903,8 @@ def find_best_struct(ss_file, number_of_struct=10):
 
     Parameters
     ----------
-    ss_file : path
-        path to capri_ss.tsv
+    ss_file : path or pandas DataFrame
+        path to capri_ss.tsv, or its table
     number_of_struct: int
         number of models with lower model-cluster-ranking
 
@@ -594,7 +913,7 @@ def find_best_struct(ss_file, number_of_struct=10):
     best_struct_df : pandas DataFrame
         DataFrame of best structures
     """
-    dfss = read_capri_table(ss_file)
+    dfss = load_capri_table(ss_file)
     dfss = dfss.sort_values(by=["cluster-id", "model-cluster-ranking"])
     # TODO need a check for "Unclustered"
 
@@ -696,17 +1015,17 @@ def clt_table_handler(clt_file, ss_file):
 
     Parameters
     ----------
-    clt_file : str or Path
-        path to capri_clt.tsv file
-    ss_file: str or Path
-        path to capri_ss.tsv file
+    clt_file : str, Path or pandas DataFrame
+        path to capri_clt.tsv file, or its table
+    ss_file: str, Path or pandas DataFrame
+        path to capri_ss.tsv file, or its table
 
     Returns
     -------
     fig :
         an instance of plotly.graph_objects.Figure
     """
-    dfcl = read_capri_table(clt_file)
+    dfcl = load_capri_table(clt_file)
     statistics_df = clean_capri_table(dfcl)
     structs_df = find_best_struct(ss_file, number_of_struct=10)
     structs_df = _add_links(structs_df)
@@ -0,0 +1,541 @@
+"""
+Run-wide registry of models.
+
+The registry is a SQLite database stored in the run directory. It keeps,
+for every step of the workflow, the models exported by that step with their
+scores, energies, cluster assignments and, if available, CAPRI metrics. It
+is populated while the workflow runs, so analysis tools can query models
+across steps without re-parsing the output files of each step. The
+model-to-reference residue numbering calculated by ``caprieval`` is also
+kept, so it is reused by later ``caprieval`` steps, as are the CAPRI metrics
+of each model content, reference and parameters. ``haddock3-analyse`` reuses
+these metrics as well.
+
+Main functions
+--------------
+
+* :py:class:`ModelRegistry`
+* :py:func:`parse_filter`
+* :py:func:`get_run_registry`
+
+Example
+-------
+
+Top 200 models by score in step 7 with i-RMSD lower than 4::
+
+    >>> registry = ModelRegistry("run1/registry.db")
+    >>> registry.query(step=7, filters=["irmsd<4"], limit=200)
+"""
+import contextlib
+import json
+import re
+import sqlite3
+from pathlib import Path
+
+from haddock.core.defaults import MODEL_REGISTRY_FILE
+
+
+MODEL_COLUMNS = (
+    "step",
+    "step_name",
+    "model",
+    "path",
+    "ori_name",
+    "md5",
+    "checksum",
+    "score",
+    "clt_id",
+    "clt_rank",
+    "clt_model_rank",
+    )
+
+CAPRI_COLUMNS = ("irmsd", "fnat", "lrmsd", "ilrmsd", "dockq")
+
+FILTER_OPERATORS = ("<=", ">=", "!=", "<", ">", "=")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS models (
+    step INTEGER NOT NULL,
+    step_name TEXT,
+    model TEXT NOT NULL,
+    path TEXT,
+    ori_name TEXT,
+    md5 TEXT,
+    checksum TEXT,
+    score REAL,
+    clt_id INTEGER,
+    clt_rank INTEGER,
+    clt_model_rank INTEGER,
+    PRIMARY KEY (step, model)
+    );
+CREATE TABLE IF NOT EXISTS energies (
+    step INTEGER NOT NULL,
+    model TEXT NOT NULL,
+    term TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (step, model, term)
+    );
+CREATE TABLE IF NOT EXISTS capri (
+    step INTEGER NOT NULL,
+    model TEXT NOT NULL,
+    irmsd REAL,
+    fnat REAL,
+    lrmsd REAL,
+    ilrmsd REAL,
+    dockq REAL,
+    PRIMARY KEY (step, model)
+    );
+CREATE TABLE IF NOT EXISTS numbering (
+    key TEXT PRIMARY KEY,
+    numbering TEXT
+    );
+CREATE TABLE IF NOT EXISTS capri_cache (
+    key TEXT PRIMARY KEY,
+    metrics TEXT
+    );
+CREATE INDEX IF NOT EXISTS models_score ON models (step, score);
+CREATE INDEX IF NOT EXISTS models_checksum ON models (checksum);
+CREATE INDEX IF NOT EXISTS capri_irmsd ON capri (step, irmsd);
+CREATE INDEX IF NOT EXISTS energies_term ON energies (step, term, value);
+"""
+
+_filter_regex = re.compile(
+    r"^\s*(\w+)\s*(" + "|".join(map(re.escape, FILTER_OPERATORS)) + r")\s*(.+?)\s*$"  # noqa: E501
+    )
+
+
+class RegistryError(Exception):
+    """Raised when something goes wrong with the model registry."""
+
+    def __init__(self, msg=""):
+        self.msg = msg
+        super().__init__(self.msg)
+
+
+def parse_filter(filter_str):
+    """
+    Parse a filter expression.
+
+    Examples
+    --------
+    >>> parse_filter("irmsd<4")
+    ('irmsd', '<', 4.0)
+
+    >>> parse_filter("clt_rank = 1")
+    ('clt_rank', '=', 1.0)
+
+    Parameters
+    ----------
+    filter_str : str
+        An expression in the form ``<column><operator><value>``.
+
+    Returns
+    -------
+    tuple
+        The column, the operator and the value. The value is converted
+        to `float` when possible.
+
+    Raises
+    ------
+    RegistryError
+        If the expression cannot be parsed.
+    """
+    match = _filter_regex.match(filter_str)
+    if not match:
+        raise RegistryError(f"Filter {filter_str!r} could not be parsed.")
+    column, operator, value = match.groups()
+    try:
+        value = float(value)
+    except ValueError:
+        value = value.strip("'\"")
+    return column, operator, value
+
+
+def _cluster_id(clt_id):
+    """Convert a cluster id to `int`, `None` for unclustered models."""
+    try:
+        return int(clt_id)
+    except (TypeError, ValueError):
+        # `None` or "-"
+        return None
+
+
+def _iter_models(models):
+    """Iterate over models, unpacking ensembles given as dictionaries."""
+    for model in models:
+        if isinstance(model, dict):
+            yield from model.values()
+        else:
+            yield model
+
+
+class ModelRegistry:
+    """Registry of the models of a run stored in a SQLite database."""
+
+    def __init__(self, db_path):
+        """
+        Open the registry, creating the database if needed.
+
+        Parameters
+        ----------
+        db_path : str or pathlib.Path
+            Path to the SQLite database.
+        """
+        self.db_path = Path(db_path)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def register_models(self, step, step_name, models):
+        """
+        Register the models exported by a step.
+
+        Models previously registered for the same step are replaced.
+
+        Parameters
+        ----------
+        step : int
+            The index of the step in the workflow.
+
+        step_name : str
+            The name of the module.
+
+        models : list
+            The :py:class:`haddock.libs.libontology.PDBFile` objects. Lists
+            of dictionaries, as exported by the topology modules, are
+            accepted. Their content checksum is the `checksum` calculated
+            when they were exported.
+        """
+        model_rows = []
+        energy_rows = []
+        for model in _iter_models(models):
+            model_rows.append((
+                step,
+                step_name,
+                model.file_name,
+                str(model.rel_path),
+                model.ori_name,
+                model.md5,
+                getattr(model, "checksum", None),
+                model.score,
+                _cluster_id(model.clt_id),
+                model.clt_rank,
+                model.clt_model_rank,
+                ))
+            for term, value in (model.unw_energies or {}).items():
+                energy_rows.append((step, model.file_name, term, value))
+
+        with self._connect() as conn:
+            conn.execute("DELETE FROM models WHERE step = ?", (step,))
+            conn.execute("DELETE FROM energies WHERE step = ?", (step,))
+            conn.executemany(
+                f"INSERT OR REPLACE INTO models VALUES ({', '.join('?' * len(MODEL_COLUMNS))})",  # noqa: E501
+                model_rows,
+                )
+            conn.executemany(
+                "INSERT OR REPLACE INTO energies VALUES (?, ?, ?, ?)",
+                energy_rows,
+                )
+
+    def register_capri(self, step, rows):
+        """
+        Register the CAPRI metrics calculated in a step.
+
+        Parameters
+        ----------
+        step : int
+            The index of the step in the workflow.
+
+        rows : iterable of dict
+            Each dictionary must have the ``model`` key, with the model
+            file name, and may have any of the :py:data:`CAPRI_COLUMNS`.
+        """
+        values = [
+            (step, row["model"]) + tuple(row.get(k) for k in CAPRI_COLUMNS)
+            for row in rows
+            ]
+        with self._connect() as conn:
+            conn.execute("DELETE FROM capri WHERE step = ?", (step,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO capri VALUES (?, ?, ?, ?, ?, ?, ?)",
+                values,
+                )
+
+    def steps(self):
+        """
+        List the registered steps.
+
+        Returns
+        -------
+        list of tuples
+            The index and the module name of each step.
+        """
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT DISTINCT step, step_name FROM models ORDER BY step"
+                ).fetchall()
+
+    def energy_terms(self):
+        """List the registered energy terms."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT DISTINCT term FROM energies")
+            return sorted(r[0] for r in rows)
+
+    def _column_sql(self, column, terms):
+        """Translate a column name to its SQL expression."""
+        if column in MODEL_COLUMNS:
+            return f"m.{column}"
+        if column in CAPRI_COLUMNS:
+            return f"c.{column}"
+        if column in terms:
+            return (
+                "(SELECT e.value FROM energies e WHERE e.step = m.step "
+                "AND e.model = m.model AND e.term = ?)"
+                )
+        raise RegistryError(
+            f"Unknown column {column!r}. Available columns are: "
+            f"{', '.join(MODEL_COLUMNS + CAPRI_COLUMNS + tuple(terms))}."
+            )
+
+    def query(
+            self,
+            step=None,
+            filters=None,
+            sortby="score",
+            ascending=True,
+            limit=None,
+            ):
+        """
+        Query the registered models.
+
+        Parameters
+        ----------
+        step : int, optional
+            Restrict the query to a step. Queries all steps if not given.
+
+        filters : list, optional
+            Filter expressions, either strings as accepted by
+            :py:func:`parse_filter` or ``(column, operator, value)``
+            tuples. Energy terms can be used as columns.
+
+        sortby : str
+            The column used to sort the models.
+
+        ascending : bool
+            Whether to sort in ascending order.
+
+        limit : int, optional
+            The maximum number of models to return.
+
+        Returns
+        -------
+        list of dict
+            One dictionary per model with the model and CAPRI columns.
+        """
+        terms = self.energy_terms()
+        clauses = []
+        params = []
+
+        if step is not None:
+            clauses.append("m.step = ?")
+            params.append(int(step))
+
+        for filter_ in filters or []:
+            if isinstance(filter_, str):
+                filter_ = parse_filter(filter_)
+            column, operator, value = filter_
+            if operator not in FILTER_OPERATORS:
+                raise RegistryError(f"Unknown operator {operator!r}.")
+            column_sql = self._column_sql(column, terms)
+            if column_sql.startswith("(SELECT"):
+                params.append(column)
+            clauses.append(f"{column_sql} {operator} ?")
+            params.append(value)
+
+        sort_sql = self._column_sql(sortby, terms)
+        order_params = [sortby] if sort_sql.startswith("(SELECT") else []
+        direction = "ASC" if ascending else "DESC"
+
+        columns = [f"m.{c}" for c in MODEL_COLUMNS]
+        columns += [f"c.{c}" for c in CAPRI_COLUMNS]
+        sql = (
+            f"SELECT {', '.join(columns)} FROM models m "
+            "LEFT JOIN capri c ON c.step = m.step AND c.model = m.model"
+            )
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += f" ORDER BY {sort_sql} IS NULL, {sort_sql} {direction}"
+        params.extend(order_params * 2)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+
+        keys = MODEL_COLUMNS + CAPRI_COLUMNS
+        with self._connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [dict(zip(keys, row)) for row in rows]
+
+    def find_by_checksum(self, checksum):
+        """
+        Find the registered entries of a model by its content checksum.
+
+        Parameters
+        ----------
+        checksum : str
+            The content checksum of the model file.
+
+        Returns
+        -------
+        list of dict
+            The matching entries, in step order.
+        """
+        return self.query(
+            filters=[("checksum", "=", checksum)],
+            sortby="step",
+            )
+
+    def get_numbering(self, key):
+        """
+        Get a stored model-to-reference numbering.
+
+        Parameters
+        ----------
+        key : str
+            The numbering identifier, see
+            :py:func:`haddock.libs.libalign.numbering_key`.
+
+        Returns
+        -------
+        dict, bool or None
+            The numbering dictionary (one dictionary per chain), `False` if
+            the alignment could not match the chains, or `None` if the
+            numbering is not stored.
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT numbering FROM numbering WHERE key = ?",
+                (key,),
+                ).fetchone()
+        if row is None:
+            return None
+        numbering = json.loads(row[0])
+        if not numbering:
+            return numbering
+        return {
+            chain: {model_res: ref_res for model_res, ref_res in pairs}
+            for chain, pairs in numbering
+            }
+
+    def store_numbering(self, key, numbering):
+        """
+        Store a model-to-reference numbering.
+
+        Parameters
+        ----------
+        key : str
+            The numbering identifier, see
+            :py:func:`haddock.libs.libalign.numbering_key`.
+
+        numbering : dict or bool
+            The numbering dictionary (one dictionary per chain), or `False`.
+        """
+        self.store_numberings({key: numbering})
+
+    def store_numberings(self, numberings):
+        """
+        Store several model-to-reference numberings at once.
+
+        Parameters
+        ----------
+        numberings : dict
+            The numberings, see :py:meth:`store_numbering`, by numbering
+            identifier.
+        """
+        rows = []
+        for key, numbering in numberings.items():
+            if numbering:
+                # residue numbers are kept as integers
+                numbering = [
+                    [chain, list(residues.items())]
+                    for chain, residues in numbering.items()
+                    ]
+            rows.append((key, json.dumps(numbering)))
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO numbering VALUES (?, ?)",
+                rows,
+                )
+
+    def get_capri_cache(self, keys):
+        """
+        Get stored CAPRI metrics.
+
+        Parameters
+        ----------
+        keys : iterable of str
+            The metrics identifiers, see
+            :py:func:`haddock.modules.analysis.caprieval.capri.capri_cache_keys`.
+
+        Returns
+        -------
+        dict
+            The metrics dictionary of each stored key.
+        """
+        keys = list(keys)
+        found = {}
+        with self._connect() as conn:
+            # stay below the SQLite limit of variables per statement
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = conn.execute(
+                    "SELECT key, metrics FROM capri_cache "
+                    f"WHERE key IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                    ).fetchall()
+                found.update((key, json.loads(value)) for key, value in rows)
+        return found
+
+    def store_capri_cache(self, metrics):
+        """
+        Store CAPRI metrics.
+
+        Parameters
+        ----------
+        metrics : dict
+            The metrics dictionary of each key, see
+            :py:func:`haddock.modules.analysis.caprieval.capri.capri_cache_keys`.
+        """
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO capri_cache VALUES (?, ?)",
+                ((key, json.dumps(value)) for key, value in metrics.items()),
+                )
+
+
+def get_run_registry(run_dir):
+    """
+    Get the model registry of a run.
+
+    Parameters
+    ----------
+    run_dir : str or pathlib.Path
+        The run directory.
+
+    Returns
+    -------
+    :py:class:`ModelRegistry` or None
+        `None` if `run_dir` is not a run directory, that is, it does not
+        have a ``data`` folder.
+    """
+    run_dir = Path(run_dir)
+    if not Path(run_dir, "data").is_dir():
+        return None
+    return ModelRegistry(Path(run_dir, MODEL_REGISTRY_FILE))
@@ -1,6 +1,7 @@
 """General utilities."""
 import collections.abc
 import contextlib
+import hashlib
 import re
 import shutil
 import subprocess
@@ -85,6 +86,30 @@ def copy_files_to_dir(paths, directory):
         shutil.copy(path, directory)
 
 
+def file_checksum(path, block_size=2**20):
+    """
+    Calculate the MD5 checksum of a file's content.
+
+    Parameters
+    ----------
+    path : str or Path
+        Path to the file.
+
+    block_size : int
+        The number of bytes read at each iteration. Defaults to 1MB.
+
+    Returns
+    -------
+    str
+        The hexadecimal digest.
+    """
+    md5 = hashlib.md5()
+    with open(path, 'rb') as fin:
+        for block in iter(lambda: fin.read(block_size), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
 def remove_folder(folder):
     """
     Remove a folder if it exists.
@@ -1,5 +1,6 @@
 """HADDOCK3 modules."""
 import re
+import sqlite3
 from abc import ABC, abstractmethod
 from contextlib import contextmanager, suppress
 from copy import deepcopy
@@ -13,11 +14,13 @@ from haddock.gear import config
 from haddock.gear.clean_steps import clean_output
 from haddock.gear.parameters import config_mandatory_general_parameters
 from haddock.gear.yaml2cfg import read_from_yaml_config
+from haddock.libs.libcoords import get_run_store
 from haddock.libs.libhpc import HPCScheduler
 from haddock.libs.libio import folder_exists, working_directory
 from haddock.libs.libmpi import MPIScheduler
 from haddock.libs.libontology import ModuleIO
 from haddock.libs.libparallel import Scheduler
+from haddock.libs.libregistry import get_run_registry
 from haddock.libs.libtimer import log_time
 from haddock.libs.libutil import recursive_dict_update
 
@@ -202,10 +205,15 @@ class BaseHaddockModule(ABC):
     def add_parent_to_paths(self):
         """Add parent path to paths."""
         # convert paths to relative by appending parent
+        def add_parent(path):
+            return path if Path(path).is_absolute() else Path('..', path)
+
         for key, value in self.params.items():
             if value and key.endswith('_fname'):
-                if not Path(value).is_absolute():
-                    self.params[key] = Path('..', value)
+                if isinstance(value, (list, tuple)):
+                    self.params[key] = [add_parent(v) for v in value]
+                else:
+                    self.params[key] = add_parent(value)
         return
 
     def run(self, **params):
@@ -241,7 +249,12 @@ class BaseHaddockModule(ABC):
         """
         return
 
-    def export_output_models(self, faulty_tolerance=0):
+    def export_output_models(
+            self,
+            faulty_tolerance=0,
+            min_size=0,
+            checksum=False,
+            ):
         """
         Export output to the ModuleIO interface.
 
@@ -257,11 +270,25 @@ class BaseHaddockModule(ABC):
             The percentage of missing output allowed. If 20 is given,
             raises an error if 20% of the expected output is missing (not
             saved to disk).
+
+        min_size : int, default 0
+            Output files smaller than `min_size` bytes are considered
+            missing.
+
+        checksum : bool, default False
+            Whether to store the checksum of each output file in the
+            exported models. Checksums are always stored when the run has
+            a model registry, where they identify the models by content.
         """
         assert self.output_models, "`self.output_models` cannot be empty."
+        registry = self.get_registry()
         io = ModuleIO()
         io.add(self.output_models, "o")
-        faulty = io.check_faulty()
+        faulty = io.check_faulty(
+            min_size=min_size,
+            checksum=checksum or registry is not None,
+            ncores=self.params.get("ncores", 1),
+            )
         if faulty > faulty_tolerance:
             _msg = (
                 f"{faulty:.2f}% of output was not generated for this module "
@@ -269,6 +296,93 @@ class BaseHaddockModule(ABC):
             self.finish_with_error(_msg)
         io.save()
 
+        self.query_registry(
+            "register_models",
+            self.order,
+            self.name,
+            io.output,
+            registry=registry,
+            )
+        self.update_coordinate_store(io.output)
+
+    def update_coordinate_store(self, models):
+        """
+        Add models to the coordinate store of the run, if there is one.
+
+        Errors updating the store are logged but do not stop the module.
+
+        Parameters
+        ----------
+        models : list
+            The exported :py:class:`haddock.libs.libontology.PDBFile`
+            objects.
+        """
+        step_path = Path.cwd()
+        if not step_folder_regex_re.fullmatch(step_path.name):
+            return
+        store = get_run_store(step_path.parent, create=True)
+        if store is None:
+            return
+        try:
+            store.add_models(models, ncores=self.params.get("ncores", 1))
+        except (OSError, ValueError) as err:
+            self.log(
+                f"Could not update the coordinate store: {err}",
+                "warning",
+                )
+
+    def get_registry(self):
+        """
+        Get the model registry of the run this step belongs to.
+
+        Returns
+        -------
+        :py:class:`haddock.libs.libregistry.ModelRegistry` or None
+            `None` if the current working directory is not a step folder
+            of a run directory.
+        """
+        step_path = Path.cwd()
+        if not step_folder_regex_re.fullmatch(step_path.name):
+            return None
+        try:
+            return get_run_registry(step_path.parent)
+        except sqlite3.Error as err:
+            self.log(f"Could not open the model registry: {err}", "warning")
+            return None
+
+    def query_registry(self, method, *args, registry=None):
+        """
+        Call a method of the model registry of the run, if there is one.
+
+        Errors are logged but do not stop the module.
+
+        Parameters
+        ----------
+        method : str
+            The name of the :py:class:`haddock.libs.libregistry.ModelRegistry`
+            method to call.
+
+        *args
+            The arguments passed to `method`.
+
+        registry : :py:class:`haddock.libs.libregistry.ModelRegistry`, optional
+            The registry to call, instead of the one of the step.
+
+        Returns
+        -------
+        The value returned by `method`, `None` if there is no registry or
+        the call failed.
+        """
+        if registry is None:
+            registry = self.get_registry()
+        if registry is None:
+            return None
+        try:
+            return getattr(registry, method)(*args)
+        except sqlite3.Error as err:
+            self.log(f"Could not access the model registry: {err}", "warning")
+            return None
+
     def finish_with_error(self, reason="Module has failed."):
         """Finish with error message."""
         if isinstance(reason, Exception):
@@ -321,8 +435,12 @@ class BaseHaddockModule(ABC):
     def _confirm_fnames_exist(self):
         for param, value in self._params.items():
             if param.endswith('_fname') and value:
-                if not Path(value).exists():
-                    raise FileNotFoundError(f'File not found: {str(value)!r}')
+                paths = value if isinstance(value, (list, tuple)) else [value]
+                for path in paths:
+                    if not Path(path).exists():
+                        raise FileNotFoundError(
+                            f'File not found: {str(path)!r}'
+                            )
 
     def _fill_emptypaths(self):
         """Fill empty paths."""
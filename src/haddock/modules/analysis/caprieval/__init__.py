@@ -1,13 +1,20 @@
 """Calculate CAPRI metrics."""
 from pathlib import Path
 
+from haddock.libs.libalign import pdb2fastadic
 from haddock.libs.libparallel import Scheduler
+from haddock.libs.libutil import transform_to_list
 from haddock.modules import BaseHaddockModule
 from haddock.modules.analysis.caprieval.capri import (
     CAPRI,
+    CAPRIJob,
+    ReferenceContext,
+    capri_cache_keys,
     capri_cluster_analysis,
     merge_data,
     rearrange_ss_capri_output,
+    references_header,
+    row_reference_metrics,
     )
 
 
@@ -23,6 +30,9 @@ class HaddockModule(BaseHaddockModule):
     def __init__(self, order, path, *ignore, init_params=DEFAULT_CONFIG,
                  **everything):
         super().__init__(order, path, init_params)
+        # registry keeping the metrics of the models evaluated before, when
+        #  the module does not run as a step of the run (haddock3-analyse)
+        self.cache_registry = None
 
     @classmethod
     def confirm_installation(cls):
@@ -43,13 +53,61 @@ class HaddockModule(BaseHaddockModule):
         models.sort()
         best_model_fname = Path(models[0].rel_path)
 
-        if self.params["reference_fname"]:
-            reference = Path(self.params["reference_fname"])
-        else:
+        references = [
+            Path(ref)
+            for ref in transform_to_list(self.params["reference_fname"])
+            if ref
+            ]
+        if not references:
             self.log(
                 "No reference was given. "
                 "Using the structure with the lowest score from previous step")
-            reference = best_model_fname
+            references = [best_model_fname]
+        elif len(references) > 1:
+            self.log(
+                f"Evaluating the models against {len(references)} references"
+                )
+
+        # metrics of identical models evaluated by a previous step
+        registry = self.cache_registry or self.get_registry()
+        cache_keys = [[None] * len(references) for _ in models]
+        cached = {}
+        if registry is not None:
+            cache_keys = capri_cache_keys(models, references, self.params)
+            cached = self.query_registry(
+                "get_capri_cache",
+                [key for keys in cache_keys for key in keys],
+                registry=registry,
+                ) or {}
+        cached_metrics = [
+            [cached.get(key) for key in keys] for keys in cache_keys
+            ]
+        pending = [
+            i for i, metrics in enumerate(cached_metrics) if None in metrics
+            ]
+        self.log(
+            f"{len(models) - len(pending)} models evaluated by a previous "
+            f"step, {len(pending)} to evaluate"
+            )
+
+        # The reference-side data is calculated once and shared
+        #  read-only with all the jobs
+        pending_models = [models[i] for i in pending]
+        sequences = None
+        if self.params["alignment_method"] != "structure":
+            sequences = [pdb2fastadic(model) for model in pending_models]
+        reference_contexts = []
+        for reference in references:
+            reference_context = ReferenceContext(reference, self.params)
+            # models sharing a sequence share the numbering to the reference
+            reference_context.precompute_numbering(
+                pending_models,
+                self.params,
+                path=Path("."),
+                registry=registry,
+                sequences=sequences,
+                )
+            reference_contexts.append(reference_context)
 
         # Each model is a job; this is not the most efficient way
         #  but by assigning each model to an individual job
@@ -62,27 +120,67 @@ class HaddockModule(BaseHaddockModule):
                     identificator=i,
                     model=model_to_be_evaluated,
                     path=Path("."),
-                    reference=reference,
-                    params=self.params
+                    reference=references[0],
+                    params=self.params,
+                    reference_context=reference_contexts[0],
+                    reference_contexts=reference_contexts,
+                    cached_metrics=cached_metrics[i - 1],
+                    registry=registry,
                     )
                 )
 
-        ncores = self.params['ncores']
-        capri_engine = Scheduler(capri_jobs, ncores=ncores)
-        capri_engine.run()
+        # the jobs return their rows, the tables are built here
+        rows = [None] * len(capri_jobs)
+        new_numberings = {}
+        if pending:
+            capri_engine = Scheduler(
+                [CAPRIJob(capri_jobs[i]) for i in pending],
+                ncores=self.params['ncores'],
+                collect_results=True,
+                )
+            capri_engine.run()
+            for i, (row, numberings) in zip(pending, capri_engine.results):
+                rows[i] = row
+                new_numberings.update(numberings)
+        # the numberings aligned by the jobs, the structural ones
+        if new_numberings:
+            self.query_registry(
+                "store_numberings",
+                new_numberings,
+                registry=registry,
+                )
+        for i, job in enumerate(capri_jobs):
+            if job.is_cached():
+                rows[i] = job.run()
+
+        new_metrics = {}
+        for i in pending:
+            if rows[i] is None or cache_keys[i][0] is None:
+                continue
+            reference_metrics = row_reference_metrics(rows[i], len(references))
+            for key, metrics, cached in zip(
+                    cache_keys[i],
+                    reference_metrics,
+                    cached_metrics[i],
+                    ):
+                if cached is None:
+                    new_metrics[key] = metrics
+        if new_metrics:
+            self.query_registry(
+                "store_capri_cache",
+                new_metrics,
+                registry=registry,
+                )
 
-        # very ugly way of loading the capri metrics back into
-        #  the CAPRI object, there's definitively a better way
-        #  of doing this
-        capri_jobs = merge_data(capri_jobs)
+        capri_jobs = merge_data(capri_jobs, rows)
 
-        # Each job created one .tsv, unify them:
         rearrange_ss_capri_output(
+            rows,
             output_name="capri_ss.tsv",
-            output_count=len(capri_jobs),
             sort_key=self.params["sortby"],
             sort_ascending=self.params["sort_ascending"],
-            path=Path(".")
+            path=Path("."),
+            info_header=references_header(references),
             )
 
         capri_cluster_analysis(
@@ -100,3 +198,8 @@ class HaddockModule(BaseHaddockModule):
         #  no operation is done on them
         self.output_models = models
         self.export_output_models()
+        self.query_registry(
+            "register_capri",
+            self.order,
+            [capri.registry_row() for capri in capri_jobs],
+            )
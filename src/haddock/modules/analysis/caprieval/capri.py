@@ -1,13 +1,16 @@
 """CAPRI module."""
+import hashlib
+import json
 import os
 import shutil
 import tempfile
-from itertools import combinations
+from contextlib import suppress
+from functools import partial
 from pathlib import Path
 
 import numpy as np
+from numpy.lib import recfunctions
 from pdbtools import pdb_segxchain
-from scipy.spatial.distance import cdist
 
 from haddock import log
 from haddock.libs.libalign import (
@@ -16,17 +19,168 @@ from haddock.libs.libalign import (
     centroid,
     get_align,
     get_atoms,
+    identity_numbering,
     kabsch,
     load_coords,
     make_range,
+    numbering_key,
+    pdb2fastadic,
+    select_atoms,
     )
-from haddock.libs.libio import write_dic_to_file, write_nested_dic_to_file
+from haddock.libs.libcontacts import residue_contacts
+from haddock.libs.libcoords import load_atoms
+from haddock.libs.libio import write_nested_dic_to_file
 from haddock.libs.libontology import PDBFile
+from haddock.libs.libutil import file_checksum
+
+
+CAPRI_METRICS = ("irmsd", "fnat", "lrmsd", "ilrmsd", "dockq")
+"""The CAPRI metrics calculated for each model."""
+
+CACHE_PARAMS = (
+    "receptor_chain",
+    "ligand_chain",
+    "alignment_method",
+    "fnat",
+    "fnat_cutoff",
+    "irmsd",
+    "irmsd_cutoff",
+    "lrmsd",
+    "ilrmsd",
+    "dockq",
+    )
+"""The parameters the CAPRI metrics of a model depend on."""
 
+# the metrics where the larger value is the best
+_HIGHER_IS_BETTER = ("fnat", "dockq")
+# the metric choosing the best reference, the first one calculated
+_BEST_REFERENCE_ORDER = ("dockq", "irmsd", "lrmsd", "ilrmsd", "fnat")
 
-def load_contacts(pdb_f, cutoff=5.0):
+
+def best_of_references(reference_metrics):
     """
-    Load residue-based contacts.
+    Get the CAPRI metrics of the best reference.
+
+    The best reference is the one with the best DockQ, or the best of the
+    first other metric calculated, in the order I-RMSD, L-RMSD, I-L-RMSD
+    and FNAT. All the metrics are taken from that reference, so that they
+    describe the same comparison.
+
+    Parameters
+    ----------
+    reference_metrics : list
+        The metrics of the model for each reference, see
+        :py:meth:`CAPRI.evaluate`, `None` for the failed references.
+
+    Returns
+    -------
+    best : dict
+        The metrics of the best reference, `nan` if they were not
+        calculated.
+    best_reference : int or None
+        The index of the best reference, from 1.
+    """
+    values = np.array(
+        [
+            [m[key] if m else np.nan for key in CAPRI_METRICS]
+            for m in reference_metrics
+            ],
+        dtype=float,
+        )
+    for key in _BEST_REFERENCE_ORDER:
+        col = CAPRI_METRICS.index(key)
+        if np.isnan(values[:, col]).all():
+            continue
+        # the best value is the lowest, flip the others
+        column = values[:, col] * (-1 if key in _HIGHER_IS_BETTER else 1)
+        best_row = int(np.argmin(np.where(np.isnan(column), np.inf, column)))
+        best = dict(zip(CAPRI_METRICS, values[best_row].tolist()))
+        return best, best_row + 1
+    return dict.fromkeys(CAPRI_METRICS, float('nan')), None
+
+
+def capri_cache_keys(models, references, params):
+    """
+    Identify the CAPRI metrics of models by their content.
+
+    The key of a model and a reference depends on the content of both
+    files and on the :py:data:`CACHE_PARAMS`, so models copied or selected
+    by other steps share the key of the original model.
+
+    Parameters
+    ----------
+    models : list of :py:class:`haddock.libs.libontology.PDBFile`
+        The models. Their `checksum` is used if known.
+    references : list
+        The references, paths or :py:class:`haddock.libs.libontology.PDBFile`.
+    params : dict
+        The parameters of the CAPRI evaluation.
+
+    Returns
+    -------
+    list of list of str
+        The key of each model for each reference.
+    """
+    ref_checksums = [
+        file_checksum(getattr(ref, "rel_path", ref)) for ref in references
+        ]
+    params_id = [params.get(key) for key in CACHE_PARAMS]
+    keys = []
+    for model in models:
+        checksum = getattr(model, "checksum", None) or file_checksum(
+            model.rel_path
+            )
+        keys.append([
+            hashlib.md5(
+                json.dumps([checksum, ref_checksum, params_id]).encode()
+                ).hexdigest()
+            for ref_checksum in ref_checksums
+            ])
+    return keys
+
+
+def row_reference_metrics(row, nreferences):
+    """
+    Get the metrics for each reference from a row of ``capri_ss.tsv``.
+
+    Parameters
+    ----------
+    row : dict
+        The row, see :py:meth:`CAPRI.make_output`.
+    nreferences : int
+        The number of references.
+
+    Returns
+    -------
+    list of dict
+        The metrics for each reference, `nan` if not calculated.
+    """
+    if nreferences == 1:
+        return [{key: row[key] for key in CAPRI_METRICS}]
+    return [
+        {key: row.get(f"{key}_ref{ref}", float('nan')) for key in CAPRI_METRICS}
+        for ref in range(1, nreferences + 1)
+        ]
+
+
+def _unique_atoms(pdb_atoms, selected):
+    """
+    Get the indices of the selected atoms with a unique identifier.
+
+    Of the atoms sharing chain, residue number and name, such as alternate
+    locations, only the last one is kept, as :py:func:`load_coords` does.
+    """
+    indices = np.flatnonzero(selected)
+    identifiers = recfunctions.repack_fields(
+        pdb_atoms[["chain", "resnum", "name"]][indices]
+        )
+    _, last = np.unique(identifiers[::-1], return_index=True)
+    return indices[np.sort(len(indices) - 1 - last)]
+
+
+def load_contact_array(pdb_f, cutoff=5.0):
+    """
+    Load residue-based contacts as an array.
 
     Parameters
     ----------
@@ -37,42 +191,279 @@ def load_contacts(pdb_f, cutoff=5.0):
 
     Returns
     -------
-    set(con_list) : set
-        set of unique contacts
+    contacts : np.ndarray
+        unique contacts, see :py:data:`haddock.libs.libcontacts.CONTACT_DTYPE`
     """
-    con_list = []
     if isinstance(pdb_f, PDBFile):
         pdb_f = pdb_f.rel_path
     # get also side chains atoms
     atoms = get_atoms(pdb_f, full=True)
-    ref_coord_dic, _ = load_coords(pdb_f, atoms)
-    # create coordinate arrays
-    coord_arrays, coord_ids = {}, {}
-    for atom in ref_coord_dic.keys():
-        chain = atom[0]
-        if chain not in coord_arrays.keys():  # initialize lists
-            coord_arrays[chain], coord_ids[chain] = [], []
-        coord_arrays[chain].append(ref_coord_dic[atom])
-        coord_ids[chain].append(atom[1])  # only the resid is appended
-    for chain in coord_arrays.keys():
-        coord_arrays[chain] = np.array(coord_arrays[chain])
-
-    # combinations of chains
-    unique_chain_combs = list(combinations(coord_arrays.keys(), 2))
-
-    # calculating contacts
-    for pair in unique_chain_combs:
-        # cycling over each coordinate of the first chain
-        for s in range(coord_arrays[pair[0]].shape[0]):
-            s_xyz = coord_arrays[pair[0]][s].reshape(1, 3)
-            s_cid = coord_ids[pair[0]][s]
-            dist = cdist(s_xyz, coord_arrays[pair[1]])
-            npw = np.where(dist < cutoff)
-            del dist
-            for k in range(npw[0].shape[0]):
-                con = (pair[0], s_cid, pair[1], coord_ids[pair[1]][npw[1][k]])
-                con_list.append(con)
-    return set(con_list)
+    pdb_atoms, pdb_xyz = load_atoms(pdb_f)
+    selected = _unique_atoms(pdb_atoms, select_atoms(pdb_atoms, atoms))
+    return residue_contacts(
+        pdb_atoms["chain"][selected],
+        pdb_atoms["resnum"][selected],
+        pdb_xyz[selected],
+        cutoff,
+        )
+
+
+def load_contacts(pdb_f, cutoff=5.0):
+    """
+    Load residue-based contacts.
+
+    Parameters
+    ----------
+    pdb_f : PosixPath or :py:class:`haddock.libs.libontology.PDBFile`
+        PDB file of the model to have its atoms identified
+    cutoff : float, optional
+        Cutoff distance for the interface identification.
+
+    Returns
+    -------
+    set(con_list) : set
+        set of unique contacts
+    """
+    return set(load_contact_array(pdb_f, cutoff).tolist())
+
+
+def contacts_to_interface(contacts):
+    """
+    Get the interface residues from a set of contacts.
+
+    Parameters
+    ----------
+    contacts : set
+        Contacts as returned by :py:func:`load_contacts`.
+
+    Returns
+    -------
+    interface_resdic : dict
+        The interface residues of each chain.
+    """
+    interface_resdic = {}
+    for contact in contacts:
+
+        first_chain, first_resid = contact[0], contact[1]
+        sec_chain, sec_resid = contact[2], contact[3]
+
+        if first_chain not in interface_resdic:
+            interface_resdic[first_chain] = []
+        if sec_chain not in interface_resdic:
+            interface_resdic[sec_chain] = []
+
+        if first_resid not in interface_resdic[first_chain]:
+            interface_resdic[first_chain].append(first_resid)
+        if sec_resid not in interface_resdic[sec_chain]:
+            interface_resdic[sec_chain].append(sec_resid)
+
+    return interface_resdic
+
+
+class ReferenceContext:
+    """
+    Reference-side data shared by all the CAPRI evaluations of a step.
+
+    The atoms, sequences, contacts, interfaces and coordinates of the
+    reference are calculated once and reused for every model. Results are
+    cached per cutoff. The context is built in the main process, before the
+    workers are forked, and must be treated as read-only by the jobs.
+    """
+
+    def __init__(self, reference, params=None):
+        """
+        Initialize the reference context.
+
+        Parameters
+        ----------
+        reference : PosixPath or :py:class:`haddock.libs.libontology.PDBFile`
+            The reference structure.
+        params : dict, optional
+            The parameters of the CAPRI evaluation. If given, the data
+            needed by the enabled metrics is calculated right away.
+        """
+        self.reference = reference
+        self.atoms = get_atoms(reference)
+        self._sequences = None
+        self._contacts = {}
+        self._interfaces = {}
+        self._coords = {}
+        self._numberings = {}
+        # numberings aligned here and not saved in the registry yet
+        self.new_numberings = {}
+        if params:
+            self.precompute(params)
+
+    def precompute(self, params):
+        """Calculate the data needed by the metrics enabled in `params`."""
+        if params["alignment_method"] == "sequence":
+            self.sequences()
+        if params["fnat"]:
+            self.contacts(params["fnat_cutoff"])
+        if params["irmsd"] or params["ilrmsd"]:
+            self.coords(params["irmsd_cutoff"])
+        if params["lrmsd"]:
+            self.coords()
+
+    def sequences(self):
+        """Sequences of the reference, see :py:func:`pdb2fastadic`."""
+        if self._sequences is None:
+            self._sequences = pdb2fastadic(self.reference)
+        return self._sequences
+
+    def numbering(self, model, params, path, registry=None, seqdic_model=None):
+        """
+        Get the numbering of a model's residues in the reference.
+
+        With the sequence alignment, the numbering is calculated once per
+        distinct model sequence, and if the model and reference sequences
+        are identical the residues are matched in order without alignment.
+        The structural alignment depends on the coordinates, so it is
+        calculated once per distinct model content.
+
+        Parameters
+        ----------
+        model : PosixPath or :py:class:`haddock.libs.libontology.PDBFile`
+            The model.
+        params : dict
+            The parameters of the CAPRI evaluation.
+        path : Path
+            Where the alignment files are written.
+        registry : :py:class:`haddock.libs.libregistry.ModelRegistry`, optional
+            The run's model registry, where numberings are kept across
+            steps. It is only read, the numberings aligned are kept in
+            `new_numberings` until saved with :py:meth:`save_numberings`.
+        seqdic_model : dict, optional
+            The sequences of the model, see :py:func:`pdb2fastadic`, if
+            already known.
+
+        Returns
+        -------
+        dict or bool
+            The numbering dictionary (one dictionary per chain), or `False`
+            if the chains could not be matched.
+
+        Raises
+        ------
+        AlignError
+            If the alignment fails.
+        """
+        method = params["alignment_method"]
+        if seqdic_model is None:
+            seqdic_model = pdb2fastadic(model)
+        structure_id = ""
+        if method == "structure":
+            # the structural alignment depends on the coordinates of both
+            structure_id = " ".join(
+                file_checksum(getattr(pdb, "rel_path", pdb))
+                for pdb in (self.reference, model)
+                )
+        key = numbering_key(
+            method,
+            self.sequences(),
+            seqdic_model,
+            structure_id,
+            )
+        numbering = self._numberings.get(key)
+        if numbering is None and registry is not None:
+            numbering = registry.get_numbering(key)
+        if numbering is None and method != "structure":
+            numbering = identity_numbering(self.sequences(), seqdic_model)
+        if numbering is None:
+            align_func = get_align(
+                method=method,
+                lovoalign_exec=params["lovoalign_exec"],
+                )
+            if method == "sequence":
+                align_func = partial(align_func, seqdic_ref=self.sequences())
+            try:
+                numbering = align_func(self.reference, model, path)
+            except AlignError as err:
+                # failures are cached too, but not kept across steps
+                numbering = err
+            else:
+                self.new_numberings[key] = numbering
+        self._numberings[key] = numbering
+        if isinstance(numbering, Exception):
+            raise numbering
+        return numbering
+
+    def precompute_numbering(
+            self,
+            models,
+            params,
+            path,
+            registry=None,
+            sequences=None,
+            ):
+        """
+        Calculate the numbering of the distinct sequences of `models`.
+
+        Called in the main process, so the workers only read the cached
+        numberings, which are saved in `registry`. Alignment failures are
+        reported by the jobs. The structural alignment is specific to each
+        model, so it is left to the jobs, which run in parallel.
+
+        Parameters
+        ----------
+        sequences : list, optional
+            The sequences of each model, see :py:func:`pdb2fastadic`, if
+            already known.
+        """
+        if params["alignment_method"] == "structure":
+            return
+        if sequences is None:
+            sequences = [pdb2fastadic(model) for model in models]
+        for model, seqdic_model in zip(models, sequences):
+            with suppress(AlignError):
+                self.numbering(
+                    model,
+                    params,
+                    path,
+                    registry,
+                    seqdic_model=seqdic_model,
+                    )
+        if registry is not None:
+            self.save_numberings(registry)
+
+    def save_numberings(self, registry):
+        """Save the numberings aligned since the last save in `registry`."""
+        if self.new_numberings:
+            registry.store_numberings(self.new_numberings)
+            self.new_numberings = {}
+
+    def contacts(self, cutoff=5.0):
+        """Residue contacts of the reference, see :py:func:`load_contacts`."""
+        if cutoff not in self._contacts:
+            self._contacts[cutoff] = load_contacts(self.reference, cutoff)
+        return self._contacts[cutoff]
+
+    def interface(self, cutoff=5.0):
+        """Interface residues of the reference."""
+        if cutoff not in self._interfaces:
+            self._interfaces[cutoff] = contacts_to_interface(
+                self.contacts(cutoff)
+                )
+        return self._interfaces[cutoff]
+
+    def coords(self, cutoff=None):
+        """
+        Coordinates of the reference, see :py:func:`load_coords`.
+
+        Parameters
+        ----------
+        cutoff : float, optional
+            If given, only the interface residues identified with this
+            cutoff are loaded.
+        """
+        if cutoff not in self._coords:
+            filter_resdic = None if cutoff is None else self.interface(cutoff)
+            self._coords[cutoff], _ = load_coords(
+                self.reference,
+                self.atoms,
+                filter_resdic,
+                )
+        return self._coords[cutoff]
 
 
 class CAPRI:
@@ -85,6 +476,10 @@ class CAPRI:
             path,
             reference,
             params,
+            reference_context=None,
+            reference_contexts=None,
+            cached_metrics=None,
+            registry=None,
             ):
         """
         Initialize the class.
@@ -101,27 +496,120 @@ class CAPRI:
             The reference structure.
         params : dict
             The parameters for the CAPRI evaluation.
+        reference_context : :py:class:`ReferenceContext`, optional
+            The reference-side data shared with other evaluations. Created
+            for this object if not given.
+        reference_contexts : list of :py:class:`ReferenceContext`, optional
+            All the references the model is evaluated against by
+            :py:meth:`run`. Defaults to `reference_context` only.
+        cached_metrics : list, optional
+            The metrics of the model for each reference, as calculated by
+            a previous evaluation, `None` for the references to evaluate.
+        registry : :py:class:`haddock.libs.libregistry.ModelRegistry`, optional
+            The run's model registry, read for the numberings aligned by
+            previous steps.
         """
-        self.reference = reference
+        if reference_context is None:
+            reference_context = ReferenceContext(reference)
+        self.reference_contexts = reference_contexts or [reference_context]
         self.model = model
         self.path = path
         self.params = params
-        self.irmsd = float('nan')
-        self.lrmsd = float('nan')
-        self.ilrmsd = float('nan')
-        self.fnat = float('nan')
-        self.dockq = float('nan')
-        self.atoms = self._load_atoms(model, reference)
+        self.cached_metrics = (
+            cached_metrics or [None] * len(self.reference_contexts)
+            )
+        self.registry = registry
+        # model-side data, loaded once for all the references when needed
+        self._model_atoms = None
+        self._atoms = None
+        self._parsed_model = None
+        self._model_sequences = None
+        self._model_contacts = {}
+        # the metrics for each reference, see `run`
+        self.reference_metrics = []
+        self.best_reference = None
+        self.use_reference(reference_context)
         self.r_chain = params["receptor_chain"]
         self.l_chain = params["ligand_chain"]
-        self.model2ref_numbering = None
-        self.output_ss_fname = Path(f"capri_ss_{identificator}.tsv")
-        self.output_clt_fname = Path(f"capri_clt_{identificator}.tsv")
-        # for parallelisation
-        self.output = self.output_ss_fname
+        # for parallelisation, names the job in the logs
+        self.output = Path(f"capri_{identificator}")
         self.identificator = identificator
         self.core_model_idx = identificator
 
+    def is_cached(self):
+        """Whether the metrics for all the references are cached."""
+        return all(cached is not None for cached in self.cached_metrics)
+
+    def use_reference(self, reference_context):
+        """
+        Evaluate the model against another reference.
+
+        The metrics are reset, the data of the model is kept.
+
+        Parameters
+        ----------
+        reference_context : :py:class:`ReferenceContext`
+            The reference-side data.
+        """
+        self.reference_context = reference_context
+        self.reference = reference_context.reference
+        self._atoms = None
+        self.model2ref_numbering = None
+        for key in CAPRI_METRICS:
+            setattr(self, key, float('nan'))
+
+    @property
+    def atoms(self):
+        """Atoms of the model and the reference, see :py:func:`get_atoms`."""
+        if self._atoms is None:
+            if self._model_atoms is None:
+                self._model_atoms = get_atoms(self.model)
+            self._atoms = {**self._model_atoms, **self.reference_context.atoms}
+        return self._atoms
+
+    def parsed_model(self):
+        """Atoms and coordinates of the model, see :py:func:`load_atoms`."""
+        if self._parsed_model is None:
+            self._parsed_model = load_atoms(
+                getattr(self.model, "rel_path", self.model)
+                )
+        return self._parsed_model
+
+    def model_sequences(self):
+        """Sequences of the model, see :py:func:`pdb2fastadic`."""
+        if self._model_sequences is None:
+            self._model_sequences = pdb2fastadic(self.model)
+        return self._model_sequences
+
+    def model_contacts(self, cutoff=5.0):
+        """Residue contacts of the model, see :py:func:`load_contacts`."""
+        if cutoff not in self._model_contacts:
+            self._model_contacts[cutoff] = load_contacts(self.model, cutoff)
+        return self._model_contacts[cutoff]
+
+    def load_model_coords(self, filter_resdic=None):
+        """
+        Coordinates of the model in the numbering of the reference.
+
+        Parameters
+        ----------
+        filter_resdic : dict, optional
+            The residues to load (one list per chain).
+
+        Returns
+        -------
+        coord_dic : dict
+            See :py:func:`load_coords`.
+        """
+        coord_dic, _ = load_coords(
+            self.model,
+            self.atoms,
+            filter_resdic,
+            numbering_dic=self.model2ref_numbering,
+            parsed=self.parsed_model(),
+            )
+        return coord_dic
+
     def calc_irmsd(self, cutoff=5.0):
         """Calculate the I-RMSD.
 
@@ -131,22 +619,15 @@ class CAPRI:
             The cutoff distance for the intermolecular contacts.
         """
         # Identify reference interface
-        ref_interface_resdic = self.identify_interface(self.reference, cutoff)
+        ref_interface_resdic = self.reference_context.interface(cutoff)
 
         if len(ref_interface_resdic) == 0:
             log.warning("No reference interface found")
         else:
             # Load interface coordinates
-            ref_coord_dic, _ = load_coords(
-                self.reference, self.atoms, ref_interface_resdic
-                )
+            ref_coord_dic = self.reference_context.coords(cutoff)
 
-            mod_coord_dic, _ = load_coords(
-                self.model,
-                self.atoms,
-                ref_interface_resdic,
-                numbering_dic=self.model2ref_numbering
-                )
+            mod_coord_dic = self.load_model_coords(ref_interface_resdic)
 
             # Here _coord_dic keys are matched
             #  and formatted as (chain, resnum, atom)
@@ -177,13 +658,9 @@ class CAPRI:
 
     def calc_lrmsd(self):
         """Calculate the L-RMSD."""
-        ref_coord_dic, _ = load_coords(self.reference, self.atoms)
+        ref_coord_dic = self.reference_context.coords()
 
-        mod_coord_dic, _ = load_coords(
-            self.model,
-            self.atoms,
-            numbering_dic=self.model2ref_numbering
-            )
+        mod_coord_dic = self.load_model_coords()
 
         Q = []
         P = []
@@ -273,19 +750,12 @@ class CAPRI:
             The cutoff distance for the intermolecular contacts.
         """
         # Identify interface
-        ref_interface_resdic = self.identify_interface(self.reference, cutoff)
+        ref_interface_resdic = self.reference_context.interface(cutoff)
         # Load interface coordinates
 
-        ref_int_coord_dic, _ = load_coords(
-            self.reference, self.atoms, ref_interface_resdic
-            )
+        ref_int_coord_dic = self.reference_context.coords(cutoff)
 
-        mod_int_coord_dic, _ = load_coords(
-            self.model,
-            self.atoms,
-            ref_interface_resdic,
-            numbering_dic=self.model2ref_numbering
-            )
+        mod_int_coord_dic = self.load_model_coords(ref_interface_resdic)
 
         # write_coord_dic("ref.pdb", ref_int_coord_dic)
         # write_coord_dic("model.pdb", mod_int_coord_dic)
@@ -365,9 +835,9 @@ class CAPRI:
         cutoff : float
             The cutoff distance for the intermolecular contacts.
         """
-        ref_contacts = load_contacts(self.reference, cutoff)
+        ref_contacts = self.reference_context.contacts(cutoff)
         if len(ref_contacts) != 0:
-            model_contacts = load_contacts(self.model, cutoff)
+            model_contacts = self.model_contacts(cutoff)
             intersection = ref_contacts & model_contacts
             self.fnat = len(intersection) / float(len(ref_contacts))
         else:
@@ -400,7 +870,14 @@ class CAPRI:
         return has_cluster_info
 
     def make_output(self):
-        """Output the CAPRI results to a .tsv file."""
+        """
+        Get the CAPRI results as a row of ``capri_ss.tsv``.
+
+        Returns
+        -------
+        dict
+            The model, its score, CAPRI metrics, cluster and energies.
+        """
         data = {}
         # keep always "model" the first key
         data["model"] = self.model
@@ -415,6 +892,15 @@ class CAPRI:
         data["ilrmsd"] = self.ilrmsd
         data["dockq"] = self.dockq
 
+        if len(self.reference_contexts) > 1:
+            data["best_ref"] = self.best_reference
+            metrics = [key for key in CAPRI_METRICS if self.params.get(key)]
+            for ref, ref_metrics in enumerate(self.reference_metrics, start=1):
+                for key in metrics:
+                    data[f"{key}_ref{ref}"] = (
+                        ref_metrics[key] if ref_metrics else float('nan')
+                        )
+
         if self.has_cluster_info():
             data["cluster-id"] = self.model.clt_id
             data["cluster-ranking"] = self.model.clt_rank
@@ -429,28 +915,86 @@ class CAPRI:
             for key in self.model.unw_energies:
                 data[key] = self.model.unw_energies[key]
 
-        output_fname = Path(self.path, self.output_ss_fname)
+        return data
 
-        write_dic_to_file(data, output_fname)
+    def registry_row(self):
+        """
+        Get the CAPRI metrics to store in the model registry.
+
+        Returns
+        -------
+        dict
+            The model file name and its CAPRI metrics.
+        """
+        return {
+            "model": self.model.file_name,
+            "irmsd": self.irmsd,
+            "fnat": self.fnat,
+            "lrmsd": self.lrmsd,
+            "ilrmsd": self.ilrmsd,
+            "dockq": self.dockq,
+            }
 
     def run(self):
-        """Get the CAPRI metrics."""
-        try:
-            align_func = get_align(
-                method=self.params["alignment_method"],
-                lovoalign_exec=self.params["lovoalign_exec"]
+        """
+        Get the CAPRI metrics against all the references.
+
+        With several references, the metrics of the model are those of the
+        best reference, see :py:func:`best_of_references`, and the
+        metrics for each reference are kept in `reference_metrics`. The
+        `cached_metrics` are not calculated again.
+
+        Returns
+        -------
+        dict or None
+            The row of the model, see :py:meth:`make_output`, or `None` if
+            the model could not be aligned to any reference.
+        """
+        self.reference_metrics = [
+            self.evaluate(reference_context) if cached is None else cached
+            for reference_context, cached in zip(
+                self.reference_contexts,
+                self.cached_metrics,
                 )
-            self.model2ref_numbering = align_func(
-                self.reference,
+            ]
+        if not any(self.reference_metrics):
+            return None
+
+        best, self.best_reference = best_of_references(self.reference_metrics)
+        for key, value in best.items():
+            setattr(self, key, value)
+        return self.make_output()
+
+    def evaluate(self, reference_context):
+        """
+        Get the CAPRI metrics against a reference.
+
+        Parameters
+        ----------
+        reference_context : :py:class:`ReferenceContext`
+            The reference-side data.
+
+        Returns
+        -------
+        dict or None
+            The metrics, or `None` if the model could not be aligned to
+            the reference.
+        """
+        self.use_reference(reference_context)
+        try:
+            self.model2ref_numbering = self.reference_context.numbering(
                 self.model,
-                self.path
+                self.params,
+                self.path,
+                registry=self.registry,
+                seqdic_model=self.model_sequences(),
                 )
         except AlignError:
             log.warning(
                 f"Alignment failed between {self.reference} "
                 f"and {self.model}, skipping..."
                 )
-            return
+            return None
 
         if self.params["fnat"]:
             log.debug(f"id {self.identificator}, calculating FNAT")
@@ -478,7 +1022,7 @@ class CAPRI:
             log.debug(f"id {self.identificator}, calculating DockQ metric")
             self.calc_dockq()
 
-        self.make_output()
+        return {key: getattr(self, key) for key in CAPRI_METRICS}
 
     def check_chains(self, obs_chains):
         """Check observed chains against the expected ones."""
@@ -505,30 +1049,6 @@ class CAPRI:
 
         return r_chain, l_chain
 
-    @staticmethod
-    def _load_atoms(model, reference):
-        """
-        Load atoms from a model and reference.
-
-        Parameters
-        ----------
-        model : PosixPath or :py:class:`haddock.libs.libontology.PDBFile`
-            PDB file of the model to have its atoms identified
-        reference : PosixPath or :py:class:`haddock.libs.libontology.PDBFile`
-            PDB file of the model to have its atoms identified
-
-        Returns
-        -------
-        atom_dic : dict
-            Dictionary containing atoms observed in model and reference
-        """
-        model_atoms = get_atoms(model)
-        reference_atoms = get_atoms(reference)
-        atoms_dict = {}
-        atoms_dict.update(model_atoms)
-        atoms_dict.update(reference_atoms)
-        return atoms_dict
-
     @staticmethod
     def identify_interface(pdb_f, cutoff=5.0):
         """Identify the interface.
@@ -543,25 +1063,8 @@ class CAPRI:
         if isinstance(pdb_f, PDBFile):
             pdb_f = pdb_f.rel_path
 
-        interface_resdic = {}
         contacts = load_contacts(pdb_f, cutoff)
-
-        for contact in contacts:
-
-            first_chain, first_resid = contact[0], contact[1]
-            sec_chain, sec_resid = contact[2], contact[3]
-
-            if first_chain not in interface_resdic:
-                interface_resdic[first_chain] = []
-            if sec_chain not in interface_resdic:
-                interface_resdic[sec_chain] = []
-
-            if first_resid not in interface_resdic[first_chain]:
-                interface_resdic[first_chain].append(first_resid)
-            if sec_resid not in interface_resdic[sec_chain]:
-                interface_resdic[sec_chain].append(sec_resid)
-
-        return interface_resdic
+        return contacts_to_interface(contacts)
 
     @staticmethod
     def add_chain_from_segid(pdb_path):
@@ -583,125 +1086,143 @@ class CAPRI:
         return new_pdb_path
 
 
-def merge_data(capri_jobs):
-    """Merge CAPRI data."""
-    capri_dic = {}
-    for ident in range(1, len(capri_jobs) + 1):
-        out_file = Path(f"capri_ss_{ident}.tsv")
-        if not out_file.exists():
-            continue
-        header, content = out_file.read_text().split(os.linesep, 1)
-
-        header_data = header.split('\t')
-        content_data = content.split('\t')
-
-        model_name = Path(content_data[header_data.index("model")]).name
-        capri_dic[model_name] = {}
-        target_keys = ['irmsd', 'fnat', 'ilrmsd', 'lrmsd', 'dockq']
-        for key in target_keys:
-            capri_dic[model_name][key] = float(
-                content_data[header_data.index(key)])
-
-    for j in capri_jobs:
-        for m in capri_dic:
-            if m == j.model.file_name:
-                # add the data
-                j.irmsd = capri_dic[m]['irmsd']
-                j.fnat = capri_dic[m]['fnat']
-                j.lrmsd = capri_dic[m]['lrmsd']
-                j.ilrmsd = capri_dic[m]['ilrmsd']
-                j.dockq = capri_dic[m]['dockq']
+class CAPRIJob:
+    """
+    Run a :py:class:`CAPRI` evaluation as a parallel task.
+
+    The numberings aligned in the worker are returned with the row, so
+    that the main process saves them in the registry.
+    """
+
+    def __init__(self, capri):
+        self.capri = capri
+        # for parallelisation, names the job in the logs
+        self.output = capri.output
+
+    def run(self):
+        """
+        Evaluate the model.
+
+        Returns
+        -------
+        row : dict or None
+            The row of the model, see :py:meth:`CAPRI.run`.
+        numberings : dict
+            The numberings aligned for the model, by numbering key.
+        """
+        row = self.capri.run()
+        numberings = {}
+        for reference_context in self.capri.reference_contexts:
+            numberings.update(reference_context.new_numberings)
+            reference_context.new_numberings = {}
+        return row, numberings
 
+
+def merge_data(capri_jobs, rows):
+    """
+    Copy the CAPRI metrics calculated by the workers to the jobs.
+
+    Parameters
+    ----------
+    capri_jobs : list of :py:class:`CAPRI`
+        The jobs, as in the main process.
+    rows : list
+        The row returned by each job, see :py:meth:`CAPRI.run`, `None`
+        for the jobs that failed.
+
+    Returns
+    -------
+    capri_jobs : list of :py:class:`CAPRI`
+    """
+    for job, row in zip(capri_jobs, rows):
+        if row is None:
+            continue
+        for key in CAPRI_METRICS:
+            setattr(job, key, row[key])
     return capri_jobs
 
 
 def rearrange_ss_capri_output(
+        rows,
         output_name,
-        output_count,
         sort_key,
         sort_ascending,
-        path
+        path,
+        info_header="",
         ):
     """
-    Combine different capri outputs in a single file.
+    Write the rows of the CAPRI jobs in a single file.
+
+    The models are ranked by score in the ``caprieval_rank`` column and
+    sorted by `sort_key`. Models with a `nan` `sort_key` are written last.
 
     Parameters
     ----------
+    rows : list
+        The row returned by each job, see :py:meth:`CAPRI.run`, `None`
+        for the jobs that failed.
     output_name : str
         Name of the output file.
-    output_count : int
-        Number of output files to combine.
     sort_key : str
         Key to sort the output files.
+    sort_ascending : bool
+        Whether to sort in ascending order.
     path : Path
         Path to the output directory.
+    info_header : str
+        Comment lines written before the table.
     """
-    # this would be easier and more readable with pandas (:
     output_fname = Path(path, output_name)
-    log.info(f"Rearranging output files into {output_fname}")
-    keyword = output_name.split(".")[0]
-    split_dict = {
-        "capri_ss": "model-cluster-ranking",
-        "capri_clt": "caprieval_rank"
-        }
-    if keyword not in split_dict.keys():
-        raise Exception(f'Keyword {keyword} does not exist.')
-
-    # Load the information of each intermediate file
-    data = {}
-    for ident in range(1, output_count + 1):
-        out_file = Path(path, f"{keyword}_{ident}.tsv")
-
-        # raise a warning if file does not exist.
-        if not out_file.exists():
-            log.warning((f"Output file {out_file} does not exist. "
-                        "Caprieval will not be exhaustive..."))
-            continue
+    log.info(f"Writing the CAPRI metrics of the models into {output_fname}")
+    rows = [row for row in rows if row is not None]
+    if not rows:
+        log.warning(f"No CAPRI metrics to write in {output_fname}")
+        return
 
-        data[ident] = {}
-        header, content = out_file.read_text().split(os.linesep, 1)
+    # the score ranks the models
+    scores = np.array([row["score"] for row in rows], dtype=float)
+    for rank, idx in enumerate(np.argsort(scores, kind="stable"), start=1):
+        rows[idx]["caprieval_rank"] = rank
 
-        header_data = header.split('\t')
-        content_data = content.split('\t')
+    values = np.array([row[sort_key] for row in rows], dtype=float)
+    if not sort_ascending:
+        values = -values
+    order = np.argsort(values, kind="stable")
 
-        # find out the data type of each field
-        for key, value in zip(header_data, content_data):
-            try:
-                value = int(value)
-            except ValueError:
-                try:
-                    value = float(value)
-                except ValueError:
-                    value = str(value).strip(os.linesep)
-            data[ident][key] = value
+    data = {i: rows[idx] for i, idx in enumerate(order, start=1)}
+    write_nested_dic_to_file(data, output_fname, info_header=info_header)
 
-        out_file.unlink()
 
-    # Rank according to the score
-    score_rankkey_values = [(k, data[k]['score']) for k in data.keys()]
-    score_rankkey_values.sort(key=lambda x: x[1])
+def references_header(references):
+    """
+    Describe the references of the ``_ref<n>`` columns of ``capri_ss.tsv``.
 
-    for i, k in enumerate(score_rankkey_values):
-        data_idx, _ = k
-        data[data_idx]["caprieval_rank"] = i + 1
+    Parameters
+    ----------
+    references : list
+        The references the models are evaluated against.
 
-    # Sort according to the sort key
-    rankkey_values = [(k, data[k][sort_key]) for k in data.keys()]
-    rankkey_values.sort(
-        key=lambda x: x[1],
-        reverse=True if not sort_ascending else False
+    Returns
+    -------
+    str
+        The comment lines, empty for a single reference.
+    """
+    if len(references) < 2:
+        return ""
+    lines = ["#" * 40, "# `caprieval` references", "#"]
+    lines.extend(
+        f"# > ref{i}={reference}"
+        for i, reference in enumerate(references, start=1)
         )
-
-    _data = {}
-    for i, (data_idx, _) in enumerate(rankkey_values):
-        _data[i + 1] = data[data_idx]
-    data = _data
-
-    if not data:
-        # This means no files have been collected
-        return
-    else:
-        write_nested_dic_to_file(data, output_name)
+    lines.extend([
+        "#",
+        "# The metrics are those of best_ref, the reference with the best",
+        "#  DockQ (or I-RMSD, L-RMSD, I-L-RMSD, FNAT if DockQ is not",
+        "#  calculated).",
+        "#",
+        "#" * 40,
+        ])
+    return os.linesep.join(lines)
 
 
 def calc_stats(data):
@@ -0,0 +1,591 @@
+"""
+FCC clustering.
+
+The contacts of the models are encoded in a sparse boolean matrix, one row
+per model and one column per distinct contact. The number of contacts two
+models share is then the product of this matrix by its transpose, calculated
+in blocks of rows, and for positive cutoffs only the pairs sharing contacts
+are considered.
+
+The clustering is greedy: the model with the most unclustered neighbours
+becomes the center of a cluster with these neighbours, until the largest
+cluster left is smaller than the population threshold. The clusters found
+do not depend on the threshold, which only stops the clustering, so the
+clustering is done once down to a threshold of 1 and the clusters of any
+threshold are the first ones found.
+"""
+import heapq
+import os
+from functools import partial
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from haddock import log
+from haddock.libs.libclust import write_structure_list
+from haddock.libs.libcontacts import (
+    contact_codes,
+    decode_contacts,
+    residue_contacts,
+    )
+from haddock.libs.libcoords import load_atoms
+
+
+FCC_BLOCK_SIZE = 2000
+"""The number of models per block of rows of the FCC calculation."""
+
+SWEEP_FILE = "clustfcc_sweep.npz"
+"""The clusters of all the thresholds, saved in the step folder."""
+
+_block_matrix = None
+
+
+def fcc_atoms(atoms):
+    """
+    Select the atoms and segments used for the FCC contacts.
+
+    The selection is the one of the ``contact_fcc`` program of FCC: the
+    ``ATOM`` records without hydrogens, that is, atom names starting with
+    ``H`` or with a digit followed by ``H``. The residues are grouped by
+    segment identifier, column 73 of the PDB format, or by chain if the
+    model has no segment identifiers.
+
+    Parameters
+    ----------
+    atoms : np.ndarray
+        Structured array with :py:data:`haddock.libs.libpdb.ATOM_DTYPE`.
+
+    Returns
+    -------
+    selection : np.ndarray
+        Whether each atom is used.
+    segments : np.ndarray
+        The segment of each atom.
+    """
+    names = atoms["name"]
+    hydrogen = np.char.startswith(names, "H") | (
+        np.char.isdigit(names.astype("U1")) & (np.char.find(names, "H") == 1)
+        )
+    selection = ~atoms["hetatm"] & ~hydrogen
+    segments = atoms["segid"].astype("U1")
+    if not np.char.strip(segments).any():
+        segments = atoms["chain"]
+    return selection, segments
+
+
+def model_contacts(pdb_f, cutoff):
+    """
+    Calculate the residue contacts of a model.
+
+    The atoms are read from the coordinate store when possible, and
+    selected with :py:func:`fcc_atoms`.
+
+    Parameters
+    ----------
+    pdb_f : str or pathlib.Path
+        The PDB file of the model.
+    cutoff : float
+        The distance cutoff, in Angstrom.
+
+    Returns
+    -------
+    np.ndarray
+        The contacts, encoded by
+        :py:func:`haddock.libs.libcontacts.contact_codes`.
+    """
+    atoms, xyz = load_atoms(pdb_f)
+    selection, segments = fcc_atoms(atoms)
+    contacts = residue_contacts(
+        segments[selection],
+        atoms["resnum"][selection],
+        xyz[selection],
+        cutoff,
+        )
+    return contact_codes(contacts)
+
+
+def calc_contacts(models, cutoff, ncores=1):
+    """
+    Calculate the residue contacts of the models.
+
+    Parameters
+    ----------
+    models : list
+        The :py:class:`haddock.libs.libontology.PDBFile` models.
+    cutoff : float
+        The distance cutoff, in Angstrom.
+    ncores : int
+        The number of processes.
+
+    Returns
+    -------
+    list of np.ndarray
+        The encoded contacts of each model.
+    """
+    paths = [str(model.rel_path) for model in models]
+    calc = partial(model_contacts, cutoff=cutoff)
+    if ncores > 1 and len(paths) > 1:
+        ncores = min(ncores, len(paths))
+        with Pool(ncores) as pool:
+            return pool.map(
+                calc,
+                paths,
+                chunksize=max(len(paths) // (4 * ncores), 1),
+                )
+    return list(map(calc, paths))
+
+
+def write_contact_file(codes, output_fname):
+    """
+    Write the contacts of a model in text form.
+
+    Each line holds the residue number and segment of the two residues in
+    contact, once per pair of residues.
+
+    Parameters
+    ----------
+    codes : np.ndarray
+        The encoded contacts.
+    output_fname : str or pathlib.Path
+        The name of the file.
+    """
+    contacts = decode_contacts(codes)
+    Path(output_fname).write_text("".join(
+        f"{c['resnum_a']} {c['chain_a']} {c['resnum_b']} {c['chain_b']}"
+        f"{os.linesep}"
+        for c in contacts
+        ))
+
+
+def contact_matrix(contacts):
+    """
+    Encode the contacts of the models in a sparse boolean matrix.
+
+    Parameters
+    ----------
+    contacts : list of np.ndarray
+        The encoded contacts of each model, unique within a model.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        The (n_models, n_contacts) matrix, stored as int32 ones so that its
+        products count the shared contacts.
+    """
+    codes = np.concatenate(contacts) if contacts else np.empty(0, np.int64)
+    _, columns = np.unique(codes, return_inverse=True)
+    indptr = np.concatenate(([0], np.cumsum([len(c) for c in contacts])))
+    return csr_matrix(
+        (np.ones(len(codes), dtype=np.int32), columns.ravel(), indptr),
+        shape=(len(contacts), columns.max() + 1 if len(codes) else 0),
+        )
+
+
+def _set_block_matrix(matrix):
+    global _block_matrix
+    _block_matrix = matrix
+
+
+def _block_fcc(bounds, cutoff, strictness):
+    """Find the neighbours of a block of rows of the upper triangle."""
+    start, end = bounds
+    matrix = _block_matrix
+    partner_cutoff = cutoff * strictness
+    shared = matrix[start:end] @ matrix[start:].T
+    if max(cutoff, partner_cutoff) > 0:
+        shared = shared.tocoo()
+        rows, cols, common = shared.row, shared.col, shared.data
+    else:
+        # pairs without shared contacts pass cutoffs <= 0, compare them all
+        common = shared.toarray().ravel()
+        rows, cols = np.divmod(np.arange(len(common)), shared.shape[1])
+    ref = rows.astype(np.intp) + start
+    mobi = cols.astype(np.intp) + start
+    upper = mobi > ref
+    ref, mobi, common = ref[upper], mobi[upper], common[upper]
+
+    lengths = np.diff(matrix.indptr)
+    # rounded as in the fcc.matrix text file the clustering used to read,
+    # models without contacts give NaN and are nobody's neighbours
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fcc = np.round(common / lengths[ref], 2)
+        fcc_v = np.round(common / lengths[mobi], 3)
+    forward = (fcc >= cutoff) & (fcc_v >= partner_cutoff)
+    backward = (fcc_v >= cutoff) & (fcc >= partner_cutoff)
+    return (
+        np.concatenate((ref[forward], mobi[backward])),
+        np.concatenate((mobi[forward], ref[backward])),
+        )
+
+
+def fcc_neighbours(
+        matrix,
+        cutoff,
+        strictness,
+        ncores=1,
+        block_size=FCC_BLOCK_SIZE,
+        ):
+    """
+    Find the neighbours of each model.
+
+    Model `j` is a neighbour of model `i` if the fraction of the contacts
+    of `i` present in `j` is at least `cutoff`, and the fraction of the
+    contacts of `j` present in `i` at least ``cutoff * strictness``.
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix
+        The contact matrix, see :py:func:`contact_matrix`.
+    cutoff : float
+        The FCC cutoff. Only the pairs sharing contacts are compared,
+        unless both `cutoff` and ``cutoff * strictness`` are not positive.
+    strictness : float
+        The factor of the cutoff of the reverse FCC.
+    ncores : int
+        The number of processes, each calculating blocks of rows.
+    block_size : int
+        The number of rows per block.
+
+    Returns
+    -------
+    ref, neighbour : np.ndarray
+        The indices of each model and of its neighbour, one pair per
+        neighbour.
+    """
+    nmodels = matrix.shape[0]
+    blocks = [
+        (start, min(start + block_size, nmodels))
+        for start in range(0, nmodels, block_size)
+        ]
+    calc = partial(_block_fcc, cutoff=cutoff, strictness=strictness)
+    if ncores > 1 and len(blocks) > 1:
+        with Pool(
+                min(ncores, len(blocks)),
+                initializer=_set_block_matrix,
+                initargs=(matrix,),
+                ) as pool:
+            found = pool.map(calc, blocks, chunksize=1)
+    else:
+        _set_block_matrix(matrix)
+        found = list(map(calc, blocks))
+        _set_block_matrix(None)
+    if not found:
+        return np.empty(0, np.intp), np.empty(0, np.intp)
+    return (
+        np.concatenate([ref for ref, _ in found]),
+        np.concatenate([neighbour for _, neighbour in found]),
+        )
+
+
+def write_fcc_matrix(matrix, output_fname, block_size=FCC_BLOCK_SIZE):
+    """
+    Write the FCC of all the pairs of models in text form.
+
+    Each line holds the indices of the two models, starting at 1, the
+    fraction of the contacts of the first model present in the second and
+    the reverse fraction.
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix
+        The contact matrix, see :py:func:`contact_matrix`.
+    output_fname : str or pathlib.Path
+        The name of the file.
+    block_size : int
+        The number of rows calculated at once.
+    """
+    nmodels = matrix.shape[0]
+    lengths = np.diff(matrix.indptr)
+    with open(output_fname, "w") as fh:
+        for start in range(0, nmodels, block_size):
+            end = min(start + block_size, nmodels)
+            shared = (matrix[start:end] @ matrix.T).toarray()
+            for ref in range(start, end):
+                common = shared[ref - start, ref + 1:]
+                mobis = np.arange(ref + 1, nmodels)
+                fcc = common / lengths[ref]
+                fcc_v = common / lengths[mobis]
+                fh.write("".join(
+                    f"{ref + 1} {mobi + 1} {f:.2f} {f_v:.3f}{os.linesep}"
+                    for mobi, f, f_v in zip(mobis, fcc, fcc_v)
+                    ))
+
+
+def sweep_clusters(nmodels, ref, neighbour):
+    """
+    Cluster the models for all the population thresholds.
+
+    The unclustered model with the most unclustered neighbours, the
+    highest index first in case of a tie, is the center of the next
+    cluster, which holds its unclustered neighbours. The clustering goes on
+    until all the models are clustered, that is, down to a threshold of 1.
+
+    Parameters
+    ----------
+    nmodels : int
+        The number of models.
+    ref, neighbour : np.ndarray
+        The indices of each model and of its neighbour, as given by
+        :py:func:`fcc_neighbours`.
+
+    Returns
+    -------
+    centers : np.ndarray
+        The center of each cluster, in the order they are found.
+    sizes : np.ndarray
+        The number of members of each cluster, without the center. It
+        does not increase from one cluster to the next.
+    labels : np.ndarray
+        The cluster of each model, from 0.
+    """
+    order = np.argsort(ref, kind="stable")
+    neighbours = np.split(
+        np.asarray(neighbour)[order],
+        np.cumsum(np.bincount(ref, minlength=nmodels))[:-1],
+        )
+    # the models each model is a neighbour of, to update their counts
+    order = np.argsort(neighbour, kind="stable")
+    neighbour_of = np.split(
+        np.asarray(ref)[order],
+        np.cumsum(np.bincount(neighbour, minlength=nmodels))[:-1],
+        )
+
+    counts = np.array([len(n) for n in neighbours])
+    labels = np.full(nmodels, -1)
+    heap = [(-count, -model) for model, count in enumerate(counts.tolist())]
+    heapq.heapify(heap)
+    centers = []
+    sizes = []
+    while heap:
+        count, center = heapq.heappop(heap)
+        count, center = -count, -center
+        if labels[center] != -1 or count != counts[center]:
+            # clustered, or with an outdated count
+            continue
+        members = neighbours[center][labels[neighbours[center]] == -1]
+        cluster_id = len(centers)
+        labels[center] = cluster_id
+        labels[members] = cluster_id
+        centers.append(center)
+        sizes.append(len(members))
+
+        # the models that had the new members as neighbours lose them
+        for model in np.concatenate(
+                [neighbour_of[m] for m in members] + [neighbour_of[center]]
+                ).tolist():
+            if labels[model] == -1:
+                counts[model] -= 1
+                heapq.heappush(heap, (-counts[model], -model))
+
+    return (
+        np.array(centers, dtype=int),
+        np.array(sizes, dtype=int),
+        labels,
+        )
+
+
+def get_clusters(centers, sizes, labels, threshold):
+    """
+    Get the clusters of a population threshold.
+
+    Parameters
+    ----------
+    centers, sizes, labels : np.ndarray
+        The clusters of all the thresholds, see :py:func:`sweep_clusters`.
+    threshold : int
+        The minimum number of models of a cluster, with its center.
+
+    Returns
+    -------
+    list of tuple
+        The center and the sorted other members of each cluster.
+    """
+    nclusters = int(np.count_nonzero(sizes >= threshold - 1))
+    return [
+        (
+            int(centers[cl_id]),
+            np.setdiff1d(np.flatnonzero(labels == cl_id), centers[cl_id]),
+            )
+        for cl_id in range(nclusters)
+        ]
+
+
+def save_sweep(centers, sizes, labels, output_fname=SWEEP_FILE):
+    """Save the clusters of all the thresholds."""
+    np.savez(output_fname, centers=centers, sizes=sizes, labels=labels)
+
+
+def load_sweep(sweep_fname=SWEEP_FILE):
+    """
+    Load the clusters of all the thresholds.
+
+    Returns
+    -------
+    centers, sizes, labels : np.ndarray
+        See :py:func:`sweep_clusters`.
+    """
+    with np.load(sweep_fname) as sweep:
+        return sweep["centers"], sweep["sizes"], sweep["labels"]
+
+
+def find_threshold(sizes, threshold):
+    """
+    Get the highest threshold up to `threshold` giving a cluster.
+
+    Parameters
+    ----------
+    sizes : np.ndarray
+        The number of members of each cluster, see
+        :py:func:`sweep_clusters`.
+    threshold : int
+        The population threshold.
+
+    Returns
+    -------
+    int
+    """
+    for curr_thr in range(threshold, 0, -1):
+        log.info(f'Clustering with threshold={curr_thr}')
+        if len(sizes) and sizes[0] >= curr_thr - 1:
+            return curr_thr
+        log.info("[WARNING] No cluster was found, decreasing threshold!")
+    return 1
+
+
+def write_clusters(models, clusters, params):
+    """
+    Rank the clusters, annotate the models and write the clusters.
+
+    ``cluster.out``, ``clustfcc.tsv`` and ``clustfcc.txt`` are written in
+    the current folder.
+
+    Parameters
+    ----------
+    models : list
+        The clustered models.
+    clusters : list of tuple
+        The center and the other members of each cluster, see
+        :py:func:`get_clusters`.
+    params : dict
+        The parameters of the clustering, reported in ``clustfcc.txt``.
+        ``threshold`` is the threshold of the clusters.
+
+    Returns
+    -------
+    output_models : list
+        The clustered models, sorted by cluster rank and score.
+    """
+    threshold = params['threshold']
+    # write the classic output file for compatibility reasons
+    log.info('Saving output to cluster.out')
+    cluster_out = Path('cluster.out')
+    with open(cluster_out, 'w') as fh:
+        for cluster_id, (center, members) in enumerate(clusters, start=1):
+            fh.write(f"Cluster {cluster_id} -> {center + 1} ")
+            for member in members:
+                fh.write(f"{member + 1} ")
+            fh.write(os.linesep)
+
+    clt_dic = {}
+    clt_centers = {}
+    for cluster_id, (center, members) in enumerate(clusters, start=1):
+        cluster_center_pdb = models[center]
+        clt_centers[cluster_id] = cluster_center_pdb
+        clt_dic[cluster_id] = [cluster_center_pdb]
+        clt_dic[cluster_id].extend(models[m] for m in members)
+
+    # Rank the clusters
+    #  they are sorted by the topX (threshold) models in each cluster
+    score_dic = {}
+    for clt_id in clt_dic:
+        score_l = [p.score for p in clt_dic[clt_id]]
+        score_l.sort()
+        denom = float(min(threshold, len(score_l)))
+        top4_score = sum(score_l[:threshold]) / denom
+        score_dic[clt_id] = top4_score
+
+    sorted_score_dic = sorted(score_dic.items(), key=lambda k: k[1])
+
+    # Add this info to the models
+    output_models = []
+    for cluster_rank, _e in enumerate(sorted_score_dic, start=1):
+        cluster_id, _ = _e
+        # sort the models by score
+        clt_dic[cluster_id].sort()
+        # rank the models
+        for model_ranking, pdb in enumerate(clt_dic[cluster_id],
+                                            start=1):
+            pdb.clt_id = cluster_id
+            pdb.clt_rank = cluster_rank
+            pdb.clt_model_rank = model_ranking
+            output_models.append(pdb)
+
+    # Write unclustered structures
+    write_structure_list(models,
+                         output_models,
+                         out_fname="clustfcc.tsv")
+
+    # Prepare clustfcc.txt
+    output_fname = Path('clustfcc.txt')
+    output_str = f'### clustfcc output ###{os.linesep}'
+    output_str += os.linesep
+    output_str += f'Clustering parameters {os.linesep}'
+    output_str += (
+        "> contact_distance_cutoff="
+        f"{params['contact_distance_cutoff']}A"
+        f"{os.linesep}")
+    output_str += (
+        f"> fraction_cutoff={params['fraction_cutoff']}"
+        f"{os.linesep}")
+    output_str += f"> threshold={params['threshold']}{os.linesep}"
+    output_str += (
+        f"> strictness={params['strictness']}{os.linesep}")
+    output_str += os.linesep
+    output_str += (
+        "Note: Models marked with * represent the center of the cluster"
+        f"{os.linesep}")
+    output_str += (
+        f"-----------------------------------------------{os.linesep}")
+    output_str += os.linesep
+    output_str += f'Total # of clusters: {len(clusters)}{os.linesep}'
+
+    for cluster_rank, _e in enumerate(sorted_score_dic, start=1):
+        cluster_id, _ = _e
+        center_pdb = clt_centers[cluster_id]
+        model_score_l = [(e.score, e) for e in clt_dic[cluster_id]]
+        model_score_l.sort()
+        subset_score_l = [e[0] for e in model_score_l][:threshold]
+        top_mean_score = np.mean(subset_score_l)
+        top_std = np.std(subset_score_l)
+        output_str += (
+            f"{os.linesep}"
+            "-----------------------------------------------"
+            f"{os.linesep}"
+            f"Cluster {cluster_rank} (#{cluster_id}, "
+            f"n={len(model_score_l)}, "
+            f"top{threshold}_avg_score = {top_mean_score:.2f} "
+            f"+-{top_std:.2f})"
+            f"{os.linesep}")
+        output_str += os.linesep
+        output_str += f'clt_rank\tmodel_name\tscore{os.linesep}'
+        for model_ranking, element in enumerate(model_score_l, start=1):
+            score, pdb = element
+            if pdb.file_name == center_pdb.file_name:
+                output_str += (
+                    f"{model_ranking}\t{pdb.file_name}\t{score:.2f}\t*"
+                    f"{os.linesep}")
+            else:
+                output_str += (
+                    f"{model_ranking}\t{pdb.file_name}\t{score:.2f}"
+                    f"{os.linesep}")
+    output_str += (
+        "-----------------------------------------------"
+        f"{os.linesep}")
+
+    log.info('Saving detailed output to clustfcc.txt')
+    with open(output_fname, 'w') as out_fh:
+        out_fh.write(output_str)
+
+    return output_models
@@ -0,0 +1,134 @@
+"""
+Leader RMSD clustering module.
+
+This module clusters the models of the previous step by RMSD without
+calculating the full RMSD matrix, for sampling runs too large for the
+`rmsdmatrix` and `clustrmsd` modules. The coordinates of all the models are
+loaded once, as in `rmsdmatrix`, and the models are visited from the best to
+the worst score: each model joins the closest cluster leader within
+`clust_cutoff`, or becomes the leader of a new cluster.
+
+The RMSD of every leader to the first `npivots` leaders is kept. As the RMSD
+satisfies the triangle inequality, these values bound the RMSD of a model to
+the other leaders, and only the leaders that can be within `clust_cutoff` are
+compared with it. The number of RMSD calculations grows with the number of
+models times the number of clusters, instead of the square of the number of
+models.
+
+The clusters are coarser than the hierarchical clusters of `clustrmsd`: all
+the models of a cluster are within `clust_cutoff` of the leader, which is
+the cluster center, but not of each other. The models are annotated in the same
+way as in `clustrmsd`, and `cluster.out`, `clustleader.tsv` and
+`clustleader.txt` follow the `clustrmsd` formats.
+
+To measure how close the clusters come to the exact ones, set `exact_sample` to
+a number of models: these are clustered with the full RMSD matrix, with the
+`clustrmsd` default linkage and the ``distance`` criterion at `clust_cutoff`,
+and the adjusted Rand index of the two clusterings of the sample, 1 for
+identical clusterings, is reported in `clustleader.txt`.
+
+The `resdic_` parameter selects the residues used in the RMSD calculation, as
+in `rmsdmatrix`.
+"""
+import contextlib
+from pathlib import Path
+
+import numpy as np
+
+from haddock.modules import BaseHaddockModule
+from haddock.modules.analysis import confirm_resdic_chainid_length
+from haddock.modules.analysis.clustleader.clustleader import (
+    compare_exact,
+    leader_clustering,
+    )
+from haddock.modules.analysis.clustrmsd.clustrmsd import (
+    iterate_threshold,
+    write_clusters,
+    )
+from haddock.modules.analysis.rmsdmatrix.rmsd import load_model_coords
+
+
+RECIPE_PATH = Path(__file__).resolve().parent
+DEFAULT_CONFIG = Path(RECIPE_PATH, "defaults.yaml")
+
+
+class HaddockModule(BaseHaddockModule):
+    """HADDOCK3 module for leader clustering with RMSD."""
+
+    name = RECIPE_PATH.name
+
+    def __init__(self, order, path, initial_params=DEFAULT_CONFIG):
+        super().__init__(order, path, initial_params)
+
+    @classmethod
+    def confirm_installation(cls):
+        """Confirm the module is installed."""
+        return
+
+    def update_params(self, *args, **kwargs):
+        """Update parameters."""
+        super().update_params(*args, **kwargs)
+        with contextlib.suppress(KeyError):
+            self.params.pop("resdic_")
+
+        confirm_resdic_chainid_length(self._params)
+
+    def _run(self):
+        """Execute module."""
+        models = self.previous_io.retrieve_models()
+        filter_resdic = {
+            key[-1]: value for key, value
+            in self.params.items()
+            if key.startswith("resdic")
+            }
+        _, xyz, mask = load_model_coords(models, filter_resdic)
+
+        # the best models become the leaders
+        order = np.argsort([m.score for m in models], kind="stable")
+        cutoff = self.params["clust_cutoff"]
+        leader_arr, leaders, ncalc = leader_clustering(
+            xyz[order],
+            mask[order],
+            cutoff,
+            self.params["npivots"],
+            )
+        cluster_arr = np.empty_like(leader_arr)
+        cluster_arr[order] = leader_arr
+        threshold = self.params["threshold"]
+
+        parameters = [
+            f"clust_cutoff={cutoff:.2f}",
+            f"threshold={threshold}",
+            f"npivots={self.params['npivots']}",
+            f"rmsd_calculations={ncalc}",
+            ]
+        if self.params["exact_sample"]:
+            agreement = compare_exact(
+                xyz,
+                mask,
+                cluster_arr,
+                cutoff,
+                self.params["exact_sample"],
+                )
+            self.log(
+                "adjusted Rand index to the exact clustering of "
+                f"{min(self.params['exact_sample'], len(models))} models: "
+                f"{agreement:.3f}"
+                )
+            parameters.append(f"exact_agreement={agreement:.3f}")
+
+        cluster_arr = iterate_threshold(cluster_arr, threshold)
+        cluster_centers = {
+            cl_id: order[leader]
+            for cl_id, leader in enumerate(leaders, start=1)
+            if cl_id in cluster_arr
+            }
+        self.output_models = write_clusters(
+            models,
+            cluster_arr,
+            cluster_centers,
+            threshold,
+            parameters,
+            name=self.name,
+            )
+        self.export_output_models()
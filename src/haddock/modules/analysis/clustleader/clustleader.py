@@ -0,0 +1,208 @@
+"""Leader clustering on RMSD."""
+import numpy as np
+
+from haddock import log
+from haddock.modules.analysis.clustrmsd.clustrmsd import (
+    get_clusters,
+    get_dendrogram,
+    )
+from haddock.modules.analysis.rmsdmatrix.rmsd import block_rmsd
+
+
+def leader_clustering(xyz, mask, cutoff, npivots=8):
+    """
+    Cluster the models around leaders.
+
+    The models are visited in order, and each joins the closest leader
+    within `cutoff`, or becomes a new leader. The RMSD of each leader to
+    the first `npivots` leaders, the pivots, is kept: as the RMSD satisfies
+    the triangle inequality, ``|d(x, p) - d(l, p)|`` is a lower bound of
+    the RMSD of a model `x` to a leader `l`, and leaders whose bound exceeds
+    `cutoff` are not compared with the model.
+
+    The cost is about ``N * (npivots + candidates)`` RMSD calculations,
+    instead of the ``N * (N - 1) / 2`` of the full matrix.
+
+    Parameters
+    ----------
+    xyz : np.ndarray
+        The coordinates, shape (n_models, n_atoms, 3).
+    mask : np.ndarray
+        Whether each model has each atom, shape (n_models, n_atoms).
+    cutoff : float
+        The largest RMSD of a model to its leader.
+    npivots : int
+        The number of leaders used to bound the RMSD to the others.
+
+    Returns
+    -------
+    cluster_arr : np.ndarray
+        The cluster of each model, from 1, in the order leaders are found.
+    leaders : np.ndarray
+        The index of the leader of each cluster.
+    ncalc : int
+        The number of RMSD calculated.
+    """
+    nmodels = len(xyz)
+    cluster_arr = np.zeros(nmodels, dtype=int)
+    leaders = []
+    # RMSD of each leader to the pivots, grown when needed
+    pivot_rmsd = np.zeros((64, npivots))
+    ncalc = 0
+    for model in range(nmodels):
+        npiv = min(len(leaders), npivots)
+        to_pivots = block_rmsd(
+            xyz[model],
+            mask[model],
+            xyz[leaders[:npiv]],
+            mask[leaders[:npiv]],
+            )
+        candidates = np.arange(npiv)
+        distances = to_pivots
+        if len(leaders) > npiv:
+            bounds = np.abs(
+                pivot_rmsd[npiv:len(leaders), :npiv] - to_pivots
+                ).max(axis=1)
+            others = np.flatnonzero(bounds <= cutoff) + npiv
+            if len(others):
+                sel = [leaders[i] for i in others]
+                distances = np.concatenate((
+                    distances,
+                    block_rmsd(xyz[model], mask[model], xyz[sel], mask[sel]),
+                    ))
+                candidates = np.concatenate((candidates, others))
+        ncalc += len(distances)
+
+        if len(distances) and distances.min() <= cutoff:
+            cluster_arr[model] = candidates[np.argmin(distances)] + 1
+            continue
+
+        # new leader
+        if len(leaders) == len(pivot_rmsd):
+            pivot_rmsd = np.concatenate((pivot_rmsd, np.zeros_like(pivot_rmsd)))
+        pivot_rmsd[len(leaders), :npiv] = to_pivots
+        if npiv < npivots:
+            # the new leader is also a pivot
+            pivot_rmsd[:npiv, npiv] = to_pivots
+        leaders.append(model)
+        cluster_arr[model] = len(leaders)
+
+    log.info(
+        f"{len(leaders)} leaders found with {ncalc} RMSD calculations, "
+        f"{nmodels * (nmodels - 1) // 2} for the full matrix"
+        )
+    return cluster_arr, np.array(leaders, dtype=int), ncalc
+
+
+def adjusted_rand_index(labels_a, labels_b):
+    """
+    Calculate the adjusted Rand index of two clusterings.
+
+    The index is 1 for identical clusterings, whatever the cluster ids, and
+    about 0 for random ones.
+
+    Parameters
+    ----------
+    labels_a : np.ndarray
+        The cluster of each model in the first clustering.
+    labels_b : np.ndarray
+        The cluster of each model in the second clustering.
+
+    Returns
+    -------
+    float
+    """
+    _, inv_a = np.unique(labels_a, return_inverse=True)
+    _, inv_b = np.unique(labels_b, return_inverse=True)
+    contingency = np.zeros((inv_a.max() + 1, inv_b.max() + 1))
+    np.add.at(contingency, (inv_a, inv_b), 1)
+
+    def pairs(counts):
+        return (counts * (counts - 1) / 2).sum()
+
+    sum_comb = pairs(contingency)
+    sum_a = pairs(contingency.sum(axis=1))
+    sum_b = pairs(contingency.sum(axis=0))
+    expected = sum_a * sum_b / pairs(np.array([len(inv_a)]))
+    max_index = (sum_a + sum_b) / 2
+    if max_index == expected:
+        # both clusterings are trivial
+        return 1.0
+    return float((sum_comb - expected) / (max_index - expected))
+
+
+def exact_clustering(xyz, mask, cutoff, linkage_type="average"):
+    """
+    Cluster the models with the full RMSD matrix.
+
+    This is the :py:mod:`haddock.modules.analysis.clustrmsd` clustering,
+    with the ``distance`` criterion and `cutoff` as tolerance.
+
+    Parameters
+    ----------
+    xyz : np.ndarray
+        The coordinates, shape (n_models, n_atoms, 3).
+    mask : np.ndarray
+        Whether each model has each atom, shape (n_models, n_atoms).
+    cutoff : float
+        The distance at which the dendrogram is cut.
+    linkage_type : str
+        The linkage method.
+
+    Returns
+    -------
+    cluster_arr : np.ndarray
+        The cluster of each model.
+    """
+    nmodels = len(xyz)
+    matrix = np.concatenate([
+        block_rmsd(xyz[i], mask[i], xyz[i + 1:], mask[i + 1:])
+        for i in range(nmodels - 1)
+        ])
+    dendrogram = get_dendrogram(matrix, linkage_type)
+    return get_clusters(dendrogram, cutoff, "distance")
+
+
+def compare_exact(
+        xyz,
+        mask,
+        cluster_arr,
+        cutoff,
+        sample_size,
+        linkage_type="average",
+        seed=42,
+        ):
+    """
+    Compare the leader clusters with the exact clustering of a sample.
+
+    Parameters
+    ----------
+    xyz : np.ndarray
+        The coordinates, shape (n_models, n_atoms, 3).
+    mask : np.ndarray
+        Whether each model has each atom, shape (n_models, n_atoms).
+    cluster_arr : np.ndarray
+        The leader cluster of each model.
+    cutoff : float
+        The RMSD cutoff of the clusterings.
+    sample_size : int
+        The number of models clustered exactly.
+    linkage_type : str
+        The linkage method of the exact clustering.
+    seed : int
+        The seed of the sample.
+
+    Returns
+    -------
+    float
+        The adjusted Rand index of the two clusterings of the sample.
+    """
+    nmodels = len(xyz)
+    rng = np.random.default_rng(seed)
+    sample = np.sort(rng.choice(
+        nmodels,
+        min(sample_size, nmodels),
+        replace=False,
+        ))
+    exact = exact_clustering(xyz[sample], mask[sample], cutoff, linkage_type)
+    return adjusted_rand_index(cluster_arr[sample], exact)
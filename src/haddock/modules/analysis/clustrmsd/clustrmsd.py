@@ -1,16 +1,25 @@
 """RMSD clustering."""
+import os
 from pathlib import Path
 
 import numpy as np
 from scipy.cluster.hierarchy import fcluster, linkage
 
 from haddock import log
+from haddock.libs.libclust import write_structure_list
 from haddock.libs.libontology import RMSDFile
 
 
+LINKAGE_FILE = "linkage_{}.npz"
+"""The linkage of a RMSD matrix, saved next to the matrix."""
+
+
 def read_matrix(rmsd_matrix):
     """
     Read the RMSD matrix.
+
+    Binary (``.npy``) matrices are memory-mapped, not copied; other files
+    are parsed as text, with one ``i j rmsd`` line per pair.
     
     Parameters
     ----------
@@ -26,8 +35,14 @@ def read_matrix(rmsd_matrix):
         err = f"{type(rmsd_matrix)} is not a RMSDFile object."
         raise TypeError(err)
     filename = Path(rmsd_matrix.path, rmsd_matrix.file_name)
-    # count lines
-    nlines = sum(1 for line in open(filename))
+    if filename.suffix == ".npy":
+        matrix = np.load(filename, mmap_mode="r")
+        if matrix.ndim != 1:
+            raise ValueError(f"{filename} is not a condensed matrix")
+        nlines = len(matrix)
+    else:
+        # count lines
+        nlines = sum(1 for line in open(filename))
     log.info(f"input rmsd matrix has {nlines} entries")
     # must be a 1D condensed distance matrix
     d = int(np.ceil(np.sqrt(nlines * 2)))
@@ -37,6 +52,8 @@ def read_matrix(rmsd_matrix):
     if nlines != rmsd_matrix.npairs:
         err = f"number of pairs {nlines} != expected ({rmsd_matrix.npairs})"
         raise ValueError(err)
+    if filename.suffix == ".npy":
+        return matrix
     # creating and filling matrix obj
     matrix = np.zeros((nlines))
     c = 0
@@ -57,6 +74,59 @@ def get_dendrogram(rmsd_matrix, linkage_type):
     return Z
 
 
+def _matrix_signature(matrix_f):
+    """Return the size and modification time of the matrix file."""
+    stat = os.stat(matrix_f)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def load_linkage(rmsd_matrix, linkage_type, matrix=None):
+    """
+    Get the linkage of a RMSD matrix, calculating it only once.
+
+    The linkage is saved next to the matrix, together with the size and
+    modification time of the matrix, and read back as long as the matrix
+    does not change.
+
+    Parameters
+    ----------
+    rmsd_matrix : :obj:`RMSDFile`
+        RMSDFile object with the path to the RMSD matrix.
+
+    linkage_type : str
+        The linkage method.
+
+    matrix : np.ndarray, optional
+        The RMSD matrix, if already read with :py:func:`read_matrix`. It is
+        read from `rmsd_matrix` only when the linkage is calculated.
+
+    Returns
+    -------
+    dendrogram : np.ndarray
+        The linkage matrix.
+    """
+    matrix_f = Path(rmsd_matrix.path, rmsd_matrix.file_name)
+    linkage_f = Path(rmsd_matrix.path, LINKAGE_FILE.format(linkage_type))
+    signature = _matrix_signature(matrix_f)
+    if linkage_f.exists():
+        with np.load(linkage_f) as saved:
+            if str(saved["matrix"]) == signature:
+                log.info(f"Reading the {linkage_type} linkage from {linkage_f}")
+                return saved["linkage"]
+
+    if matrix is None:
+        matrix = read_matrix(rmsd_matrix)
+    dendrogram = get_dendrogram(matrix, linkage_type)
+    tmp_f = Path(rmsd_matrix.path, f".{os.getpid()}_{linkage_f.name}")
+    try:
+        with open(tmp_f, "wb") as fout:
+            np.savez(fout, linkage=dendrogram, matrix=np.array(signature))
+        os.replace(tmp_f, linkage_f)
+    except OSError as err:
+        log.warning(f"Could not save the linkage to {linkage_f}: {err}")
+    return dendrogram
+
+
 def get_clusters(dendrogram, tolerance, criterion):
     """Obtain the clusters."""
     log.info('Clustering dendrogram...')
@@ -80,19 +150,17 @@ def apply_threshold(cluster_arr, threshold):
     cluster_arr : np.ndarray
         Array of clusters (unclustered structures are labelled with -1)
     """
-    new_cluster_arr = cluster_arr.copy()
     log.info(f"Applying threshold {threshold} to cluster list")
-    cluster_pops = np.unique(cluster_arr, return_counts=True)
-    uncl_idx = np.where(cluster_pops[1] < threshold)[0]
-    invalid_clusters = cluster_pops[0][uncl_idx]
+    cluster_ids, cluster_pops = np.unique(cluster_arr, return_counts=True)
+    invalid_clusters = cluster_ids[cluster_pops < threshold]
     log.info(f"Invalid clusters: {invalid_clusters}")
     # replacing invalid clusters with -1
-    uncl_models = 0
-    for cl_idx, cl_id in enumerate(new_cluster_arr):
-        if cl_id in invalid_clusters:
-            new_cluster_arr[cl_idx] = -1
-            uncl_models += 1
-    log.info(f"Threshold applied, {uncl_models} models left unclustered")
+    unclustered = np.isin(cluster_arr, invalid_clusters)
+    new_cluster_arr = np.where(unclustered, -1, cluster_arr)
+    log.info(
+        f"Threshold applied, {np.count_nonzero(unclustered)} models left "
+        "unclustered"
+        )
     return new_cluster_arr
 
 
@@ -129,20 +197,24 @@ def cond_index(i, j, n):
 
     Parameters
     ----------
-    i : int
+    i : int or np.ndarray
         Index of the first element.
-    j : int
-        Index of the second element.
+    j : int or np.ndarray
+        Index of the second element, greater than `i`.
     n : int
         Number of observations.
     """
-    return n * (n - 1) / 2 - (n - i) * (n - i - 1) / 2 + j - i - 1
+    return n * i - i * (i + 1) // 2 + j - i - 1
 
 
-def get_cluster_center(npw, n_obs, rmsd_matrix):
+def get_cluster_center(npw, n_obs, rmsd_matrix, block_size=2**22):
     """
     Get the cluster centers.
 
+    The center is the model with the lowest sum of distances to the other
+    models of the cluster. The distances are read from the condensed
+    matrix by blocks of rows of the cluster submatrix.
+
     Parameters
     ----------
     npw: np.ndarray
@@ -151,20 +223,272 @@ def get_cluster_center(npw, n_obs, rmsd_matrix):
         Number of overall observations (models).
     rmsd_matrix : np.ndarray
         RMSD matrix.
+    block_size : int
+        The maximum number of distances read at once.
 
     Returns
     -------
     cluster_center : int
         Index of cluster center
     """
-    intra_cl_distances = {el: 0.0 for el in npw}
-    
-    # iterating over the elements of the cluster
-    for m_idx in range(len(npw)):
-        npws = npw[m_idx + 1:]
-        pairs = [int(cond_index(npw[m_idx], npw_el, n_obs)) for npw_el in npws]
-        for pair_idx in range(len(pairs)):
-            intra_cl_distances[npw[m_idx]] += rmsd_matrix[pairs[pair_idx]]
-            intra_cl_distances[npws[pair_idx]] += rmsd_matrix[pairs[pair_idx]]
-    cluster_center = min(intra_cl_distances, key=intra_cl_distances.get)
-    return cluster_center
+    npw = np.asarray(npw, dtype=np.int64)
+    nmembers = len(npw)
+    intra_cl_distances = np.zeros(nmembers)
+    nrows = max(block_size // max(nmembers, 1), 1)
+    cols = np.arange(nmembers)
+    for start in range(0, nmembers - 1, nrows):
+        rows = np.arange(start, min(start + nrows, nmembers - 1))
+        # the upper triangle of the cluster submatrix
+        upper = cols[None, :] > rows[:, None]
+        first = np.minimum(npw[rows][:, None], npw[None, :])[upper]
+        second = np.maximum(npw[rows][:, None], npw[None, :])[upper]
+        distances = np.zeros(upper.shape)
+        distances[upper] = rmsd_matrix[cond_index(first, second, n_obs)]
+        intra_cl_distances[rows] += distances.sum(axis=1)
+        intra_cl_distances += distances.sum(axis=0)
+    cluster_center = npw[np.argmin(intra_cl_distances)]
+    return int(cluster_center)
+
+
+def get_tolerance(tolerance, criterion, dendrogram, nmodels):
+    """
+    Get the tolerance used to cut the dendrogram.
+
+    Parameters
+    ----------
+    tolerance : float
+        The tolerance given by the user, NaN if not defined.
+    criterion : str
+        The criterion used to cut the dendrogram.
+    dendrogram : np.ndarray
+        The linkage matrix.
+    nmodels : int
+        The number of models.
+
+    Returns
+    -------
+    tol : int or float
+        The number of clusters, for `maxclust`, or the distance, for
+        `distance`.
+    """
+    if np.isnan(tolerance):
+        log.info("tolerance is not defined")
+        if criterion == "maxclust":
+            tol = max(nmodels // 4 + 1, 2)
+        else:
+            tol = np.mean(dendrogram[:, 2])
+        log.info(f"Setting tolerance to {tol:.2f} for criterion {criterion}")
+    elif criterion == "maxclust":
+        tol = int(tolerance)
+    elif criterion == "distance":
+        tol = float(tolerance)
+    else:
+        raise Exception(f"unknown criterion {criterion}")
+    log.info(f"tolerance {tol}")
+    return tol
+
+
+def cluster_models(
+        models,
+        dendrogram,
+        rmsd_matrix,
+        linkage_type,
+        criterion,
+        tolerance,
+        threshold,
+        ):
+    """
+    Cut the dendrogram and write the clusters.
+
+    The models are annotated with their cluster, and ``cluster.out``,
+    ``clustrmsd.tsv`` and ``clustrmsd.txt`` are written in the current
+    folder.
+
+    Parameters
+    ----------
+    models : list
+        The models, in the order of the RMSD matrix.
+    dendrogram : np.ndarray
+        The linkage matrix.
+    rmsd_matrix : np.ndarray
+        The condensed RMSD matrix, used to find the cluster centers.
+    linkage_type : str
+        The linkage method, reported in ``clustrmsd.txt``.
+    criterion : str
+        The criterion used to cut the dendrogram.
+    tolerance : float
+        The tolerance, NaN to calculate it from the dendrogram.
+    threshold : int
+        The minimum population of a cluster.
+
+    Returns
+    -------
+    output_models : list
+        The clustered models, sorted by cluster rank and score.
+    """
+    crit = criterion
+    tol = get_tolerance(tolerance, crit, dendrogram, len(models))
+    cluster_arr = get_clusters(dendrogram, tol, crit)
+
+    # when crit == distance, apply clustering threshold
+    if crit == "distance":
+        cluster_arr = iterate_threshold(cluster_arr, threshold)
+
+    n_obs = len(cluster_arr)
+    cluster_centers = {
+        cl_id: get_cluster_center(
+            np.where(cluster_arr == cl_id)[0],
+            n_obs,
+            rmsd_matrix,
+            )
+        for cl_id in np.unique(cluster_arr) if cl_id != -1
+        }
+    return write_clusters(
+        models,
+        cluster_arr,
+        cluster_centers,
+        threshold,
+        [
+            f"linkage_type={linkage_type}",
+            f"criterion={crit}",
+            f"tolerance={tol:.2f}",
+            f"threshold={threshold}",
+            ],
+        )
+
+
+def write_clusters(
+        models,
+        cluster_arr,
+        cluster_centers,
+        threshold,
+        parameters,
+        name="clustrmsd",
+        ):
+    """
+    Rank the clusters, annotate the models and write the clusters.
+
+    ``cluster.out``, ``<name>.tsv`` and ``<name>.txt`` are written in the
+    current folder.
+
+    Parameters
+    ----------
+    models : list
+        The clustered models.
+    cluster_arr : np.ndarray
+        The cluster of each model, -1 for unclustered models.
+    cluster_centers : dict
+        The index of the center of each cluster.
+    threshold : int
+        The number of models whose scores rank the clusters.
+    parameters : list of str
+        The clustering parameters, reported in ``<name>.txt``.
+    name : str
+        The name of the module, used for the output files.
+
+    Returns
+    -------
+    output_models : list
+        The clustered models, sorted by cluster rank and score.
+    """
+    # print clusters
+    unq_clusters = np.unique(cluster_arr)  # contains -1 (unclustered)
+    clusters = [c for c in unq_clusters if c != -1]
+    log.info(f"clusters = {clusters}")
+
+    # preparing output
+    clt_dic = {}
+    log.info('Saving output to cluster.out')
+    cluster_out = Path('cluster.out')
+    with open(cluster_out, 'w') as fh:
+        for cl_id in clusters:
+            npw = np.where(cluster_arr == cl_id)[0]
+            clt_dic[cl_id] = [models[n] for n in npw]
+            fh.write(f"Cluster {cl_id} -> ")
+            for el in npw[:-1]:
+                fh.write(f"{el + 1} ")
+            fh.write(f"{npw[-1] + 1}")
+            fh.write(os.linesep)
+    centers = {
+        cl_id: models[center].file_name
+        for cl_id, center in cluster_centers.items()
+        }
+    # rank the clusters
+    score_dic = {}
+    for clt_id in clt_dic:
+        score_l = [p.score for p in clt_dic[clt_id]]
+        score_l.sort()
+        denom = float(min(threshold, len(score_l)))
+        top4_score = sum(score_l[:threshold]) / denom
+        score_dic[clt_id] = top4_score
+
+    sorted_score_dic = sorted(score_dic.items(), key=lambda k: k[1])
+
+    # Add this info to the models
+    output_models = []
+    for cluster_rank, _e in enumerate(sorted_score_dic, start=1):
+        cluster_id, _ = _e
+        # sort the models by score
+        clt_dic[cluster_id].sort()
+        # rank the models
+        for model_ranking, pdb in enumerate(clt_dic[cluster_id],
+                                            start=1):
+            pdb.clt_id = int(cluster_id)
+            pdb.clt_rank = cluster_rank
+            pdb.clt_model_rank = model_ranking
+            output_models.append(pdb)
+
+    # Write unclustered structures
+    write_structure_list(models,
+                         output_models,
+                         out_fname=f"{name}.tsv")
+
+    # Prepare the detailed output
+    output_fname = Path(f'{name}.txt')
+    output_str = f'### {name} output ###{os.linesep}'
+    output_str += os.linesep
+    output_str += f'Clustering parameters {os.linesep}'
+    for parameter in parameters:
+        output_str += f"> {parameter}{os.linesep}"
+    output_str += os.linesep
+
+    output_str += (
+        f"-----------------------------------------------{os.linesep}")
+    output_str += os.linesep
+    output_str += f'Total # of clusters: {len(clusters)}{os.linesep}'
+    for cluster_rank, _e in enumerate(sorted_score_dic, start=1):
+        cluster_id, _ = _e
+
+        model_score_l = [(e.score, e) for e in clt_dic[cluster_id]]
+        model_score_l.sort()
+        top_score = score_dic[cluster_id]
+
+        output_str += (
+            f"{os.linesep}"
+            "-----------------------------------------------"
+            f"{os.linesep}"
+            f"Cluster {cluster_rank} (#{cluster_id}, "
+            f"n={len(model_score_l)}, "
+            f"top{threshold}_avg_score = {top_score:.2f})"
+            f"{os.linesep}")
+        output_str += os.linesep
+        output_str += f'clt_rank\tmodel_name\tscore{os.linesep}'
+        for model_ranking, element in enumerate(model_score_l, start=1):
+            score, pdb = element
+            # is the model the cluster center?
+            if pdb.file_name == centers[cluster_id]:
+                output_str += (
+                    f"{model_ranking}\t{pdb.file_name}\t{score:.2f}\t*"
+                    f"{os.linesep}")
+            else:
+                output_str += (
+                    f"{model_ranking}\t{pdb.file_name}\t{score:.2f}"
+                    f"{os.linesep}")
+    output_str += (
+        "-----------------------------------------------"
+        f"{os.linesep}")
+    log.info(f'Saving detailed output to {output_fname}')
+    with open(output_fname, 'w') as out_fh:
+        out_fh.write(output_str)
+
+    return output_models
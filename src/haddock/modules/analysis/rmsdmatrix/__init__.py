@@ -5,15 +5,24 @@ This module calculates of the RMSD matrix between all the models
 generated in the previous step.
 
 As all the pairwise RMSD calculations are independent, the module distributes
-them over all the available cores in an optimal way.
+them over all the available cores in an optimal way. The coordinates of all
+the models are loaded once, before the calculation, and shared by all the
+cores.
 
-Once created, the RMSD matrix is saved in text form in the current `rmsdmatrix`
-folder. The path to this file is then shared with the following step of the
-workflow by means of the json file `rmsd_matrix.json`.
+Once created, the condensed RMSD matrix is saved in binary form (`rmsd.npy`)
+in the current `rmsdmatrix` folder. Each core writes its own slice of the
+matrix directly to this file. The path to this file is then shared with the
+following step of the workflow by means of the json file `rmsd_matrix.json`.
+A text version of the matrix (`rmsd.matrix`) can be written as well.
 
-The module accepts two parameters in input, namely:
+The module accepts the following parameters in input, namely:
 
-* `max_models` (default = 10000)
+* `max_models` (default = 10000): above this number of models the matrix is
+  calculated in tiles, see below
+* `tile_memory` (default = 2048): the memory, in MB, used by the tiled
+  calculation
+* `matrix_text` (default = false): whether to also write the matrix in text
+  form
 * `resdic_` : an expandable parameter to specify which residues must be
   considered for the alignment and the RMSD calculation. If there are
   two proteins denoted by chain IDs A and B, then the user can operate
@@ -24,20 +33,54 @@ The module accepts two parameters in input, namely:
 
 thus telling the module to consider residues from 1 to 4 of chain A and from 2
 to 4 of chain B for the alignment and RMSD calculation.
+
+Above `max_models` models, the coordinates are stored on disk and the matrix
+is calculated in tiles, blocks of models against blocks of models sized to fit
+in `tile_memory`. The calculation is kept in the `rmsd_tiles` folder of the run
+directory until it completes: if it is interrupted, running the step again,
+for example with ``--restart``, resumes it from the tiles not yet calculated.
+
+Along with the matrix, the module saves the hash of the coordinates of each
+model, and of the atom selection, in `rmsd_models.json`. If another step of the
+run directory holds a matrix with the same atom selection, for example after
+``--extend-run`` or ``haddock3-copy``, the RMSD values of the models the two
+matrices share are copied from it, and only the pairs involving new models are
+calculated.
 """
 import contextlib
+import json
+import shutil
 from pathlib import Path
 
+import numpy as np
+
 from haddock import log
 from haddock.libs.libontology import ModuleIO, RMSDFile
 from haddock.libs.libparallel import Scheduler
 from haddock.libs.libutil import parse_ncores
-from haddock.modules import BaseHaddockModule
+from haddock.modules import BaseHaddockModule, get_module_steps_folders
 from haddock.modules.analysis import confirm_resdic_chainid_length
 from haddock.modules.analysis.rmsdmatrix.rmsd import (
+    MATRIX_MODELS_FILE,
     RMSD,
     RMSDJob,
+    coords_hash,
+    create_matrix,
+    fill_from_matrix,
+    find_matrix,
+    load_model_coords,
     rmsd_dispatcher,
+    save_matrix_models,
+    selection_hash,
+    write_matrix_text,
+    )
+from haddock.modules.analysis.rmsdmatrix.tiled import (
+    RMSDTile,
+    count_missing,
+    get_tile_size,
+    get_tiles,
+    get_tiles_root,
+    prepare_tiles,
     )
 
 
@@ -58,21 +101,6 @@ class HaddockModule(BaseHaddockModule):
         """Confirm if contact executable is compiled."""
         return
 
-    def _rearrange_output(self, output_name, path, ncores):
-        """Combine different rmsd outputs in a single file."""
-        output_fname = Path(path, output_name)
-        self.log(f"rearranging output files into {output_fname}")
-        # Combine files
-        with open(output_fname, 'w') as out_file:
-            for core in range(ncores):
-                tmp_file = Path(path, "rmsd_" + str(core) + ".matrix")
-                with open(tmp_file) as infile:
-                    out_file.write(infile.read())
-                log.debug(f"File number {core} written")
-                tmp_file.unlink()
-        log.info("Completed reconstruction of rmsd files.")
-        log.info(f"{output_fname} created.")
-
     def update_params(self, *args, **kwargs):
         """Update parameters."""
         super().update_params(*args, **kwargs)
@@ -93,38 +121,84 @@ class HaddockModule(BaseHaddockModule):
             individualize=True
             )
 
-        # Parallelisation : optimal dispatching of models
         nmodels = len(models)
-        if nmodels > self.params["max_models"]:
-            # too many input models : RMSD matrix would be too big => Abort!
-            raise Exception("Too many models for RMSD matrix calculation")
         tot_npairs = nmodels * (nmodels - 1) // 2
         log.info(f"total number of pairs {tot_npairs}")
+        filter_resdic = {
+            key[-1]: value for key, value
+            in self.params.items()
+            if key.startswith("resdic")
+            }
+        if nmodels > self.params["max_models"]:
+            # too many input models : the matrix is calculated in tiles
+            self.log(
+                f"{nmodels} models exceed max_models "
+                f"({self.params['max_models']}), using the tiled calculation"
+                )
+            output_name = self._run_tiled(models, filter_resdic)
+        else:
+            output_name = self._run_cores(models, filter_resdic)
+
+        if self.params["matrix_text"]:
+            self.log("writing the RMSD matrix to rmsd.matrix")
+            rmsd_matrix = np.load(output_name, mmap_mode="r")
+            write_matrix_text(rmsd_matrix, nmodels, "rmsd.matrix")
+
+        # Sending models to the next step of the workflow
+        self.output_models = models
+        self.export_output_models()
+        # Sending matrix path to the next step of the workflow
+        matrix_io = ModuleIO()
+        rmsd_matrix_file = RMSDFile(
+            output_name,
+            npairs=tot_npairs
+            )
+        matrix_io.add(rmsd_matrix_file)
+        matrix_io.save(filename="rmsd_matrix.json")
+
+    def _run_cores(self, models, filter_resdic):
+        """Calculate the matrix with one slice of pairs per core."""
+        # Parallelisation : optimal dispatching of models
+        nmodels = len(models)
+        tot_npairs = nmodels * (nmodels - 1) // 2
         ncores = parse_ncores(n=self.params['ncores'], njobs=tot_npairs)
         npairs, ref_structs, mod_structs = rmsd_dispatcher(
             nmodels,
             tot_npairs,
             ncores)
 
+        # the coordinates are loaded once and shared by all the jobs
+        keys, *coords = load_model_coords(models, filter_resdic)
+        selection = selection_hash(keys, filter_resdic)
+        hashes = [coords_hash(*model_coords) for model_coords in zip(*coords)]
+
+        # the matrix is created here and filled by the cores
+        output_name = "rmsd.npy"
+        create_matrix(output_name, tot_npairs)
+        self._reuse_matrix(output_name, selection, hashes)
+        save_matrix_models(MATRIX_MODELS_FILE, selection, hashes)
+        offsets = np.cumsum([0] + npairs[:-1]).tolist()
+
         # Calculate the rmsd for each set of models
         rmsd_jobs = []
         self.log(f"running Rmsd Jobs with {ncores} cores")
         for core in range(ncores):
-            output_name = "rmsd_" + str(core) + ".matrix"
             rmsd_obj = RMSD(
                 models,
                 core,
                 npairs[core],
                 ref_structs[core],
                 mod_structs[core],
-                output_name,
+                "rmsd_" + str(core) + ".matrix",
                 path=Path("."),
+                coords=coords,
+                matrix_file=Path(output_name),
+                offset=offsets[core],
                 params=self.params
                 )
-            job_f = Path(output_name)
             # init RMSDJob
             job = RMSDJob(
-                job_f,
+                Path(output_name),
                 self.params,
                 rmsd_obj
                 )
@@ -133,39 +207,89 @@ class HaddockModule(BaseHaddockModule):
         rmsd_engine = Scheduler(rmsd_jobs, ncores=ncores)
         rmsd_engine.run()
 
-        rmsd_file_l = []
+        rmsd_matrix = np.load(output_name, mmap_mode="r")
         not_found = []
-        for job in rmsd_jobs:
-            if not job.output.exists():
-                # NOTE: If there is no output, most likely the RMSD calculation
-                # timed out
-                not_found.append(job.output.name)
-                wrn = f'Rmsd results were not calculated for {job.output.name}'
+        for core in range(ncores):
+            core_slice = slice(offsets[core], offsets[core] + npairs[core])
+            if np.isnan(rmsd_matrix[core_slice]).any():
+                # NOTE: If there are missing values, most likely the RMSD
+                # calculation timed out
+                not_found.append(core)
+                wrn = f'Rmsd results were not calculated by core {core}'
                 log.warning(wrn)
-            else:
-                rmsd_file_l.append(str(job.output))
 
         if not_found:
             # Not all distances were calculated, cannot create the full matrix
-            self.finish_with_error("Several files were not generated:"
+            self.finish_with_error("Several cores did not complete:"
                                    f" {not_found}")
 
-        # Post-processing : single file
-        output_name = "rmsd.matrix"
-        self._rearrange_output(
-            output_name,
-            path=rmsd_obj.path,
-            ncores=ncores
+        return output_name
+
+    def _reuse_matrix(self, matrix_f, selection, hashes):
+        """Copy the values of a previous matrix with the same models."""
+        run_dir = Path.cwd().parent
+        if not Path(run_dir, "data").is_dir():
+            return
+        folders = [
+            Path(run_dir, step) for step in get_module_steps_folders(run_dir)
+            if step != Path.cwd().name
+            ]
+        previous = find_matrix(folders, selection, hashes)
+        if previous is None:
+            return
+        old_matrix_f, old_hashes = previous
+        matrix = np.load(matrix_f, mmap_mode="r+")
+        copied = fill_from_matrix(
+            matrix,
+            hashes,
+            np.load(old_matrix_f, mmap_mode="r"),
+            old_hashes,
+            )
+        matrix.flush()
+        self.log(
+            f"{copied} of {len(matrix)} RMSD values copied from "
+            f"{old_matrix_f.parent.name}"
             )
 
-        # Sending models to the next step of the workflow
-        self.output_models = models
-        self.export_output_models()
-        # Sending matrix path to the next step of the workflow
-        matrix_io = ModuleIO()
-        rmsd_matrix_file = RMSDFile(
-            output_name,
-            npairs=tot_npairs
+    def _run_tiled(self, models, filter_resdic):
+        """Calculate the matrix in tiles, within the memory budget."""
+        nmodels = len(models)
+        tiles_path = prepare_tiles(models, get_tiles_root(), filter_resdic)
+        models_f = Path(tiles_path, MATRIX_MODELS_FILE)
+        info = json.loads(models_f.read_text())
+        self._reuse_matrix(
+            Path(tiles_path, "rmsd.npy"),
+            info["selection"],
+            info["models"],
             )
-        matrix_io.add(rmsd_matrix_file)
-        matrix_io.save(filename="rmsd_matrix.json")
+        natoms = np.load(Path(tiles_path, "mask.npy"), mmap_mode="r").shape[1]
+        ncores = parse_ncores(n=self.params['ncores'])
+        tile_size = get_tile_size(natoms, self.params["tile_memory"], ncores)
+        tiles = [
+            RMSDTile(tiles_path, nmodels, rows, cols)
+            for rows, cols in get_tiles(nmodels, tile_size)
+            ]
+        ncores = parse_ncores(n=self.params['ncores'], njobs=len(tiles))
+        self.log(
+            f"running {len(tiles)} tiles of {tile_size} models "
+            f"with {ncores} cores"
+            )
+        rmsd_engine = Scheduler(tiles, ncores=ncores)
+        rmsd_engine.run()
+
+        matrix_f = Path(tiles_path, "rmsd.npy")
+        missing = count_missing(np.load(matrix_f, mmap_mode="r"))
+        if missing:
+            self.finish_with_error(
+                f"{missing} RMSD values were not calculated. Running the "
+                f"step again resumes the calculation from {tiles_path}."
+                )
+
+        output_name = "rmsd.npy"
+        shutil.move(matrix_f, output_name)
+        shutil.move(models_f, MATRIX_MODELS_FILE)
+        shutil.rmtree(tiles_path)
+        with contextlib.suppress(OSError):
+            # only removed if there are no other calculations
+            tiles_path.parent.rmdir()
+        return output_name
@@ -1,17 +1,21 @@
 """RMSD calculations."""
+import hashlib
+import json
 import os
 from pathlib import Path
 
 import numpy as np
 
 from haddock import log
-from haddock.libs.libalign import (
-    calc_rmsd,
-    centroid,
-    get_atoms,
-    kabsch,
-    load_coords,
-    )
+from haddock.libs.libalign import batch_rmsd, get_atoms, load_coords_stack
+
+
+# maximum number of models superposed to a reference in one call
+RMSD_BLOCK_SIZE = 500
+# the condensed matrix is stored in double precision, as used by scipy
+RMSD_MATRIX_DTYPE = np.float64
+# the models of a matrix, saved next to it to extend it later
+MATRIX_MODELS_FILE = "rmsd_models.json"
 
 
 class RMSDJob:
@@ -50,6 +54,9 @@ class RMSD:
             start_mod,
             output_name,
             path,
+            coords=None,
+            matrix_file=None,
+            offset=0,
             **params,
             ):
         """
@@ -80,6 +87,20 @@ class RMSD:
         path : pathlib.Path
             path to the current directory
 
+        coords : tuple
+            The (xyz, mask) coordinates of all the models, as given by
+            :py:func:`load_coords_stack`. If not given, they are loaded
+            from the models.
+
+        matrix_file : pathlib.Path
+            The binary condensed matrix, as created by
+            :py:func:`create_matrix`. If given, the RMSD values are written
+            to it, starting at `offset`, instead of to `output_name`.
+
+        offset : int
+            The index of the first pair of this core in the condensed
+            matrix.
+
         **params : dict
             additional parameters
         """
@@ -103,9 +124,11 @@ class RMSD:
             log.info("No filtering dictionary, using all residues")
         self.output_name = output_name
         self.path = path
-        self.atoms = {}
-        for m in model_list:
-            self.atoms.update(get_atoms(m))
+        self.matrix_file = matrix_file
+        self.offset = offset
+        if coords is None:
+            _, *coords = load_model_coords(model_list, self.filter_resdic)
+        self.xyz, self.mask = coords
         # data array
         self.data = np.zeros((self.npairs, 3))
 
@@ -115,45 +138,66 @@ class RMSD:
         ref = self.start_ref
         mod = self.start_mod
         nmodels = len(self.model_list)
-        for n in range(self.npairs):
-
-            ref_coord_dic, _ = load_coords(
-                self.model_list[ref], self.atoms, self.filter_resdic
-                )
-
-            mod_coord_dic, _ = load_coords(
-                self.model_list[mod], self.atoms, self.filter_resdic
-                )
-            P = []
-            Q = []
-            for k in ref_coord_dic.keys() & mod_coord_dic.keys():
-                ref_xyz = ref_coord_dic[k]
-                mod_xyz = mod_coord_dic[k]
-                Q.append(ref_xyz)
-                P.append(mod_xyz)
-            Q = np.asarray(Q)
-            P = np.asarray(P)
-            Q = Q - centroid(Q)
-            P = P - centroid(P)
-            U = kabsch(P, Q)
-            P = np.dot(P, U)
-            rmsd = calc_rmsd(P, Q)
-            # saving output (adding one for consistency with clusterfcc)
-            self.data[n, 0] = ref + 1
-            self.data[n, 1] = mod + 1
-            self.data[n, 2] = rmsd
+        # values already in the matrix are not calculated again
+        self.data[:, 2] = np.nan
+        if self.matrix_file is not None:
+            matrix = np.load(self.matrix_file, mmap_mode="r")
+            self.data[:, 2] = matrix[self.offset:self.offset + self.npairs]
+        n = 0
+        while n < self.npairs:
+            # all the remaining pairs of the current reference are
+            #  calculated together
+            block = min(nmodels - mod, self.npairs - n, RMSD_BLOCK_SIZE)
+            mods = np.arange(mod, mod + block)
+            self.data[n:n + block, 0] = ref + 1
+            self.data[n:n + block, 1] = mods + 1
+            todo = np.isnan(self.data[n:n + block, 2])
+            if todo.any():
+                self.data[n:n + block, 2][todo] = self.calc_block(
+                    ref,
+                    mods[todo],
+                    )
+            n += block
             # updating indices
-            if mod == (nmodels - 1):
+            if mod + block == nmodels:
                 ref += 1
                 mod = ref + 1
             else:
-                mod += 1
+                mod += block
+
+    def calc_block(self, ref, mods):
+        """
+        Calculate the RMSD of a reference against several models.
+
+        Models sharing the atoms of the reference are superposed in a
+        single :py:func:`haddock.libs.libalign.batch_rmsd` call, the others
+        on the atoms they have in common with the reference.
+
+        Parameters
+        ----------
+        ref : int
+            index of the reference structure
+
+        mods : iterable of int
+            indices of the mobile structures
+
+        Returns
+        -------
+        rmsds : np.ndarray
+            The RMSD of each mobile structure.
+        """
+        mods = np.asarray(mods, dtype=int)
+        return block_rmsd(
+            self.xyz[ref],
+            self.mask[ref],
+            self.xyz[mods],
+            self.mask[mods],
+            )
 
     def output(
             self,
             ):
         """Write down the RMSD matrix."""
-        output_fname = Path(self.path, self.output_name)
         # check if there are very low values in the RMSD vector
         check_low_values = np.isclose(
             self.data[:, 2],
@@ -162,6 +206,13 @@ class RMSD:
             ).any()
         if check_low_values:
             log.warning(f"core {self.core}: low values of RMSD detected.")
+        if self.matrix_file is not None:
+            # each core writes its own slice of the condensed matrix
+            matrix = np.load(self.matrix_file, mmap_mode="r+")
+            matrix[self.offset:self.offset + self.npairs] = self.data[:, 2]
+            matrix.flush()
+            return
+        output_fname = Path(self.path, self.output_name)
         with open(output_fname, "w") as out_fh:
             for data in list(self.data):
                 data_str = f"{data[0]:.0f} {data[1]:.0f} {data[2]:.3f}"
@@ -169,6 +220,312 @@ class RMSD:
                 out_fh.write(data_str)
 
 
+def block_rmsd(ref_xyz, ref_mask, mod_xyz, mod_mask):
+    """
+    Calculate the RMSD of a reference against several models.
+
+    Parameters
+    ----------
+    ref_xyz : np.ndarray
+        The coordinates of the reference, shape (n_atoms, 3).
+
+    ref_mask : np.ndarray
+        The atoms of the reference, shape (n_atoms,).
+
+    mod_xyz : np.ndarray
+        The coordinates of the models, shape (n_models, n_atoms, 3).
+
+    mod_mask : np.ndarray
+        The atoms of the models, shape (n_models, n_atoms).
+
+    Returns
+    -------
+    rmsds : np.ndarray
+        The RMSD of each model.
+    """
+    same = (mod_mask == ref_mask).all(axis=1)
+    rmsds = np.zeros(len(mod_xyz))
+    if same.any():
+        # models sharing the atoms of the reference are stacked
+        rmsds[same] = batch_rmsd(
+            mod_xyz[same][:, ref_mask],
+            ref_xyz[ref_mask],
+            )
+    for i in np.flatnonzero(~same):
+        common = ref_mask & mod_mask[i]
+        rmsds[i] = batch_rmsd(mod_xyz[i, common], ref_xyz[common])
+    return rmsds
+
+
+def create_matrix(output_fname, npairs):
+    """
+    Create the binary condensed RMSD matrix.
+
+    The matrix is a ``.npy`` file, so its header records the type and the
+    number of pairs, and it can be memory-mapped. Values are initialised
+    to NaN, to detect pairs that were not calculated.
+
+    Parameters
+    ----------
+    output_fname : str or pathlib.Path
+        The name of the matrix file.
+
+    npairs : int
+        The number of pairs of models.
+
+    Returns
+    -------
+    matrix : np.memmap
+        The matrix, opened for writing.
+    """
+    matrix = np.lib.format.open_memmap(
+        output_fname,
+        mode="w+",
+        dtype=RMSD_MATRIX_DTYPE,
+        shape=(npairs,),
+        )
+    matrix[:] = np.nan
+    matrix.flush()
+    return matrix
+
+
+def write_matrix_text(matrix, nmodels, output_fname, chunk_size=1000000):
+    """
+    Write a condensed RMSD matrix in text form.
+
+    Each line holds the indices of the two models, starting at 1, and
+    their RMSD.
+
+    Parameters
+    ----------
+    matrix : np.ndarray
+        The condensed RMSD matrix.
+
+    nmodels : int
+        The number of models.
+
+    output_fname : str or pathlib.Path
+        The name of the text file.
+
+    chunk_size : int
+        The maximum number of lines formatted at once, unless a single row
+        of the matrix is longer.
+    """
+    start = 0
+    ref = 0
+    with open(output_fname, "w") as out_fh:
+        while ref < nmodels - 1:
+            # whole rows of the matrix are written at once
+            refs, mods = [], []
+            npairs = 0
+            while ref < nmodels - 1 and (
+                    npairs == 0
+                    or npairs + nmodels - ref - 1 <= chunk_size):
+                mods.append(np.arange(ref + 1, nmodels))
+                refs.append(np.full(nmodels - ref - 1, ref))
+                npairs += nmodels - ref - 1
+                ref += 1
+            np.savetxt(
+                out_fh,
+                np.column_stack((
+                    np.concatenate(refs) + 1,
+                    np.concatenate(mods) + 1,
+                    matrix[start:start + npairs],
+                    )),
+                fmt="%d %d %.3f",
+                newline=os.linesep,
+                )
+            start += npairs
+
+
+def load_model_coords(model_list, filter_resdic=None):
+    """
+    Load the coordinates of all the models once.
+
+    Parameters
+    ----------
+    model_list : list
+        List of models
+
+    filter_resdic : dict
+        dictionary of residues to be loaded (one list per chain)
+
+    Returns
+    -------
+    keys : list
+        The (chain, resnum, atom name) identifier of each atom.
+
+    xyz : np.ndarray
+        The coordinates, shape (n_models, n_atoms, 3).
+
+    mask : np.ndarray
+        Whether each model has each atom, shape (n_models, n_atoms).
+    """
+    atoms = {}
+    for m in model_list:
+        atoms.update(get_atoms(m))
+    return load_coords_stack(model_list, atoms, filter_resdic)
+
+
+def selection_hash(keys, filter_resdic=None):
+    """
+    Get the hash of the atoms used in the RMSD calculation.
+
+    Parameters
+    ----------
+    keys : list
+        The (chain, resnum, atom name) identifier of each atom.
+
+    filter_resdic : dict
+        dictionary of residues to be loaded (one list per chain)
+
+    Returns
+    -------
+    str
+        The MD5 hexadecimal digest.
+    """
+    selection = json.dumps(
+        [list(keys), sorted((filter_resdic or {}).items())],
+        default=str,
+        )
+    return hashlib.md5(selection.encode()).hexdigest()
+
+
+def coords_hash(xyz, mask):
+    """
+    Get the hash of the coordinates of a model.
+
+    Parameters
+    ----------
+    xyz : np.ndarray
+        The coordinates of the model, shape (n_atoms, 3).
+
+    mask : np.ndarray
+        The atoms of the model, shape (n_atoms,).
+
+    Returns
+    -------
+    str
+        The MD5 hexadecimal digest.
+    """
+    md5 = hashlib.md5(np.ascontiguousarray(xyz, dtype=np.float32).tobytes())
+    md5.update(np.ascontiguousarray(mask, dtype=bool).tobytes())
+    return md5.hexdigest()
+
+
+def save_matrix_models(output_fname, selection, hashes):
+    """
+    Save the atom selection and the models of a matrix.
+
+    Parameters
+    ----------
+    output_fname : str or pathlib.Path
+        The name of the file.
+
+    selection : str
+        The hash of the atom selection, see :py:func:`selection_hash`.
+
+    hashes : list
+        The hash of each model, see :py:func:`coords_hash`.
+    """
+    with open(output_fname, "w") as fout:
+        json.dump({"selection": selection, "models": hashes}, fout)
+
+
+def find_matrix(folders, selection, hashes):
+    """
+    Find the existing matrix sharing the most models.
+
+    Only the matrices with the same atom selection, and at least two models
+    in common, are considered.
+
+    Parameters
+    ----------
+    folders : list of pathlib.Path
+        The folders where to look for ``rmsd.npy`` and its
+        :py:data:`MATRIX_MODELS_FILE`.
+
+    selection : str
+        The hash of the atom selection.
+
+    hashes : list
+        The hash of each model.
+
+    Returns
+    -------
+    tuple or None
+        The path to the matrix and the hashes of its models.
+    """
+    found = None
+    shared_max = 1
+    hashes = set(hashes)
+    for folder in folders:
+        matrix_f = Path(folder, "rmsd.npy")
+        models_f = Path(folder, MATRIX_MODELS_FILE)
+        if not (matrix_f.exists() and models_f.exists()):
+            continue
+        try:
+            info = json.loads(models_f.read_text())
+        except (OSError, ValueError):
+            continue
+        if info.get("selection") != selection:
+            continue
+        shared = len(hashes.intersection(info["models"]))
+        if shared > shared_max:
+            found = (matrix_f, info["models"])
+            shared_max = shared
+    return found
+
+
+def cond_offset(i, j, nmodels):
+    """Get the index of the pair (i, j), with i < j, in the condensed matrix."""
+    return nmodels * i - i * (i + 1) // 2 + j - i - 1
+
+
+def fill_from_matrix(matrix, hashes, old_matrix, old_hashes):
+    """
+    Copy the RMSD values of the models shared with another matrix.
+
+    Parameters
+    ----------
+    matrix : np.ndarray
+        The condensed matrix to fill.
+
+    hashes : list
+        The hash of each model of `matrix`.
+
+    old_matrix : np.ndarray
+        The condensed matrix to copy from.
+
+    old_hashes : list
+        The hash of each model of `old_matrix`.
+
+    Returns
+    -------
+    int
+        The number of values copied.
+    """
+    old_index = {}
+    for i, model_hash in enumerate(old_hashes):
+        old_index.setdefault(model_hash, i)
+    old_idx = np.array([old_index.get(h, -1) for h in hashes])
+    nmodels = len(hashes)
+    old_nmodels = len(old_hashes)
+    copied = 0
+    for ref in np.flatnonzero(old_idx >= 0):
+        mods = np.arange(ref + 1, nmodels)
+        mods = mods[(old_idx[mods] >= 0) & (old_idx[mods] != old_idx[ref])]
+        if not len(mods):
+            continue
+        old_ref = np.minimum(old_idx[ref], old_idx[mods])
+        old_mod = np.maximum(old_idx[ref], old_idx[mods])
+        matrix[cond_offset(ref, mods, nmodels)] = old_matrix[
+            cond_offset(old_ref, old_mod, old_nmodels)
+            ]
+        copied += len(mods)
+    return copied
+
+
 def get_pair(nmodels, idx):
     """Get the pair of structures given the 1D matrix index."""
     if (nmodels < 0 or idx < 0):
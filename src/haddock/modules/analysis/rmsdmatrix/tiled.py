@@ -0,0 +1,341 @@
+"""
+Tiled calculation of large RMSD matrices.
+
+The matrix is split in tiles, blocks of reference models against blocks of
+mobile models, whose coordinates fit in a memory budget. The coordinates of
+all the models are stored once in memory-mapped arrays, and each tile reads
+only its two blocks and writes its values straight into the memory-mapped
+condensed matrix.
+
+All the files of a calculation are kept in a checkpoint folder named after
+the hash of the model files and of the residue selection. Pairs not yet
+calculated are NaN in the matrix, so an interrupted calculation resumes from
+the tiles that were not completed, and values copied from an existing matrix
+are not calculated again.
+"""
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from haddock import log
+from haddock.libs.libalign import get_atoms, load_coords
+from haddock.libs.libutil import file_checksum
+from haddock.modules.analysis.rmsdmatrix.rmsd import (
+    MATRIX_MODELS_FILE,
+    RMSD_BLOCK_SIZE,
+    block_rmsd,
+    cond_offset,
+    coords_hash,
+    create_matrix,
+    save_matrix_models,
+    selection_hash,
+    )
+
+
+TILES_DIR = "rmsd_tiles"
+"""The folder of the tiled calculations, in the run directory."""
+
+
+def get_tiles_root():
+    """
+    Get the folder holding the tiled calculations.
+
+    Modules run in their step folder, so the folder is created in the run
+    directory, where it survives the step folder being removed on restart.
+    Outside a run directory the current folder is used.
+
+    Returns
+    -------
+    pathlib.Path
+    """
+    run_dir = Path.cwd().parent
+    if Path(run_dir, "data").is_dir():
+        return Path(run_dir, TILES_DIR)
+    return Path(TILES_DIR)
+
+
+def store_model_coords(model_list, path, filter_resdic=None):
+    """
+    Store the coordinates of all the models in memory-mapped arrays.
+
+    The models are read twice, once to find the atoms and once to store
+    their coordinates, so that only one model is in memory at a time. The
+    atom selection and the hash of each model are saved in
+    :py:data:`haddock.modules.analysis.rmsdmatrix.rmsd.MATRIX_MODELS_FILE`.
+
+    Parameters
+    ----------
+    model_list : list
+        List of models
+
+    path : pathlib.Path
+        The folder where ``coords.npy`` and ``mask.npy`` are written.
+
+    filter_resdic : dict
+        dictionary of residues to be loaded (one list per chain)
+    """
+    atoms = {}
+    for m in model_list:
+        atoms.update(get_atoms(m))
+    keys = {}
+    for m in model_list:
+        coord_dic, _ = load_coords(m, atoms, filter_resdic)
+        keys.update(dict.fromkeys(coord_dic))
+    index = {key: i for i, key in enumerate(keys)}
+
+    xyz = open_memmap(
+        Path(path, "coords.npy"),
+        mode="w+",
+        dtype=np.float32,
+        shape=(len(model_list), len(keys), 3),
+        )
+    mask = open_memmap(
+        Path(path, "mask.npy"),
+        mode="w+",
+        dtype=bool,
+        shape=(len(model_list), len(keys)),
+        )
+    hashes = []
+    for n, m in enumerate(model_list):
+        coord_dic, _ = load_coords(m, atoms, filter_resdic)
+        idx = [index[key] for key in coord_dic]
+        if idx:
+            xyz[n, idx] = list(coord_dic.values())
+            mask[n, idx] = True
+        hashes.append(coords_hash(xyz[n], mask[n]))
+    xyz.flush()
+    mask.flush()
+
+    selection = selection_hash(keys, filter_resdic)
+    save_matrix_models(Path(path, MATRIX_MODELS_FILE), selection, hashes)
+
+
+def tiles_key(model_list, filter_resdic=None):
+    """
+    Identify a tiled calculation without parsing the models.
+
+    Parameters
+    ----------
+    model_list : list
+        List of models
+
+    filter_resdic : dict
+        dictionary of residues to be loaded (one list per chain)
+
+    Returns
+    -------
+    str
+        The MD5 hash of the content of the model files, in order, and of
+        the residue selection.
+    """
+    content = json.dumps(
+        [
+            [file_checksum(getattr(m, "rel_path", m)) for m in model_list],
+            sorted((filter_resdic or {}).items()),
+            ],
+        default=str,
+        )
+    return hashlib.md5(content.encode()).hexdigest()
+
+
+def prepare_tiles(model_list, root, filter_resdic=None):
+    """
+    Prepare the checkpoint folder of a tiled calculation.
+
+    If a folder with the same model files and residue selection exists, it
+    is reused, and the calculation resumes without parsing the models.
+
+    Parameters
+    ----------
+    model_list : list
+        List of models
+
+    root : pathlib.Path
+        The folder holding the tiled calculations.
+
+    filter_resdic : dict
+        dictionary of residues to be loaded (one list per chain)
+
+    Returns
+    -------
+    pathlib.Path
+        The checkpoint folder, with the coordinates and the matrix.
+    """
+    path = Path(root, tiles_key(model_list, filter_resdic))
+    if Path(path, "rmsd.npy").exists():
+        log.info(f"Resuming the RMSD matrix calculation in {path}")
+        return path
+
+    tmp_path = Path(root, f"tmp_{os.getpid()}")
+    tmp_path.mkdir(parents=True, exist_ok=True)
+    store_model_coords(model_list, tmp_path, filter_resdic)
+    shutil.rmtree(path, ignore_errors=True)
+    nmodels = len(model_list)
+    create_matrix(Path(tmp_path, "rmsd.npy"), nmodels * (nmodels - 1) // 2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def get_tile_size(natoms, memory, ncores):
+    """
+    Get the number of models per block of a tile.
+
+    Parameters
+    ----------
+    natoms : int
+        The number of atoms per model.
+
+    memory : float
+        The memory budget, in MB, shared by all the cores.
+
+    ncores : int
+        The number of cores.
+
+    Returns
+    -------
+    int
+    """
+    # two blocks of double precision coordinates, and as much again for
+    #  the superposition
+    model_bytes = 4 * max(natoms, 1) * 3 * 8
+    return max(int(memory * 2**20 / ncores / model_bytes), 1)
+
+
+def get_tiles(nmodels, tile_size):
+    """
+    Split the upper triangle of the matrix in tiles.
+
+    Parameters
+    ----------
+    nmodels : int
+        The number of models.
+
+    tile_size : int
+        The number of models per block.
+
+    Returns
+    -------
+    list of tuple
+        The (start, end) rows and (start, end) columns of each tile.
+    """
+    bounds = [
+        (start, min(start + tile_size, nmodels))
+        for start in range(0, nmodels, tile_size)
+        ]
+    return [
+        (rows, cols)
+        for i, rows in enumerate(bounds)
+        for cols in bounds[i:]
+        if cols[1] > rows[0] + 1
+        ]
+
+
+class RMSDTile:
+    """The RMSD calculation of a tile of the matrix."""
+
+    def __init__(self, path, nmodels, rows, cols):
+        """
+        Initialise the tile.
+
+        Parameters
+        ----------
+        path : pathlib.Path
+            The checkpoint folder, as given by :py:func:`prepare_tiles`.
+
+        nmodels : int
+            The number of models.
+
+        rows : tuple
+            The (start, end) indices of the reference models.
+
+        cols : tuple
+            The (start, end) indices of the mobile models.
+        """
+        self.path = path
+        self.nmodels = nmodels
+        self.rows = rows
+        self.cols = cols
+        self.output = Path(path, "rmsd.npy")
+
+    def segments(self):
+        """
+        Get the pairs of the tile.
+
+        Returns
+        -------
+        list of tuple
+            For each reference model, its index, the range of mobile models
+            and the offset of the first pair in the condensed matrix.
+        """
+        segments = []
+        for ref in range(*self.rows):
+            start = max(self.cols[0], ref + 1)
+            if start < self.cols[1]:
+                offset = cond_offset(ref, start, self.nmodels)
+                segments.append((ref, start, self.cols[1], offset))
+        return segments
+
+    def is_complete(self, matrix):
+        """Whether all the pairs of the tile are calculated."""
+        return not any(
+            np.isnan(matrix[offset:offset + end - start]).any()
+            for _, start, end, offset in self.segments()
+            )
+
+    def run(self):
+        """Calculate the RMSD of the pairs of the tile."""
+        matrix = np.load(self.output, mmap_mode="r+")
+        if self.is_complete(matrix):
+            log.debug(f"tile {self.rows} x {self.cols} already calculated")
+            return
+        xyz = np.load(Path(self.path, "coords.npy"), mmap_mode="r")
+        mask = np.load(Path(self.path, "mask.npy"), mmap_mode="r")
+        row_xyz = np.asarray(xyz[slice(*self.rows)])
+        row_mask = np.asarray(mask[slice(*self.rows)])
+        col_xyz = np.asarray(xyz[slice(*self.cols)])
+        col_mask = np.asarray(mask[slice(*self.cols)])
+        for ref, start, end, offset in self.segments():
+            r = ref - self.rows[0]
+            values = np.array(matrix[offset:offset + end - start])
+            # only the pairs not yet in the matrix are calculated
+            todo = np.flatnonzero(np.isnan(values))
+            for block in range(0, len(todo), RMSD_BLOCK_SIZE):
+                idx = todo[block:block + RMSD_BLOCK_SIZE]
+                mods = idx + start - self.cols[0]
+                values[idx] = block_rmsd(
+                    row_xyz[r],
+                    row_mask[r],
+                    col_xyz[mods],
+                    col_mask[mods],
+                    )
+            if len(todo):
+                matrix[offset:offset + end - start] = values
+        # the tile is saved as a whole
+        matrix.flush()
+
+
+def count_missing(matrix, chunk_size=10000000):
+    """
+    Count the pairs of a condensed matrix not yet calculated.
+
+    Parameters
+    ----------
+    matrix : np.ndarray
+        The condensed matrix, usually memory-mapped.
+
+    chunk_size : int
+        The number of values read at once.
+
+    Returns
+    -------
+    int
+    """
+    return sum(
+        int(np.isnan(matrix[start:start + chunk_size]).sum())
+        for start in range(0, len(matrix), chunk_size)
+        )
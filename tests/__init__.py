@@ -1,6 +1,9 @@
 """Define common test variables."""
+import shutil
 from pathlib import Path
 
+from haddock.libs.libio import working_directory
+from haddock.libs.libontology import ModuleIO, PDBFile
 from haddock.modules import modules_category
 
 
@@ -26,3 +29,32 @@ steptmp = Path(data_folder, "0_dummystep")
 
 # defines which modules are already working
 working_modules = [t for t in modules_category.items() if t[0] != 'topocg']
+
+
+def make_run(run_dir, pdbs, steps):
+    """Run the steps on copies of the PDB files in a new run directory."""
+    Path(run_dir, "data").mkdir()
+    models_path = Path(run_dir, "0_emscoring")
+    models_path.mkdir()
+    models = []
+    for i, name in enumerate(pdbs, start=1):
+        shutil.copy(Path(golden_data, name), Path(models_path, f"m{i}.pdb"))
+        models.append(PDBFile(f"m{i}.pdb", path=models_path, score=i))
+    with working_directory(models_path):
+        io = ModuleIO()
+        io.add(models, "o")
+        io.save()
+
+    for order, (module, params, step_params) in enumerate(steps, start=1):
+        step = Path(run_dir, f"{order}_{module.name}")
+        step.mkdir()
+        with working_directory(run_dir):
+            step_module = module(
+                order=order,
+                path=step,
+                initial_params=params,
+                )
+        step_module.update_params(**step_params)
+        step_module.save_config(Path(step, "params.cfg"))
+        with working_directory(step):
+            step_module.run()
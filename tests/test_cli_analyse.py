@@ -1,6 +1,7 @@
 """Test haddock3-analyse client."""
 import os
 import shutil
+import tempfile
 from pathlib import Path
 
 import pytest
@@ -8,13 +9,20 @@ import pytest
 from haddock.clis.cli_analyse import (
     get_cluster_ranking,
     main,
+    read_capri_table,
+    run_capri_analysis,
     update_capri_dict,
     )
 from haddock.gear.yaml2cfg import read_from_yaml_config
+from haddock.libs.libio import working_directory
+from haddock.libs.libontology import PDBFile
+from haddock.libs.libregistry import get_run_registry
 from haddock.modules.analysis.caprieval import \
     DEFAULT_CONFIG as caprieval_params
+from haddock.modules.analysis.caprieval import HaddockModule as CapriModule
+from haddock.modules.analysis.caprieval.capri import capri_cache_keys
 
-from . import golden_data
+from . import golden_data, make_run
 
 
 @pytest.fixture
@@ -55,14 +63,34 @@ def test_get_cluster_ranking(example_capri_clt):
                       4: 4,
                       5: 5}
     assert exp_cl_ranking == obs_cl_ranking
+    capri_df = read_capri_table(example_capri_clt)
+    assert get_cluster_ranking(capri_df, 5) == exp_cl_ranking
 
 
 def test_main(example_capri_ss, example_capri_clt):
     """Test cli_analyse main."""
-    # build fake run_dir
-    run_dir = "example_dir"
-    if os.path.isdir(run_dir):
-        shutil.rmtree(run_dir)
+    with tempfile.TemporaryDirectory(dir=".") as tmpdir:
+        # build fake run_dir
+        run_dir = Path(tmpdir, "example_dir")
+        step_name = "2_caprieval"
+        step_dir = Path(run_dir, step_name)
+        step_dir.mkdir(parents=True)
+        shutil.copy(example_capri_ss, Path(step_dir, "capri_ss.tsv"))
+        shutil.copy(example_capri_clt, Path(step_dir, "capri_clt.tsv"))
+
+        # run haddock3-analyse
+        main(run_dir, [2], 5, format=None, scale=None)
+
+        # check analysis directory exists
+        ana_dir = Path(run_dir, "analysis/")
+        assert os.path.isdir(ana_dir) is True
+
+        # check whether there are some html files
+        ana_subdir = Path(ana_dir, f"{step_name}_analysis")
+        html_files = [
+            el for el in os.listdir(ana_subdir) if el.endswith(".html")
+            ]
+        assert len(html_files) > 0
     step_name = "2_caprieval"
     step_dir = Path(run_dir, step_name)
     os.mkdir(run_dir)
@@ -83,3 +111,55 @@ def test_main(example_capri_ss, example_capri_clt):
     assert len(html_files) > 0
 
     shutil.rmtree(run_dir)
+
+
+def test_main_failed_steps():
+    """Test the steps that cannot be analysed are cancelled."""
+    with tempfile.TemporaryDirectory(dir=".") as tmpdir:
+        run_dir = Path(tmpdir, "run1")
+        for step in ("1_rigidbody", "2_flexref"):
+            Path(run_dir, step).mkdir(parents=True)
+
+        ori_cwd = os.getcwd()
+        main(run_dir, [1, 2], 5, format=None, scale=None, ncores=2)
+
+        assert os.getcwd() == ori_cwd
+        assert Path(run_dir, "analysis").is_dir()
+        assert os.listdir(Path(run_dir, "analysis")) == []
+        assert not Path(run_dir, "1_rigidbody_analysis").exists()
+        assert not Path(run_dir, "2_flexref_analysis").exists()
+
+
+def test_run_capri_analysis_cache(default_capri):
+    """Test the models evaluated by a caprieval step are not evaluated."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        make_run(
+            tmpdir,
+            ["protprot_complex_1.pdb", "protprot_complex_2.pdb"],
+            [(CapriModule, caprieval_params, {})],
+            )
+        registry = get_run_registry(tmpdir)
+        models = [
+            PDBFile(Path(tmpdir, "0_emscoring", f"m{i}.pdb")) for i in (1, 2)
+            ]
+        key = capri_cache_keys(
+            models,
+            [models[0].rel_path],
+            default_capri,
+            )[1][0]
+        metrics = registry.get_capri_cache([key])[key]
+        registry.store_capri_cache({key: dict(metrics, irmsd=42.0)})
+
+        target_path = Path(tmpdir, "0_emscoring_analysis")
+        target_path.mkdir()
+        with working_directory(target_path):
+            run_capri_analysis("0_emscoring", Path("./"), default_capri)
+
+        capri_df = read_capri_table(Path(target_path, "capri_ss.tsv"))
+        capri_df["model"] = capri_df["model"].map(os.path.basename)
+        irmsd = capri_df.set_index("model")["irmsd"]
+        assert irmsd["m2.pdb"] == 42.0
+        assert irmsd["m1.pdb"] == 0.0
+        # the analysis is not registered as a step of the run
+        assert registry.steps() == [(1, "caprieval")]
+        assert 42.0 not in [row["irmsd"] for row in registry.query(step=1)]
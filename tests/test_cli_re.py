@@ -0,0 +1,132 @@
+"""Test haddock3-re client."""
+import os
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from haddock.clis import cli_re
+from haddock.libs.libontology import ModuleIO
+from haddock.modules.analysis.clustfcc import DEFAULT_CONFIG as fcc_pars
+from haddock.modules.analysis.clustfcc import HaddockModule as ClustFCC
+from haddock.modules.analysis.clustrmsd import DEFAULT_CONFIG as clust_pars
+from haddock.modules.analysis.clustrmsd import HaddockModule as ClustRMSD
+from haddock.modules.analysis.rmsdmatrix import DEFAULT_CONFIG as rmsd_pars
+from haddock.modules.analysis.rmsdmatrix import HaddockModule as RMSDMatrix
+
+from . import golden_data, make_run
+
+
+@pytest.fixture
+def clustrmsd_run():
+    """Provide a run with a rmsdmatrix and a clustrmsd step."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        make_run(
+            tmpdir,
+            ["protdna_complex_1.pdb", "protdna_complex_2.pdb"] * 2,
+            [
+                (RMSDMatrix, rmsd_pars, {}),
+                (ClustRMSD, clust_pars, {"threshold": 1}),
+                ],
+            )
+        yield Path(tmpdir, "2_clustrmsd")
+
+
+@pytest.fixture
+def clustfcc_run():
+    """Provide a run with a clustfcc step."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        make_run(
+            tmpdir,
+            ["protprot_complex_1.pdb", "protprot_complex_2.pdb"] * 2
+            + ["protprot_complex_1.pdb"],
+            [(ClustFCC, fcc_pars, {})],
+            )
+        yield Path(tmpdir, "1_clustfcc")
+
+
+def test_reclustrmsd(clustrmsd_run):
+    """Test a clustrmsd step is cut again."""
+    out = Path(clustrmsd_run, "cluster.out").read_text()
+    assert out == f"Cluster 1 -> 1 3{os.linesep}Cluster 2 -> 2 4{os.linesep}"
+    linkage_f = Path(
+        clustrmsd_run.parent, "1_rmsdmatrix", "linkage_average.npz")
+    assert linkage_f.exists()
+    linkage_mtime = linkage_f.stat().st_mtime_ns
+    params_cfg = Path(clustrmsd_run, "params.cfg").read_text()
+
+    cli_re.main(
+        "clustrmsd",
+        clustrmsd_run,
+        criterion="maxclust",
+        tolerance=1,
+        threshold=None,
+        )
+
+    assert linkage_f.stat().st_mtime_ns == linkage_mtime
+    out = Path(clustrmsd_run, "cluster.out").read_text()
+    assert out == f"Cluster 1 -> 1 2 3 4{os.linesep}"
+    io = ModuleIO()
+    io.load(Path(clustrmsd_run, "io.json"))
+    assert [m.clt_id for m in io.output] == [1, 1, 1, 1]
+    assert [m.clt_model_rank for m in io.output] == [1, 2, 3, 4]
+    assert Path(clustrmsd_run, "params.cfg").read_text() == params_cfg
+    params = Path(clustrmsd_run, cli_re.RE_PARAMS).read_text()
+    assert "criterion = \"maxclust\"" in params
+
+
+def test_reclustrmsd_criterion(clustrmsd_run):
+    """Test the tolerance calculated for a new criterion is saved."""
+    cli_re.main("clustrmsd", clustrmsd_run, criterion="maxclust")
+    params = Path(clustrmsd_run, cli_re.RE_PARAMS).read_text()
+    assert "nan" not in params
+    assert "tolerance = 2.0" in params
+
+    # the parameters applied before are kept
+    cli_re.main("clustrmsd", clustrmsd_run, threshold=2)
+    params = Path(clustrmsd_run, cli_re.RE_PARAMS).read_text()
+    assert "criterion = \"maxclust\"" in params
+    assert "threshold = 2" in params
+
+
+def test_recluster_first_step(clustrmsd_run):
+    """Test the first step of a run is not clustered again."""
+    first_step = Path(clustrmsd_run.parent, "0_emscoring")
+    with pytest.raises(ValueError, match="first step"):
+        cli_re.main("clustrmsd", first_step)
+
+
+def test_reclustfcc(clustfcc_run):
+    """Test the clusters of a clustfcc step are taken for a new threshold."""
+    # no cluster of 4 models, the threshold was lowered to 3
+    out = Path(clustfcc_run, "cluster.out").read_text()
+    assert out == f"Cluster 1 -> 5 1 3 {os.linesep}"
+
+    cli_re.main("clustfcc", clustfcc_run, threshold=2)
+
+    out = Path(clustfcc_run, "cluster.out").read_text()
+    assert out == (
+        f"Cluster 1 -> 5 1 3 {os.linesep}"
+        f"Cluster 2 -> 4 2 {os.linesep}"
+        )
+    io = ModuleIO()
+    io.load(Path(clustfcc_run, "io.json"))
+    assert [m.clt_id for m in io.output] == [1, 1, 1, 2, 2]
+    assert [m.clt_rank for m in io.output] == [1, 1, 1, 2, 2]
+    params = Path(clustfcc_run, cli_re.RE_PARAMS).read_text()
+    assert "threshold = 2" in params
+
+
+def test_cli_args():
+    """Test the command line arguments."""
+    cmd = cli_re.ap.parse_args(
+        ["clustrmsd", str(golden_data), "-c", "distance", "-t", "2.5"])
+    assert cmd.command == "clustrmsd"
+    assert cmd.criterion == "distance"
+    assert cmd.tolerance == 2.5
+    assert cmd.threshold is None
+
+    cmd = cli_re.ap.parse_args(
+        ["clustfcc", str(golden_data), "--threshold", "2"])
+    assert cmd.command == "clustfcc"
+    assert cmd.threshold == 2
@@ -214,6 +214,15 @@ def test_load(config_example, expected):
     assert r == expected
 
 
+def test_load_list_of_files():
+    """Test lists of files are read as lists of paths."""
+    r = config.loads("[caprieval]\nreference_fname = ['ref1.pdb', 'ref2.pdb']")
+    assert r["caprieval.1"]["reference_fname"] == [
+        Path("ref1.pdb"),
+        Path("ref2.pdb"),
+        ]
+
+
 def test_load_nan_vlaue():
     """Test read config."""
     r = config.loads("param=nan")
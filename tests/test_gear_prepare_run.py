@@ -1,5 +1,6 @@
 """Test prepare run module."""
 import shutil
+import tempfile
 from math import isnan
 from pathlib import Path
 
@@ -7,6 +8,7 @@ import pytest
 
 from haddock.gear.prepare_run import (
     check_if_path_exists,
+    copy_input_files_to_data_dir,
     copy_molecules_to_topology,
     fuzzy_match,
     get_expandable_parameters,
@@ -17,6 +19,7 @@ from haddock.gear.prepare_run import (
     validate_parameters_are_not_misspelled,
     )
 from haddock.gear.yaml2cfg import read_from_yaml_config
+from haddock.gear.zerofill import zero_fill
 from haddock.modules import modules_names
 from haddock.modules.topology.topoaa import DEFAULT_CONFIG
 
@@ -185,6 +188,67 @@ def test_copy_mols_to_topo_dir(molecules, expected):
     assert all(isinstance(m, Path) for m in d["molecules"])
 
 
+def test_copy_input_files_to_data_dir():
+    """Test single files and lists of files are copied to data/."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name in ("ref1.pdb", "ref2.pdb"):
+            Path(tmpdir, name).write_text("ATOM")
+        data_dir = Path(tmpdir, "run", "data")
+        data_dir.mkdir(parents=True)
+        modules_params = {
+            "caprieval.1": {"reference_fname": Path(tmpdir, "ref1.pdb")},
+            "caprieval.2": {
+                "reference_fname": [
+                    Path(tmpdir, "ref1.pdb"),
+                    Path(tmpdir, "ref2.pdb"),
+                    ],
+                },
+            "caprieval.3": {"reference_fname": ""},
+            }
+        zero_fill.read(modules_params)
+        copy_input_files_to_data_dir(data_dir, modules_params)
+
+        assert modules_params == {
+            "caprieval.1": {
+                "reference_fname": Path("data", "0_caprieval", "ref1.pdb"),
+                },
+            "caprieval.2": {
+                "reference_fname": [
+                    Path("data", "1_caprieval", "ref1_ref1.pdb"),
+                    Path("data", "1_caprieval", "ref2_ref2.pdb"),
+                    ],
+                },
+            "caprieval.3": {"reference_fname": ""},
+            }
+        assert Path(data_dir, "1_caprieval", "ref2_ref2.pdb").exists()
+        assert not Path(data_dir, "2_caprieval").exists()
+
+
+def test_copy_input_files_same_name():
+    """Test files of a list with the same name are all kept."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        references = []
+        for folder in ("a", "b"):
+            Path(tmpdir, folder).mkdir()
+            references.append(Path(tmpdir, folder, "target.pdb"))
+            references[-1].write_text(f"REMARK {folder}")
+        data_dir = Path(tmpdir, "run", "data")
+        data_dir.mkdir(parents=True)
+        modules_params = {"caprieval": {"reference_fname": references}}
+        zero_fill.read(modules_params)
+        copy_input_files_to_data_dir(data_dir, modules_params)
+
+        copies = modules_params["caprieval"]["reference_fname"]
+        assert copies == [
+            Path("data", "0_caprieval", "ref1_target.pdb"),
+            Path("data", "0_caprieval", "ref2_target.pdb"),
+            ]
+        assert [Path(data_dir.parent, c).read_text() for c in copies] == [
+            "REMARK a",
+            "REMARK b",
+            ]
+
+
 def test_validate_step_names_are_not_misspelled():
     params = {
         "par1": None,
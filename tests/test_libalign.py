@@ -8,15 +8,22 @@ import pytest
 
 from haddock.libs.libalign import (
     align_seq,
+    align_strct,
+    batch_kabsch,
+    batch_rmsd,
     calc_rmsd,
     centroid,
     dump_as_izone,
     get_align,
     get_atoms,
+    identity_numbering,
     kabsch,
     load_coords,
+    load_coords_stack,
     make_range,
+    numbering_key,
     pdb2fastadic,
+    structural_alignment,
     )
 
 from . import golden_data
@@ -98,6 +105,64 @@ def test_calc_rmsd():
     assert round(rmsd, 2) == 12.02
 
 
+@pytest.fixture
+def coords_stack():
+    """Provide a reference and a stack of rotated and perturbed models."""
+    rng = np.random.default_rng(42)
+    ref = rng.normal(scale=10, size=(50, 3))
+    models = []
+    for _ in range(8):
+        rot, _ = np.linalg.qr(rng.normal(size=(3, 3)))
+        noise = rng.normal(scale=0.5, size=ref.shape)
+        models.append((ref + noise) @ rot + rng.normal(size=3))
+    # a mirror image requires the reflection correction
+    models.append(-ref)
+    return ref, np.array(models)
+
+
+def pairwise_rmsd(P, Q):
+    """Superpose and calculate the RMSD with the single pair functions."""
+    P = P - centroid(P)
+    Q = Q - centroid(Q)
+    return calc_rmsd(np.dot(P, kabsch(P, Q)), Q)
+
+
+def test_batch_kabsch(coords_stack):
+    """Test the batched rotations match the single pair rotations."""
+    ref, models = coords_stack
+    Q = ref - ref.mean(axis=0)
+    P = models - models.mean(axis=1, keepdims=True)
+    observed = batch_kabsch(P, Q)
+    assert observed.shape == (len(models), 3, 3)
+    for P_i, U_i in zip(P, observed):
+        np.testing.assert_allclose(U_i, kabsch(P_i, Q), atol=1e-10)
+
+
+def test_batch_rmsd(coords_stack):
+    """Test the batched RMSD matches the single pair RMSD."""
+    ref, models = coords_stack
+    expected = [pairwise_rmsd(P, ref) for P in models]
+    np.testing.assert_allclose(batch_rmsd(models, ref), expected, atol=1e-8)
+
+    observed = batch_rmsd(models, ref, dtype=np.float32)
+    assert observed.dtype == np.float32
+    np.testing.assert_allclose(observed, expected, atol=1e-3)
+
+
+def test_batch_rmsd_identical(coords_stack):
+    """Test identical structures have null RMSD."""
+    ref, _ = coords_stack
+    assert batch_rmsd(ref, ref) == pytest.approx(0, abs=1e-6)
+
+
+def test_batch_rmsd_no_superposition(coords_stack):
+    """Test the RMSD without superposition matches calc_rmsd."""
+    ref, models = coords_stack
+    observed = batch_rmsd(models, ref, superpose=False)
+    expected = [calc_rmsd(P, ref) for P in models]
+    np.testing.assert_allclose(observed, expected)
+
+
 def test_centroid():
     """Test the centroid calculation."""
     X = [
@@ -193,6 +258,25 @@ def test_error_load_coords():
         load_coords(pdb_f, atoms, filter_resdic)
 
 
+def test_load_coords_stack():
+    """Test the loading of the coordinates of several models."""
+    ref = Path(golden_data, "protein.pdb")
+    mod = Path(golden_data, "protein_renumb.pdb")
+    atoms = get_atoms(ref)
+    keys, xyz, mask = load_coords_stack([ref, mod, ref], atoms)
+    ref_dic, _ = load_coords(ref, atoms)
+    mod_dic, _ = load_coords(mod, atoms)
+
+    assert keys[:len(ref_dic)] == list(ref_dic)
+    assert set(keys) == set(ref_dic) | set(mod_dic)
+    assert xyz.shape == (3, len(keys), 3)
+    assert mask[0].sum() == len(ref_dic)
+    assert mask[1].sum() == len(mod_dic)
+    assert np.array_equal(xyz[0], xyz[2])
+    assert np.allclose(xyz[0, mask[0]], list(ref_dic.values()), atol=1e-3)
+    assert not xyz[1, ~mask[1]].any()
+
+
 def test_get_atoms():
     """Test the identification of atoms."""
     pdb_list = [
@@ -371,9 +455,42 @@ def test_get_align():
     assert callable(align_func)
 
 
-# Need dependency to test this
-# def test_align_strct():
-#     pass
+def test_align_strct():
+    """Test the in-process structural alignment."""
+    ref = Path(golden_data, "protein.pdb")
+    mod = Path(golden_data, "protein_renumb.pdb")
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        observed_numb_dic = align_strct(ref, mod, tmpdirname)
+        expected_numb_dic = {"B": {101: 1, 102: 2, 110: 4, 112: 5}}
+        assert observed_numb_dic == expected_numb_dic
+        assert Path(tmpdirname, "structure.izone").exists()
+        aln = Path(tmpdirname, "structure.aln").read_text().split(os.linesep)
+        assert aln[1:4] == ["MFQQE", "|| ||", "MF-QE"]
+
+
+def test_align_strct_ligand():
+    """Test chains without trace are matched sequentially."""
+    ref = Path(golden_data, "protlig_complex_1.pdb")
+    mod = Path(golden_data, "protlig_complex_2.pdb")
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        observed_numb_dic = align_strct(ref, mod, tmpdirname)
+    assert observed_numb_dic["B"] == {500: 500}
+    assert len(observed_numb_dic["A"]) == len(pdb2fastadic(ref)["A"])
+
+
+def test_structural_alignment():
+    """Test a shifted and rotated trace is aligned back."""
+    rng = np.random.default_rng(1)
+    ref = np.cumsum(rng.normal(scale=2.2, size=(40, 3)), axis=0)
+    rot, _ = np.linalg.qr(rng.normal(size=(3, 3)))
+    # the model misses the first five residues
+    model = ref[5:] @ rot + 10.0
+    # a wrong initial correspondence is corrected
+    initial = [(i, i) for i in range(35)]
+    pairs = structural_alignment(ref, model, initial_pairs=initial)
+    assert pairs == [(i + 5, i) for i in range(35)]
 
 
 def test_align_seq():
@@ -428,3 +545,25 @@ def test_dump_as_izone():
             ]
 
         assert observed_izone == expected_izone
+
+
+def test_identity_numbering():
+    """Test residues of identical sequences are matched in order."""
+    ref = {"A": {1: "M", 2: "K"}, "B": {1: "G"}}
+    renumbered = {"A": {11: "M", 12: "K"}, "B": {1: "G"}}
+    assert identity_numbering(ref, renumbered) == {
+        "A": {11: 1, 12: 2},
+        "B": {1: 1},
+        }
+    assert identity_numbering(ref, {"A": {1: "M", 2: "R"}, "B": {1: "G"}}) is None  # noqa: E501
+    assert identity_numbering(ref, {"A": ref["A"]}) is None
+
+
+def test_numbering_key():
+    """Test numbering keys depend on method, sequences and numbering."""
+    ref = {"A": {1: "M", 2: "K"}}
+    key = numbering_key("sequence", ref, ref)
+    assert key == numbering_key("sequence", ref, {"A": {1: "M", 2: "K"}})
+    assert key != numbering_key("structure", ref, ref)
+    assert key != numbering_key("sequence", ref, {"A": {2: "M", 3: "K"}})
+    assert key != numbering_key("sequence", ref, ref, structure_id="abc")
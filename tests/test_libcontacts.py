@@ -0,0 +1,77 @@
+"""Test the contact detection library."""
+import numpy as np
+import pytest
+from scipy.spatial.distance import cdist
+
+from haddock.libs.libcontacts import (
+    CONTACT_DTYPE,
+    atom_contacts,
+    contact_codes,
+    decode_contacts,
+    residue_contacts,
+    )
+
+
+@pytest.fixture
+def atoms():
+    """Provide random atoms in three chains."""
+    rng = np.random.default_rng(0)
+    chains = np.repeat(["A", "B", "C"], [60, 40, 30])
+    resnums = np.concatenate([
+        np.repeat(np.arange(1, 16), 4),
+        np.repeat(np.arange(1, 11), 4),
+        np.repeat(np.arange(1, 11), 3),
+        ])
+    xyz = rng.uniform(0, 20, size=(len(chains), 3))
+    return chains, resnums, xyz
+
+
+def test_atom_contacts(atoms):
+    """Test atom contacts match the brute-force distances."""
+    _, _, xyz = atoms
+    i, j = atom_contacts(xyz[:60], xyz[60:], 4.0)
+    expected = np.argwhere(cdist(xyz[:60], xyz[60:]) < 4.0)
+    assert sorted(zip(i, j)) == sorted(map(tuple, expected))
+
+
+def test_atom_contacts_empty():
+    """Test empty sets have no contacts."""
+    i, j = atom_contacts(np.empty((0, 3)), np.zeros((2, 3)), 5.0)
+    assert len(i) == len(j) == 0
+
+
+def test_residue_contacts(atoms):
+    """Test residue contacts match the brute-force distances."""
+    chains, resnums, xyz = atoms
+    observed = residue_contacts(chains, resnums, xyz, 4.0)
+    assert observed.dtype == CONTACT_DTYPE
+
+    expected = set()
+    dist = cdist(xyz, xyz)
+    for a, b in np.argwhere(dist < 4.0):
+        if chains[a] < chains[b]:
+            expected.add((chains[a], resnums[a], chains[b], resnums[b]))
+    assert set(observed.tolist()) == expected
+    assert len(observed) == len(expected)
+
+
+def test_residue_contacts_single_chain(atoms):
+    """Test a single chain has no contacts."""
+    _, resnums, xyz = atoms
+    observed = residue_contacts(np.repeat("A", len(xyz)), resnums, xyz, 5.0)
+    assert len(observed) == 0
+
+
+def test_contact_codes(atoms):
+    """Test contacts are encoded as unique integers and decoded back."""
+    chains, resnums, xyz = atoms
+    resnums = resnums - 5  # negative residue numbers
+    contacts = residue_contacts(chains, resnums, xyz, 4.0)
+    codes = contact_codes(contacts)
+    assert codes.dtype == np.int64
+    assert len(codes) == len(contacts)
+    assert (np.diff(codes) > 0).all()
+    assert sorted(decode_contacts(codes).tolist()) == sorted(contacts.tolist())
+
+    # the codes of a subset are a subset of the codes
+    assert np.isin(contact_codes(contacts[::2]), codes).all()
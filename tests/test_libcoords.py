@@ -0,0 +1,137 @@
+"""Test the run-wide coordinate store."""
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from haddock.libs.libalign import get_atoms, load_coords
+from haddock.libs.libcoords import (
+    CoordinateStore,
+    get_run_store,
+    load_atoms,
+    model_key,
+    )
+from haddock.libs.libio import working_directory
+from haddock.libs.libontology import PDBFile
+from haddock.libs.libpdb import parse_atoms
+
+from . import golden_data
+
+
+@pytest.fixture
+def run_dir():
+    """Provide a run directory with a step folder and two models."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        Path(tmpdir, "data").mkdir()
+        step = Path(tmpdir, "1_rigidbody")
+        step.mkdir()
+        for i in (1, 2):
+            shutil.copy(
+                Path(golden_data, f"protprot_complex_{i}.pdb"),
+                Path(step, f"rigidbody_{i}.pdb"),
+                )
+        yield Path(tmpdir)
+
+
+def test_parse_atoms():
+    """Test the parsing of ATOM and HETATM records."""
+    atoms, xyz = parse_atoms(Path(golden_data, "protlig_complex_1.pdb"))
+    assert len(atoms) == len(xyz)
+    assert xyz.shape[1] == 3
+    assert atoms["name"][0] == "N"
+    assert set(atoms["resname"]) >= {"G39", "ALA"}
+
+
+def test_model_key(run_dir):
+    """Test the key of a model."""
+    pdb = PDBFile("rigidbody_1.pdb", path=Path(run_dir, "1_rigidbody"))
+    with working_directory(Path(run_dir, "1_rigidbody")):
+        rundir, key = model_key(pdb)
+    assert rundir == run_dir.resolve()
+    assert key == "1_rigidbody/rigidbody_1.pdb"
+
+
+def test_add_models(run_dir):
+    """Test models are stored once and read back."""
+    store = CoordinateStore(Path(run_dir, "coordinates"))
+    models = sorted(Path(run_dir, "1_rigidbody").glob("*.pdb"))
+    store.add_models(models, ncores=2)
+    store.add_models(models)
+    assert len(store) == 2
+    assert len(list(store.topology_folder.glob("*.npy"))) == 1
+
+    atoms, xyz = parse_atoms(models[1])
+    stored_atoms, stored_xyz = store.get("1_rigidbody/rigidbody_2.pdb")
+    assert np.array_equal(stored_atoms, atoms)
+    assert stored_xyz.dtype == np.float32
+    assert np.allclose(stored_xyz, xyz, atol=1e-3)
+    assert store.get("1_rigidbody/other.pdb") is None
+
+
+def test_add_models_again(run_dir):
+    """Test a modified model is written over its previous coordinates."""
+    store = CoordinateStore(Path(run_dir, "coordinates"))
+    models = sorted(Path(run_dir, "1_rigidbody").glob("*.pdb"))
+    store.add_models(models)
+    size = store.coords_file.stat().st_size
+
+    # same atoms, other coordinates
+    shutil.copy(
+        Path(golden_data, "protprot_complex_2.pdb"),
+        models[0],
+        )
+    store.add_models(models)
+    assert store.coords_file.stat().st_size == size
+    _, xyz = parse_atoms(models[0])
+    _, stored_xyz = store.get("1_rigidbody/rigidbody_1.pdb")
+    assert np.allclose(stored_xyz, xyz, atol=1e-3)
+
+    # other atoms are appended
+    shutil.copy(Path(golden_data, "protlig_complex_1.pdb"), models[0])
+    store.add_models(models)
+    assert store.coords_file.stat().st_size > size
+    _, xyz = parse_atoms(models[0])
+    _, stored_xyz = store.get("1_rigidbody/rigidbody_1.pdb")
+    assert np.allclose(stored_xyz, xyz, atol=1e-3)
+    _, stored_xyz = store.get("1_rigidbody/rigidbody_2.pdb")
+    assert np.allclose(stored_xyz, parse_atoms(models[1])[1], atol=1e-3)
+
+
+def test_get_run_store(run_dir):
+    """Test the store is only available in run directories."""
+    assert get_run_store(Path(run_dir, "1_rigidbody"), create=True) is None
+    assert get_run_store(run_dir) is None
+    store = get_run_store(run_dir, create=True)
+    assert isinstance(store, CoordinateStore)
+    assert get_run_store(run_dir, create=True) is store
+
+
+def test_load_atoms(run_dir):
+    """Test models are read from the store unless modified."""
+    model = Path(run_dir, "1_rigidbody", "rigidbody_1.pdb")
+    get_run_store(run_dir, create=True).add_models([model])
+    _, xyz = load_atoms(model)
+    assert xyz.dtype == np.float32
+
+    shutil.copy(Path(golden_data, "protprot_complex_2.pdb"), model)
+    _, xyz = load_atoms(model)
+    assert xyz.dtype == np.float64
+    assert np.allclose(xyz, parse_atoms(model)[1])
+
+
+def test_load_coords_from_store(run_dir):
+    """Test coordinates loaded from the store match the PDB file."""
+    model = Path(run_dir, "1_rigidbody", "rigidbody_1.pdb")
+    atoms = get_atoms(model)
+    expected, expected_ranges = load_coords(model, atoms)
+    get_run_store(run_dir, create=True).add_models([model])
+    observed, observed_ranges = load_coords(model, atoms)
+    assert list(observed) == list(expected)
+    assert observed_ranges == expected_ranges
+    assert np.allclose(
+        np.array(list(observed.values())),
+        np.array(list(expected.values())),
+        atol=1e-3,
+        )
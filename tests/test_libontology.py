@@ -0,0 +1,68 @@
+"""Test libontology."""
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from haddock.libs.libio import working_directory
+from haddock.libs.libontology import ModuleIO, PDBFile
+from haddock.libs.libutil import file_checksum
+
+
+@pytest.fixture
+def step_folder():
+    """Provide a step folder with two present models and a missing one."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        step = Path(tmpdir, "1_rigidbody")
+        step.mkdir()
+        Path(step, "model_1.pdb").write_text("ATOM" + "\n")
+        Path(step, "model_2.pdb").write_text("")
+        models = [
+            PDBFile(f"model_{i}.pdb", path=step)
+            for i in (1, 2, 3)
+            ]
+        with working_directory(step):
+            yield models
+
+
+def test_check_faulty(step_folder):
+    """Test missing output is detected and removed."""
+    io = ModuleIO()
+    io.add(step_folder, "o")
+    faulty = io.check_faulty()
+    assert faulty == pytest.approx(100 / 3)
+    assert [m.file_name for m in io.output] == ["model_1.pdb", "model_2.pdb"]
+
+
+def test_check_faulty_dict(step_folder):
+    """Test missing output is removed from ensembles."""
+    io = ModuleIO()
+    io.add([{0: step_folder[0], 1: step_folder[2]}], "o")
+    faulty = io.check_faulty()
+    assert faulty == 50
+    assert list(io.output[0].keys()) == [0]
+
+
+def test_check_faulty_min_size(step_folder):
+    """Test empty output is considered missing."""
+    io = ModuleIO()
+    io.add(step_folder, "o")
+    faulty = io.check_faulty(min_size=1, ncores=2)
+    assert faulty == pytest.approx(200 / 3)
+    assert [m.file_name for m in io.output] == ["model_1.pdb"]
+
+
+def test_check_faulty_checksum(step_folder):
+    """Test checksums are stored in the present output."""
+    io = ModuleIO()
+    io.add(step_folder, "o")
+    io.check_faulty(checksum=True, ncores=2)
+    assert io.output[0].checksum == file_checksum(io.output[0].rel_path)
+    assert io.output[0].checksum != io.output[1].checksum
+    assert step_folder[2].checksum is None
+
+
+def test_check_faulty_empty():
+    """Test error is raised without output."""
+    with pytest.raises(Exception):
+        ModuleIO().check_faulty()
@@ -0,0 +1,34 @@
+"""Test the parallelisation library."""
+from pathlib import Path
+
+import pytest
+
+from haddock.libs.libparallel import Scheduler
+
+
+class Task:
+    """A task returning its input squared."""
+
+    def __init__(self, value):
+        self.value = value
+        self.output = Path(f"task_{value}")
+
+    def run(self):
+        """Square the input."""
+        return self.value ** 2
+
+
+@pytest.mark.parametrize("ncores", [1, 3])
+def test_scheduler_results(ncores):
+    """Test the results of the tasks are collected in order."""
+    tasks = [Task(i) for i in range(10)]
+    engine = Scheduler(tasks, ncores=ncores, collect_results=True)
+    engine.run()
+    assert engine.results == [i ** 2 for i in range(10)]
+
+
+def test_scheduler_no_results():
+    """Test the results are not collected by default."""
+    engine = Scheduler([Task(2)], ncores=1)
+    engine.run()
+    assert engine.results == [None]
@@ -31,3 +31,31 @@ def test_read_chain_ids(lines, expected):
 def test_read_seg_ids(lines, expected):
     result = libpdb.read_segids(lines)
     assert result == expected
+
+
+def test_parse_atoms(tmp_path):
+    """Test ATOM and HETATM records are parsed, short lines included."""
+    pdb_f = tmp_path / "model.pdb"
+    pdb_f.write_text("\n".join([
+        "REMARK parsed",
+        chainC[0],
+        chainC[1][:54],
+        "HETATM    4 ZN    ZN D 100      10.000 -20.500   0.125  1.00  0.00      ZN  ZN",  # noqa: E501
+        "END",
+        ]))
+    atoms, xyz = libpdb.parse_atoms(pdb_f)
+    assert atoms["hetatm"].tolist() == [False, False, True]
+    assert atoms["name"].tolist() == ["CA", "CA", "ZN"]
+    assert atoms["resname"].tolist() == ["ARG", "GLU", "ZN"]
+    assert atoms["chain"].tolist() == ["C", "C", "D"]
+    assert atoms["resnum"].tolist() == [4, 6, 100]
+    assert atoms["segid"].tolist() == ["C", "", "ZN"]
+    assert atoms["element"].tolist() == ["C", "", "ZN"]
+    assert xyz.tolist()[2] == [10.0, -20.5, 0.125]
+
+
+def test_identify_chainseg(tmp_path):
+    """Test chain and segment identifiers are listed."""
+    pdb_f = tmp_path / "model.pdb"
+    pdb_f.write_text("\n".join(chainC))
+    assert libpdb.identify_chainseg(pdb_f) == (["C"], ["C"])
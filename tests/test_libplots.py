@@ -1,10 +1,19 @@
 """Test finding the best structures in libplots."""
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 import pytest
 
-from haddock.libs.libplots import find_best_struct
+from haddock.libs.libplots import (
+    _FIGURE_DATA,
+    box_plot_stats,
+    density_bins,
+    density_edges,
+    find_best_struct,
+    read_capri_table,
+    render_figures,
+    )
 
 from . import data_folder, golden_data
 
@@ -89,3 +98,59 @@ def test_find_best_struct_unclustered(example_capri_ss_dashcluster):
         )
     expected.columns.names = ["Structure"]
     pd.testing.assert_frame_equal(result, expected)
+
+
+def test_find_best_struct_dataframe(example_capri_ss):
+    """Finds the same structures in the loaded table."""
+    capri_df = read_capri_table(example_capri_ss)
+    result = find_best_struct(capri_df, 4)
+    expected = find_best_struct(example_capri_ss, 4)
+    pd.testing.assert_frame_equal(result, expected)
+    assert len(capri_df) == len(read_capri_table(example_capri_ss))
+
+
+def _add_figure(offset, value):
+    return offset + value
+
+
+@pytest.mark.parametrize("ncores", [1, 3])
+def test_render_figures(ncores):
+    """Test the figures are returned in order."""
+    axes = [{"value": i} for i in range(5)]
+    result = render_figures(_add_figure, axes, {"offset": 10}, ncores=ncores)
+    assert result == [10, 11, 12, 13, 14]
+    assert _FIGURE_DATA == {}
+
+
+def test_density_edges():
+    """Test the bins cover the finite values."""
+    capri_df = pd.DataFrame({
+        "irmsd": [1.0, 3.0, np.nan, 2.0],
+        "score": [-5.0, -5.0, -5.0, -5.0],
+        })
+    edges = density_edges(capri_df, ["irmsd", "score"], nbins=4)
+    np.testing.assert_allclose(edges["irmsd"], [1.0, 1.5, 2.0, 2.5, 3.0])
+    np.testing.assert_allclose(edges["score"], [-5.5, -5.25, -5, -4.75, -4.5])
+
+
+def test_density_bins():
+    """Test the models are counted in the non-empty bins."""
+    x = [0.1, 0.2, 0.9, np.nan, 0.6]
+    y = [0.1, 0.4, 0.9, 0.5, np.inf]
+    edges = np.array([0.0, 0.5, 1.0])
+    x_centres, y_centres, counts = density_bins(x, y, edges, edges)
+    np.testing.assert_allclose(x_centres, [0.25, 0.75])
+    np.testing.assert_allclose(y_centres, [0.25, 0.75])
+    np.testing.assert_allclose(counts, [2, 1])
+
+
+def test_box_plot_stats():
+    """Test the whiskers exclude the outliers."""
+    values = pd.Series([1.0, 2.0, 3.0, 4.0, 5.0, 100.0, np.nan])
+    stats = box_plot_stats(values)
+    assert stats["q1"] == [2.25]
+    assert stats["median"] == [3.5]
+    assert stats["q3"] == [4.75]
+    assert stats["lowerfence"] == [1.0]
+    assert stats["upperfence"] == [5.0]
+    assert box_plot_stats(pd.Series([np.nan])) is None
@@ -0,0 +1,162 @@
+"""Test the model registry."""
+import math
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from haddock.libs.libontology import PDBFile
+from haddock.libs.libregistry import (
+    ModelRegistry,
+    RegistryError,
+    get_run_registry,
+    parse_filter,
+    )
+
+
+@pytest.fixture
+def registry():
+    """Provide a registry with two steps."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        registry = ModelRegistry(Path(tmpdir, "registry.db"))
+        models = []
+        for i in range(1, 5):
+            model = PDBFile(
+                f"model_{i}.pdb",
+                path=Path(tmpdir, "7_caprieval"),
+                score=-10.0 * i,
+                unw_energies={"vdw": -float(i), "elec": 2.0 * i},
+                )
+            model.clt_id = 1 if i % 2 else 2
+            model.checksum = f"checksum{i}"
+            models.append(model)
+        registry.register_models(6, "flexref", models)
+        registry.register_models(7, "caprieval", models)
+        registry.register_capri(
+            7,
+            [{"model": f"model_{i}.pdb", "irmsd": float(i), "fnat": 0.1 * i}
+             for i in range(1, 5)],
+            )
+        yield registry
+
+
+@pytest.mark.parametrize(
+    "filter_str,expected",
+    [
+        ("irmsd<4", ("irmsd", "<", 4.0)),
+        ("fnat >= 0.3", ("fnat", ">=", 0.3)),
+        ("clt_id=1", ("clt_id", "=", 1.0)),
+        ("step_name!=caprieval", ("step_name", "!=", "caprieval")),
+        ],
+    )
+def test_parse_filter(filter_str, expected):
+    """Test filter expressions are parsed."""
+    assert parse_filter(filter_str) == expected
+
+
+def test_parse_filter_error():
+    """Test malformed filter expressions."""
+    with pytest.raises(RegistryError):
+        parse_filter("irmsd")
+
+
+def test_steps(registry):
+    """Test registered steps are listed."""
+    assert registry.steps() == [(6, "flexref"), (7, "caprieval")]
+
+
+def test_query_top(registry):
+    """Test models are sorted by score and limited."""
+    rows = registry.query(step=7, limit=2)
+    assert [r["model"] for r in rows] == ["model_4.pdb", "model_3.pdb"]
+    assert rows[0]["irmsd"] == 4.0
+
+
+def test_query_filters(registry):
+    """Test CAPRI and energy filters."""
+    rows = registry.query(step=7, filters=["irmsd<4", "vdw<=-2"])
+    assert [r["model"] for r in rows] == ["model_3.pdb", "model_2.pdb"]
+
+    rows = registry.query(step=6, filters=["irmsd<4"])
+    assert rows == []
+
+
+def test_query_cluster_filter(registry):
+    """Test models are filtered by cluster id."""
+    rows = registry.query(step=7, filters=["clt_id=1"])
+    assert [r["model"] for r in rows] == ["model_3.pdb", "model_1.pdb"]
+    assert rows[0]["clt_id"] == 1
+
+    rows = registry.query(step=7, filters=[("clt_id", "!=", 1)])
+    assert [r["model"] for r in rows] == ["model_4.pdb", "model_2.pdb"]
+
+
+def test_unclustered_models():
+    """Test unclustered models have no cluster id."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        registry = ModelRegistry(Path(tmpdir, "registry.db"))
+        model = PDBFile("model_1.pdb", path=tmpdir)
+        model.clt_id = "-"
+        registry.register_models(1, "seletop", [model])
+        assert registry.query(step=1)[0]["clt_id"] is None
+
+
+def test_query_sortby_energy(registry):
+    """Test sorting by an energy term."""
+    rows = registry.query(step=6, sortby="elec", ascending=False)
+    assert [r["model"] for r in rows][0] == "model_4.pdb"
+
+
+def test_query_unknown_column(registry):
+    """Test unknown columns raise an error."""
+    with pytest.raises(RegistryError):
+        registry.query(filters=["foo<1"])
+
+
+def test_register_replaces_step(registry):
+    """Test registering a step twice replaces its models."""
+    registry.register_models(6, "flexref", [PDBFile("other.pdb")])
+    rows = registry.query(step=6)
+    assert [r["model"] for r in rows] == ["other.pdb"]
+
+
+def test_find_by_checksum(registry):
+    """Test the entries of a model are found by its content."""
+    entries = registry.find_by_checksum("checksum2")
+    assert [(e["step"], e["model"]) for e in entries] == [
+        (6, "model_2.pdb"),
+        (7, "model_2.pdb"),
+        ]
+    assert registry.find_by_checksum("other") == []
+
+
+def test_get_run_registry():
+    """Test the registry is only created in run directories."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        assert get_run_registry(tmpdir) is None
+        Path(tmpdir, "data").mkdir()
+        assert isinstance(get_run_registry(tmpdir), ModelRegistry)
+
+
+def test_numbering(registry):
+    """Test numberings are stored with integer residue numbers."""
+    assert registry.get_numbering("abc") is None
+    numbering = {"A": {1: 10, 2: 11}, "B": {5: 5}}
+    registry.store_numbering("abc", numbering)
+    assert registry.get_numbering("abc") == numbering
+    registry.store_numbering("def", False)
+    assert registry.get_numbering("def") is False
+
+
+def test_capri_cache(registry):
+    """Test CAPRI metrics are stored by key."""
+    assert registry.get_capri_cache(["abc"]) == {}
+    metrics = {
+        f"key{i}": {"irmsd": float(i), "fnat": float("nan")}
+        for i in range(1200)
+        }
+    registry.store_capri_cache(metrics)
+    found = registry.get_capri_cache(["key3", "key1100", "other"])
+    assert set(found) == {"key3", "key1100"}
+    assert found["key3"]["irmsd"] == 3.0
+    assert math.isnan(found["key3"]["fnat"])
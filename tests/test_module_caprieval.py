@@ -7,16 +7,28 @@ from pathlib import Path
 import numpy as np
 import pytest
 
+from haddock.gear.yaml2cfg import read_from_yaml_config
+from haddock.libs.libio import working_directory
 from haddock.libs.libontology import PDBFile
+from haddock.libs.libregistry import ModelRegistry, get_run_registry
+from haddock.libs.libutil import file_checksum
+from haddock.modules.analysis.caprieval import DEFAULT_CONFIG as capri_pars
+from haddock.modules.analysis.caprieval import HaddockModule as CapriModule
 from haddock.modules.analysis.caprieval.capri import (
     CAPRI,
+    CAPRIJob,
+    ReferenceContext,
+    best_of_references,
     calc_stats,
+    capri_cache_keys,
     capri_cluster_analysis,
     load_contacts,
+    merge_data,
     rearrange_ss_capri_output,
+    row_reference_metrics,
     )
 
-from . import golden_data
+from . import golden_data, make_run
 
 
 def round_two_dec(value):
@@ -225,6 +237,309 @@ def test_protprot_dockq(protprot_caprimodule):
     assert round_two_dec(protprot_caprimodule.dockq) == 0.10
 
 
+def test_reference_context(protprot_input_list, params):
+    """Test the reference data is calculated once and shared."""
+    reference = protprot_input_list[0].rel_path
+    context = ReferenceContext(
+        reference,
+        dict(
+            params,
+            alignment_method="sequence",
+            fnat=True,
+            fnat_cutoff=5.0,
+            irmsd=True,
+            irmsd_cutoff=10.0,
+            ilrmsd=False,
+            lrmsd=True,
+            ),
+        )
+    assert context.sequences() is context.sequences()
+    assert set(context._contacts) == {5.0, 10.0}
+    assert set(context._coords) == {None, 10.0}
+
+    capri = CAPRI(
+        identificator=1,
+        reference=reference,
+        model=protprot_input_list[1].rel_path,
+        path=golden_data,
+        params=params,
+        reference_context=context,
+        )
+    capri.calc_irmsd(cutoff=10.0)
+    capri.calc_lrmsd()
+    capri.calc_fnat()
+    assert round_two_dec(capri.irmsd) == 8.33
+    assert round_two_dec(capri.lrmsd) == 20.94
+    assert round_two_dec(capri.fnat) == 0.05
+    assert context.interface(10.0) is context.interface(10.0)
+
+
+def test_reference_context_numbering(
+        protprot_input_list,
+        protprot_1bkd_input_list,
+        params,
+        ):
+    """Test numberings are calculated once per sequence."""
+    aln_params = dict(params, alignment_method="sequence", lovoalign_exec="")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # identical sequences are matched without alignment
+        reference, model = (m.rel_path for m in protprot_input_list)
+        context = ReferenceContext(reference)
+        numbering = context.numbering(model, aln_params, tmpdir)
+        assert not list(Path(tmpdir).iterdir())
+        assert all(
+            res == ref_res
+            for chain in numbering.values()
+            for res, ref_res in chain.items()
+            )
+
+        # different sequences are aligned once
+        reference, model = (m.rel_path for m in protprot_1bkd_input_list)
+        context = ReferenceContext(reference)
+        numbering = context.numbering(model, aln_params, tmpdir)
+        assert list(Path(tmpdir).glob("*.aln"))
+        for aln in Path(tmpdir).iterdir():
+            aln.unlink()
+        assert context.numbering(model, aln_params, tmpdir) is numbering
+        assert not list(Path(tmpdir).iterdir())
+
+
+def test_reference_context_structure_numbering(protprot_input_list, params):
+    """Test structural alignments are calculated once per model content."""
+    aln_params = dict(params, alignment_method="structure", lovoalign_exec="")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        reference, model = (m.rel_path for m in protprot_input_list)
+        copy = Path(tmpdir, "copy.pdb")
+        shutil.copy(model, copy)
+        context = ReferenceContext(reference)
+        # the models have the sequence of the reference, but are aligned
+        numbering = context.numbering(reference, aln_params, tmpdir)
+        assert context.numbering(model, aln_params, tmpdir) is not numbering
+        assert len(context._numberings) == 2
+        # models with the same content share the alignment
+        context.numbering(copy, aln_params, tmpdir)
+        assert len(context._numberings) == 2
+
+
+def test_precompute_numbering(protprot_1bkd_input_list, params):
+    """Test only the sequence numberings are calculated beforehand."""
+    reference, model = (m.rel_path for m in protprot_1bkd_input_list)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        registry = ModelRegistry(Path(tmpdir, "registry.db"))
+        aln_params = dict(
+            params,
+            alignment_method="structure",
+            lovoalign_exec="",
+            )
+        context = ReferenceContext(reference)
+        context.precompute_numbering([model], aln_params, tmpdir, registry)
+        assert not context._numberings
+
+        aln_params["alignment_method"] = "sequence"
+        context.precompute_numbering([model], aln_params, tmpdir, registry)
+        assert len(context._numberings) == 1
+        # saved in the registry
+        assert not context.new_numberings
+        key = next(iter(context._numberings))
+        assert registry.get_numbering(key) == context._numberings[key]
+
+
+def test_capri_job_numberings(protprot_1bkd_input_list, params):
+    """Test the numberings aligned by a job are returned with its row."""
+    params = dict(
+        params,
+        alignment_method="sequence",
+        lovoalign_exec="",
+        fnat=True,
+        fnat_cutoff=5.0,
+        irmsd=False,
+        lrmsd=False,
+        ilrmsd=False,
+        dockq=False,
+        )
+    reference, model = protprot_1bkd_input_list
+    with tempfile.TemporaryDirectory() as tmpdir:
+        context = ReferenceContext(reference.rel_path)
+        capri = CAPRI(
+            identificator=1,
+            reference=context.reference,
+            model=model,
+            path=Path(tmpdir),
+            params=params,
+            reference_context=context,
+            )
+        job = CAPRIJob(capri)
+        assert job.output == capri.output
+        row, numberings = job.run()
+        assert row["fnat"] == capri.fnat
+        assert list(numberings.values()) == list(context._numberings.values())
+        assert not context.new_numberings
+
+
+def test_best_of_references():
+    """Test the best metrics over the references."""
+    nan = float("nan")
+    reference_metrics = [
+        {"irmsd": 2.0, "fnat": 0.5, "lrmsd": 4.0, "ilrmsd": nan,
+         "dockq": 0.4},
+        None,
+        {"irmsd": 3.0, "fnat": 0.6, "lrmsd": 1.0, "ilrmsd": nan,
+         "dockq": 0.6},
+        ]
+    best, best_reference = best_of_references(reference_metrics)
+    # all the metrics come from the reference with the best DockQ
+    assert best_reference == 3
+    assert best["irmsd"] == 3.0
+    assert best["fnat"] == 0.6
+    assert best["lrmsd"] == 1.0
+    assert np.isnan(best["ilrmsd"])
+    assert best["dockq"] == 0.6
+
+    # without DockQ the I-RMSD chooses the reference
+    for metrics in reference_metrics[::2]:
+        metrics["dockq"] = nan
+    best, best_reference = best_of_references(reference_metrics)
+    assert best_reference == 1
+    assert best["fnat"] == 0.5
+    assert best["lrmsd"] == 4.0
+
+    best, best_reference = best_of_references([None])
+    assert all(np.isnan(value) for value in best.values())
+    assert best_reference is None
+
+
+def test_multi_reference(protprot_input_list, params):
+    """Test a model is evaluated against all the references."""
+    params = dict(
+        params,
+        alignment_method="sequence",
+        lovoalign_exec="",
+        fnat=True,
+        fnat_cutoff=5.0,
+        irmsd=True,
+        irmsd_cutoff=10.0,
+        lrmsd=True,
+        ilrmsd=False,
+        dockq=True,
+        )
+    reference_contexts = [
+        ReferenceContext(model.rel_path, params)
+        for model in protprot_input_list
+        ]
+    model = protprot_input_list[1]
+    capri = CAPRI(
+        identificator=1,
+        reference=reference_contexts[0].reference,
+        model=model,
+        path=golden_data,
+        params=params,
+        reference_context=reference_contexts[0],
+        reference_contexts=reference_contexts,
+        )
+    row = capri.run()
+
+    assert round_two_dec(row["irmsd_ref1"]) == 8.33
+    assert round_two_dec(row["lrmsd_ref1"]) == 20.94
+    assert round_two_dec(row["fnat_ref1"]) == 0.05
+    # the model is the second reference
+    assert round_two_dec(row["irmsd_ref2"]) == 0.0
+    assert row["fnat_ref2"] == 1.0
+    assert row["irmsd"] == row["irmsd_ref2"]
+    assert row["fnat"] == row["fnat_ref2"]
+    assert row["best_ref"] == 2
+    assert "ilrmsd_ref1" not in row
+    assert capri.irmsd == row["irmsd"]
+
+    # a single reference has no per reference columns
+    capri = CAPRI(
+        identificator=1,
+        reference=reference_contexts[0].reference,
+        model=model,
+        path=golden_data,
+        params=params,
+        reference_context=reference_contexts[0],
+        )
+    row = capri.run()
+    assert round_two_dec(row["irmsd"]) == 8.33
+    assert "best_ref" not in row
+    assert not any(key.endswith("_ref1") for key in row)
+
+
+def test_capri_cache_keys(protprot_input_list):
+    """Test the cache keys depend on the content and the parameters."""
+    reference = protprot_input_list[0].rel_path
+    copy = PDBFile(reference, path=golden_data)
+    params = {"fnat": True, "fnat_cutoff": 5.0}
+    keys = capri_cache_keys(
+        protprot_input_list + [copy],
+        [reference],
+        params,
+        )
+    assert keys[0] == keys[2]
+    assert keys[0] != keys[1]
+
+    other = capri_cache_keys([copy], [reference], dict(params, fnat=False))
+    assert other[0] != keys[0]
+    # parameters that do not change the metrics are ignored
+    same = capri_cache_keys([copy], [reference], dict(params, sortby="fnat"))
+    assert same[0] == keys[0]
+
+
+def test_row_reference_metrics():
+    """Test getting the metrics of each reference from a row."""
+    row = {"irmsd": 1.0, "fnat": 0.5, "lrmsd": 2.0, "ilrmsd": 3.0,
+           "dockq": 0.7, "irmsd_ref1": 1.0, "irmsd_ref2": 4.0}
+    assert row_reference_metrics(row, 1) == [
+        {"irmsd": 1.0, "fnat": 0.5, "lrmsd": 2.0, "ilrmsd": 3.0,
+         "dockq": 0.7},
+        ]
+    metrics = row_reference_metrics(row, 2)
+    assert [m["irmsd"] for m in metrics] == [1.0, 4.0]
+    assert np.isnan(metrics[1]["fnat"])
+
+
+def test_caprieval_cache():
+    """Test models evaluated by a previous step are not evaluated again."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        make_run(
+            tmpdir,
+            ["protprot_complex_1.pdb", "protprot_complex_2.pdb"],
+            [(CapriModule, capri_pars, {})],
+            )
+        registry = get_run_registry(tmpdir)
+        models = [
+            PDBFile(Path(tmpdir, "0_emscoring", f"m{i}.pdb")) for i in (1, 2)
+            ]
+        keys = capri_cache_keys(
+            models,
+            [models[0].rel_path],
+            read_from_yaml_config(capri_pars),
+            )
+        cache = registry.get_capri_cache([k[0] for k in keys])
+        assert len(cache) == 2
+        # the exported models are registered with their checksum
+        entries = registry.find_by_checksum(file_checksum(models[1].rel_path))
+        assert [e["model"] for e in entries] == ["m2.pdb"]
+        assert round_two_dec(cache[keys[1][0]]["irmsd"]) == 8.33
+
+        # the metrics are taken from the registry
+        registry.store_capri_cache(
+            {keys[1][0]: dict(cache[keys[1][0]], irmsd=42.0)}
+            )
+        step_path = Path(tmpdir, "2_caprieval")
+        step_path.mkdir()
+        with working_directory(tmpdir):
+            step = CapriModule(
+                order=2,
+                path=step_path,
+                initial_params=capri_pars,
+                )
+        with working_directory(step_path):
+            step.run()
+        rows = read_capri_file(Path(tmpdir, "2_caprieval", "capri_ss.tsv"))
+        assert rows[2][rows[0].index("irmsd")] == "42.000"
+
+
 def test_protprot_1bkd_irmsd(protprot_1bkd_caprimodule):
     """Test protein-protein i-rmsd calculation."""
     protprot_1bkd_caprimodule.calc_irmsd(cutoff=10.0)
@@ -307,31 +622,25 @@ def test_protdna_fnat(protdna_caprimodule):
 
 
 def test_make_output(protprot_caprimodule):
-    """Test the writing of capri.tsv file."""
+    """Test the row of the capri_ss.tsv file."""
     protprot_caprimodule.model.clt_id = 1
     protprot_caprimodule.model.clt_rank = 1
     protprot_caprimodule.model.clt_model_rank = 10
 
-    protprot_caprimodule.make_output()
+    row = protprot_caprimodule.make_output()
 
+    assert row["model"] is protprot_caprimodule.model
+    del row["model"]
+    assert list(row) == [
+        'md5', 'caprieval_rank', 'score', 'irmsd', 'fnat', 'lrmsd', 'ilrmsd',
+        'dockq', 'cluster-id', 'cluster-ranking', 'model-cluster-ranking']
+    assert np.isnan(row["score"])
+    assert [row[k] for k in ("cluster-id", "model-cluster-ranking")] == [1, 10]
     ss_fname = Path(
         protprot_caprimodule.path,
         f"capri_ss_{protprot_caprimodule.identificator}.tsv"
         )
-
-    assert ss_fname.stat().st_size != 0
-
-    # remove the model column since its name will depend on where we are running
-    #  the test
-    observed_outf_l = read_capri_file(ss_fname)
-    expected_outf_l = [
-        ['md5', 'caprieval_rank', 'score', 'irmsd', 'fnat', 'lrmsd', 'ilrmsd',
-         'dockq', 'cluster-id', 'cluster-ranking', 'model-cluster-ranking'],
-        ['-', '-', 'nan', 'nan', 'nan', 'nan', 'nan', 'nan', '1', '1', '10'], ]
-
-    assert observed_outf_l == expected_outf_l
-
-    os.unlink(ss_fname)
+    assert not ss_fname.exists()
 
 
 def test_identify_protprotinterface(protprot_caprimodule, protprot_input_list):
@@ -432,6 +741,28 @@ def test_load_contacts(protprot_input_list):
     assert observed_con_set == expected_con_set
 
 
+def test_load_contacts_altloc():
+    """Test only the last location of an atom is used, as load_coords does."""
+    atom_line = (
+        "ATOM      1  CA {altloc}ALA {chain}   1    "
+        "{x:8.3f}   0.000   0.000  1.00  0.00           C"
+        )
+    lines = [
+        atom_line.format(altloc=" ", chain="A", x=0.0),
+        atom_line.format(altloc="A", chain="B", x=3.0),
+        atom_line.format(altloc="B", chain="B", x=30.0),
+        ]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pdb_f = Path(tmpdir, "altloc.pdb")
+        pdb_f.write_text(os.linesep.join(lines) + os.linesep)
+        assert load_contacts(pdb_f, cutoff=5.0) == set()
+
+        # the last location in contact
+        lines[1:] = lines[2:0:-1]
+        pdb_f.write_text(os.linesep.join(lines) + os.linesep)
+        assert load_contacts(pdb_f, cutoff=5.0) == {("A", 1, "B", 1)}
+
+
 def test_add_chain_from_segid(protprot_caprimodule):
     """Test replacing the chainID with segID."""
     tmp = tempfile.NamedTemporaryFile(delete=True)
@@ -447,24 +778,68 @@ def test_add_chain_from_segid(protprot_caprimodule):
 
 
 def test_rearrange_ss_capri_output():
-    """Test rearranging the capri output."""
-    with open(f"{golden_data}/capri_ss_1.tsv", 'w') as fh:
-        fh.write(
-            "model	caprieval_rank	score	irmsd	fnat	lrmsd	ilrmsd	"
-            "dockq	cluster-id	cluster-ranking	"
-            "model-cluster-ranking" + os.linesep)
-        fh.write(
-            "../1_emscoring/emscoring_909.pdb	1	-424.751	0.000	"
-            "1.000	0.000	0.000	1.000	-	-	-" + os.linesep)
-    rearrange_ss_capri_output(
-        'capri_ss.txt',
-        output_count=1,
-        sort_key="score",
-        sort_ascending=True,
-        path=golden_data)
-
-    assert Path('capri_ss.txt').stat().st_size != 0
-    Path('capri_ss.txt').unlink()
+    """Test writing the rows of the capri jobs."""
+    rows = [
+        {"model": "m1.pdb", "caprieval_rank": None, "score": -10.0,
+         "irmsd": 2.0},
+        None,
+        {"model": "m2.pdb", "caprieval_rank": None, "score": -20.0,
+         "irmsd": float("nan")},
+        {"model": "m3.pdb", "caprieval_rank": None, "score": -5.0,
+         "irmsd": 1.0},
+        ]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        rearrange_ss_capri_output(
+            rows,
+            "capri_ss.tsv",
+            sort_key="irmsd",
+            sort_ascending=True,
+            path=tmpdir,
+            )
+
+        observed = Path(tmpdir, "capri_ss.tsv").read_text().splitlines()
+        assert observed == [
+            "model\tcaprieval_rank\tscore\tirmsd",
+            "m3.pdb\t3\t-5.000\t1.000",
+            "m1.pdb\t2\t-10.000\t2.000",
+            "m2.pdb\t1\t-20.000\tnan",
+            ]
+
+        rearrange_ss_capri_output(
+            rows,
+            "capri_ss.tsv",
+            sort_key="score",
+            sort_ascending=False,
+            path=tmpdir,
+            )
+        observed = Path(tmpdir, "capri_ss.tsv").read_text().splitlines()
+        assert [line.split()[0] for line in observed[1:]] == [
+            "m3.pdb", "m1.pdb", "m2.pdb"]
+
+
+def test_rearrange_ss_capri_output_empty():
+    """Test no file is written without rows."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        rearrange_ss_capri_output(
+            [None],
+            "capri_ss.tsv",
+            sort_key="score",
+            sort_ascending=True,
+            path=tmpdir,
+            )
+        assert not Path(tmpdir, "capri_ss.tsv").exists()
+
+
+def test_merge_data(protprot_caprimodule):
+    """Test copying the metrics of the rows to the jobs."""
+    row = {"irmsd": 1.0, "fnat": 0.5, "lrmsd": 2.0, "ilrmsd": 3.0,
+           "dockq": 0.7}
+    jobs = merge_data([protprot_caprimodule], [row])
+    assert [jobs[0].irmsd, jobs[0].fnat, jobs[0].dockq] == [1.0, 0.5, 0.7]
+
+    protprot_caprimodule.irmsd = float("nan")
+    merge_data([protprot_caprimodule], [None])
+    assert np.isnan(protprot_caprimodule.irmsd)
 
 
 def test_calc_stats():
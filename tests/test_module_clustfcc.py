@@ -2,11 +2,26 @@
 import os
 from pathlib import Path
 
+import numpy as np
 import pytest
 
+from haddock.libs.libcontacts import CONTACT_DTYPE, contact_codes
 from haddock.libs.libontology import PDBFile
+from haddock.libs.libpdb import ATOM_DTYPE
 from haddock.modules.analysis.clustfcc import DEFAULT_CONFIG as clustfcc_pars
 from haddock.modules.analysis.clustfcc import HaddockModule
+from haddock.modules.analysis.clustfcc.clustfcc import (
+    calc_contacts,
+    contact_matrix,
+    fcc_atoms,
+    fcc_neighbours,
+    find_threshold,
+    get_clusters,
+    load_sweep,
+    sweep_clusters,
+    write_contact_file,
+    write_fcc_matrix,
+    )
 
 from . import golden_data
 
@@ -26,9 +41,8 @@ def output_list():
     return [
         "fcc.matrix",
         "cluster.out",
-        "protprot_complex_1.con",
-        "protprot_complex_2.con",
         "clustfcc.txt",
+        "clustfcc_sweep.npz",
         "io.json",
         "clustfcc.tsv"
         ]
@@ -41,6 +55,7 @@ def test_clustfcc_output_existence(protprot_input_list, output_list):
         path=Path("1_emscoring"),
         initial_params=clustfcc_pars
         )
+    fcc_module.update_params(matrix_text=True)
     fcc_module.previous_io.output = protprot_input_list
 
     fcc_module._run()
@@ -50,6 +65,8 @@ def test_clustfcc_output_existence(protprot_input_list, output_list):
     for el in output_list:
         assert el in ls
 
+    assert "protprot_complex_1.con" not in ls
+
 
 def test_matrix_output():
     """Check fcc.matrix file."""
@@ -62,19 +79,198 @@ def test_matrix_output():
     assert observed_output == expected_output
 
 
-def test_contacts():
+def test_contacts(protprot_input_list):
+    """Check the contacts of the models."""
+    contacts = calc_contacts(protprot_input_list, 5.0, ncores=2)
+    # the unique residue pairs of the 100 and 119 atom pairs found by
+    #  the contact_fcc program of FCC
+    assert [len(c) for c in contacts] == [20, 16]
+    assert all(c.dtype == np.int64 for c in contacts)
+    assert len(np.intersect1d(*contacts)) == 1
+    assert all(
+        (c == single).all()
+        for c, single in zip(contacts, calc_contacts(protprot_input_list, 5.0))
+        )
+
+
+def test_write_contacts(protprot_input_list):
     """Check .con files."""
-    expected_output_length = [100, 119]
+    fcc_module = HaddockModule(
+        order=1,
+        path=Path("1_emscoring"),
+        initial_params=clustfcc_pars
+        )
+    fcc_module.update_params(write_contacts=True)
+    fcc_module.previous_io.output = protprot_input_list
+    fcc_module._run()
 
     observed_output_lengths = []
+    for con_f in ("protprot_complex_1.con", "protprot_complex_2.con"):
+        observed_output_lengths.append(len(open(con_f).readlines()))
+        os.unlink(con_f)
+    assert observed_output_lengths == [20, 16]
+
+    contact = contact_codes(np.array(
+        [("A", 37, "B", 52)],
+        dtype=CONTACT_DTYPE,
+        ))
+    write_contact_file(contact, "contact.con")
+    assert open("contact.con").read() == "37 A 52 B" + os.linesep
+    os.unlink("contact.con")
 
-    con1_len = len(open("protprot_complex_1.con").readlines())
-    observed_output_lengths.append(con1_len)
 
-    con2_len = len(open("protprot_complex_2.con").readlines())
-    observed_output_lengths.append(con2_len)
+def test_fcc_atoms():
+    """Check the atoms are selected as by contact_fcc."""
+    atoms = np.array(
+        [
+            (False, "CA", "ALA", "A", 1, "A", "C"),
+            (False, "HN", "ALA", "A", 1, "A", "H"),
+            (False, "1HB", "ALA", "A", 1, "A", "H"),
+            (False, "1CB", "ALA", "A", 1, "A", "C"),
+            (True, "O", "HOH", "B", 2, "B", "O"),
+            (False, "N", "GLY", "B", 3, "C", "N"),
+            ],
+        dtype=ATOM_DTYPE,
+        )
+    selection, segments = fcc_atoms(atoms)
+    assert selection.tolist() == [True, False, False, True, False, True]
+    assert segments.tolist() == ["A", "A", "A", "A", "B", "C"]
+
+    # without segment identifiers the chains are used
+    atoms["segid"] = ""
+    _, segments = fcc_atoms(atoms)
+    assert segments.tolist() == ["A", "A", "A", "A", "B", "B"]
 
-    assert observed_output_lengths == expected_output_length
+
+@pytest.fixture
+def random_contacts():
+    """Random contacts of models drawn from a few interfaces."""
+    rng = np.random.default_rng(0)
+    interfaces = [rng.choice(200, size=40, replace=False) for _ in range(3)]
+    return [
+        np.unique(rng.choice(
+            interfaces[rng.integers(3)],
+            size=rng.integers(10, 40),
+            ))
+        for _ in range(50)
+        ]
+
+
+def fcc_neighbours_loop(contacts, cutoff, strictness):
+    """Compare the sets of contacts of each pair, as done before."""
+    sets = [set(c.tolist()) for c in contacts]
+    found = set()
+    for i in range(len(sets)):
+        for j in range(i + 1, len(sets)):
+            common = len(sets[i] & sets[j])
+            fcc = float(f"{common / len(sets[i]):.2f}")
+            fcc_v = float(f"{common / len(sets[j]):.3f}")
+            if fcc >= cutoff and fcc_v >= cutoff * strictness:
+                found.add((i, j))
+            if fcc_v >= cutoff and fcc >= cutoff * strictness:
+                found.add((j, i))
+    return found
+
+
+@pytest.mark.parametrize("ncores,block_size", [(1, 2000), (1, 7), (3, 7)])
+def test_fcc_neighbours(random_contacts, ncores, block_size):
+    """Test the sparse FCC matches the comparison of sets."""
+    matrix = contact_matrix(random_contacts)
+    assert matrix.shape[0] == 50
+    assert (matrix.sum(axis=1).A1 == [len(c) for c in random_contacts]).all()
+    for cutoff, strictness in ((0.6, 0.75), (0.3, 1.0), (0.9, 0.5)):
+        ref, neighbour = fcc_neighbours(
+            matrix,
+            cutoff,
+            strictness,
+            ncores=ncores,
+            block_size=block_size,
+            )
+        expected = fcc_neighbours_loop(random_contacts, cutoff, strictness)
+        assert len(ref) == len(expected)
+        assert set(zip(ref.tolist(), neighbour.tolist())) == expected
+
+
+@pytest.mark.parametrize("ncores,block_size", [(1, 2000), (3, 2)])
+def test_fcc_neighbours_cutoff_zero(ncores, block_size):
+    """Test pairs without shared contacts are neighbours for cutoff 0."""
+    contacts = [np.array([1, 2]), np.array([3]), np.array([2, 4])]
+    matrix = contact_matrix(contacts)
+    ref, neighbour = fcc_neighbours(
+        matrix,
+        0,
+        0.75,
+        ncores=ncores,
+        block_size=block_size,
+        )
+    expected = fcc_neighbours_loop(contacts, 0, 0.75)
+    assert len(expected) == 6
+    assert len(ref) == len(expected)
+    assert set(zip(ref.tolist(), neighbour.tolist())) == expected
+
+
+def test_write_fcc_matrix(random_contacts):
+    """Test the FCC matrix text file."""
+    matrix = contact_matrix(random_contacts[:3])
+    write_fcc_matrix(matrix, "fcc_test.matrix", block_size=2)
+    lines = open("fcc_test.matrix").read().splitlines()
+    os.unlink("fcc_test.matrix")
+    assert [line.split()[:2] for line in lines] == [
+        ["1", "2"], ["1", "3"], ["2", "3"]]
+    sets = [set(c.tolist()) for c in random_contacts[:3]]
+    common = len(sets[0] & sets[2])
+    assert lines[1] == (
+        f"1 3 {common / len(sets[0]):.2f} {common / len(sets[2]):.3f}")
+
+
+def cluster_elements_loop(neighbours, threshold):
+    """Cluster greedily for one threshold, as done before."""
+    cluster = {e: 0 for e in neighbours}
+    clusters = []
+    while True:
+        candidates = [e for e in neighbours if not cluster[e]]
+        if not candidates:
+            break
+        count, center = max(
+            (len([n for n in neighbours[e] if not cluster[n]]), e)
+            for e in candidates
+            )
+        if count < threshold - 1:
+            break
+        members = [n for n in neighbours[center] if not cluster[n]]
+        cluster[center] = len(clusters) + 1
+        for member in members:
+            cluster[member] = len(clusters) + 1
+        clusters.append((center, sorted(members)))
+    return clusters
+
+
+def test_sweep_clusters(random_contacts):
+    """Test the clusters of all thresholds match one clustering each."""
+    ref, neighbour = fcc_neighbours(
+        contact_matrix(random_contacts), 0.3, 0.75)
+    neighbours = {e: set() for e in range(50)}
+    for r, n in zip(ref.tolist(), neighbour.tolist()):
+        neighbours[r].add(n)
+
+    sweep = sweep_clusters(50, ref, neighbour)
+    centers, sizes, labels = sweep
+    assert (np.diff(sizes) <= 0).all()
+    assert (labels >= 0).all()
+    assert sizes.sum() + len(centers) == 50
+    for threshold in range(1, sizes[0] + 3):
+        expected = cluster_elements_loop(neighbours, threshold)
+        observed = get_clusters(*sweep, threshold)
+        assert [(c, m.tolist()) for c, m in observed] == expected
+
+
+def test_find_threshold():
+    """Test the threshold falls back to the largest cluster."""
+    sizes = np.array([2, 1, 0, 0])
+    assert find_threshold(sizes, 2) == 2
+    assert find_threshold(sizes, 3) == 3
+    assert find_threshold(sizes, 10) == 3
+    assert find_threshold(np.array([], dtype=int), 4) == 1
 
 
 def remove_clustfcc_files(output_list):
@@ -94,4 +290,10 @@ def test_cluster_out(output_list):
 
     assert expected_output == observed_output
 
+    # no cluster of 4, the threshold was lowered to 1
+    assert "> threshold=1" in open("clustfcc.txt").read()
+    centers, sizes, labels = load_sweep()
+    assert centers.tolist() == [1, 0]
+    assert sizes.tolist() == [0, 0]
+
     remove_clustfcc_files(output_list)
@@ -0,0 +1,146 @@
+"""Test the clustleader module."""
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pytest
+from scipy.spatial.transform import Rotation
+
+from haddock.libs.libio import working_directory
+from haddock.libs.libontology import PDBFile
+from haddock.modules.analysis.clustleader import DEFAULT_CONFIG as leader_pars
+from haddock.modules.analysis.clustleader import HaddockModule
+from haddock.modules.analysis.clustleader.clustleader import (
+    adjusted_rand_index,
+    compare_exact,
+    exact_clustering,
+    leader_clustering,
+    )
+from haddock.modules.analysis.rmsdmatrix.rmsd import block_rmsd
+
+from . import golden_data
+
+
+@pytest.fixture
+def blobs():
+    """Rotated and shifted copies of three noisy structures."""
+    rng = np.random.default_rng(0)
+    centers = rng.normal(scale=10.0, size=(3, 50, 3))
+    labels = rng.integers(3, size=60)
+    xyz = centers[labels] + rng.normal(scale=0.3, size=(60, 50, 3))
+    rotations = Rotation.random(60, random_state=1).as_matrix()
+    xyz = np.einsum("mij,maj->mai", rotations, xyz) + rng.normal(
+        scale=5.0, size=(60, 1, 3))
+    mask = np.ones((60, 50), dtype=bool)
+    return xyz, mask, labels
+
+
+def leader_loop(xyz, mask, cutoff):
+    """Compare each model with all the leaders."""
+    leaders = []
+    cluster_arr = np.zeros(len(xyz), dtype=int)
+    for model in range(len(xyz)):
+        if leaders:
+            dist = block_rmsd(
+                xyz[model], mask[model], xyz[leaders], mask[leaders])
+            if dist.min() <= cutoff:
+                cluster_arr[model] = np.argmin(dist) + 1
+                continue
+        leaders.append(model)
+        cluster_arr[model] = len(leaders)
+    return cluster_arr
+
+
+@pytest.mark.parametrize("cutoff", [0.5, 2.0, 10.0])
+def test_leader_clustering(blobs, cutoff):
+    """Test the pruning does not change the clusters."""
+    xyz, mask, _ = blobs
+    expected = leader_loop(xyz, mask, cutoff)
+    for npivots in (1, 2, 8):
+        cluster_arr, leaders, ncalc = leader_clustering(
+            xyz, mask, cutoff, npivots)
+        assert (cluster_arr == expected).all()
+        assert (cluster_arr[leaders] == np.arange(1, len(leaders) + 1)).all()
+        assert ncalc <= len(xyz) * len(leaders)
+
+
+def test_leader_clustering_pruning():
+    """Test leaders far from the pivot are not compared."""
+    rng = np.random.default_rng(0)
+    base = rng.normal(scale=5.0, size=(50, 3))
+    # structures along a line of scale factors are ordered by RMSD
+    labels = np.repeat(np.arange(10), 10)
+    xyz = base * (1 + labels / 2)[:, None, None]
+    xyz += rng.normal(scale=0.05, size=xyz.shape)
+    mask = np.ones((100, 50), dtype=bool)
+
+    cluster_arr, leaders, ncalc = leader_clustering(xyz, mask, 1.0, 1)
+    assert len(leaders) == 10
+    assert adjusted_rand_index(cluster_arr, labels) == 1.0
+    assert (cluster_arr == leader_loop(xyz, mask, 1.0)).all()
+    # each model is compared with the pivot and the leaders next to it
+    assert ncalc < 3 * len(xyz)
+
+
+def test_adjusted_rand_index():
+    """Test the adjusted Rand index."""
+    labels = np.array([1, 1, 2, 2, 3, 3])
+    assert adjusted_rand_index(labels, labels) == 1.0
+    assert adjusted_rand_index(labels, labels[::-1] + 10) == 1.0
+    assert adjusted_rand_index(labels, np.ones(6)) == 0.0
+    assert np.isclose(
+        adjusted_rand_index(labels, np.array([1, 1, 1, 2, 3, 3])),
+        0.4444,
+        atol=1e-4,
+        )
+
+
+def test_exact_agreement(blobs):
+    """Test the agreement with the exact clustering."""
+    xyz, mask, labels = blobs
+    exact = exact_clustering(xyz, mask, 2.0)
+    assert adjusted_rand_index(exact, labels) == 1.0
+    cluster_arr, _, _ = leader_clustering(xyz, mask, 2.0)
+    assert compare_exact(xyz, mask, cluster_arr, 2.0, 20) == 1.0
+
+
+@pytest.fixture
+def input_protdna_models():
+    """Two copies of two prot-DNA models."""
+    return [
+        PDBFile(
+            Path(golden_data, f"protdna_complex_{i}.pdb"),
+            path=golden_data,
+            score=score,
+            )
+        for i, score in ((1, -10.0), (2, -20.0), (1, -5.0), (2, -15.0))
+        ]
+
+
+def test_clustleader(input_protdna_models):
+    """Test the clustleader module."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with working_directory(tmpdir):
+            module = HaddockModule(
+                order=1,
+                path=Path("1_clustleader"),
+                initial_params=leader_pars,
+                )
+            module.update_params(clust_cutoff=1.0, threshold=2, exact_sample=4)
+            module.previous_io.output = input_protdna_models
+            module._run()
+
+            # model 2 has the best score and leads cluster 1
+            assert Path("cluster.out").read_text().split() == [
+                "Cluster", "1", "->", "2", "4",
+                "Cluster", "2", "->", "1", "3",
+                ]
+            models = module.output_models
+            assert [m.score for m in models] == [-20.0, -15.0, -10.0, -5.0]
+            assert [m.clt_id for m in models] == [1, 1, 2, 2]
+            assert [m.clt_rank for m in models] == [1, 1, 2, 2]
+            assert [m.clt_model_rank for m in models] == [1, 2, 1, 2]
+            assert Path("clustleader.tsv").exists()
+            txt = Path("clustleader.txt").read_text()
+            assert "> exact_agreement=1.000" in txt
+            assert Path("io.json").exists()
@@ -1,9 +1,11 @@
 """Test the clustrmsd module."""
 import os
+import tempfile
 from pathlib import Path
 
 import numpy as np
 import pytest
+from scipy.spatial.distance import squareform
 
 from haddock.libs.libontology import ModuleIO, PDBFile, RMSDFile
 from haddock.modules.analysis.clustrmsd import DEFAULT_CONFIG as clustrmsd_pars
@@ -15,6 +17,7 @@ from haddock.modules.analysis.clustrmsd.clustrmsd import (
     get_clusters,
     get_dendrogram,
     iterate_threshold,
+    load_linkage,
     read_matrix,
     )
 from haddock.modules.analysis.rmsdmatrix import DEFAULT_CONFIG as rmsd_pars
@@ -27,11 +30,13 @@ from . import golden_data
 def output_list():
     """Clustfcc output list."""
     return [
-        "rmsd.matrix",
+        "rmsd.npy",
+        "rmsd_models.json",
         "rmsd_matrix.json",
         "cluster.out",
         "clustrmsd.txt",
         "clustrmsd.tsv",
+        "linkage_average.npz",
         "io.json"
         ]
 
@@ -155,6 +160,68 @@ def test_read_rmsd_matrix(correct_rmsd_vec):
     os.unlink(output_name)
 
 
+def test_read_binary_matrix(correct_rmsd_vec):
+    """Check the binary rmsd matrix is memory-mapped."""
+    output_name = "fake_rmsd.npy"
+    json_name = "fake_rmsd.json"
+
+    np.save(output_name, np.array([e[2] for e in correct_rmsd_vec]))
+
+    save_rmsd_json(output_name, json_name, 3)
+
+    matrix_json = read_rmsd_json(json_name)
+
+    matrix = read_matrix(matrix_json.input[0])
+
+    assert isinstance(matrix, np.memmap)
+
+    assert list(matrix) == [e[2] for e in correct_rmsd_vec]
+
+    save_rmsd_json(output_name, json_name, 6)
+
+    matrix_json = read_rmsd_json(json_name)
+
+    with pytest.raises(ValueError):
+        read_matrix(matrix_json.input[0])
+
+    del matrix
+    os.unlink(json_name)
+    os.unlink(output_name)
+
+
+def test_load_linkage(correct_rmsd_array):
+    """Test the linkage is saved and reused while the matrix is unchanged."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        matrix_f = Path(tmpdir, "rmsd.npy")
+        np.save(matrix_f, correct_rmsd_array)
+        rmsd_file = RMSDFile(matrix_f, npairs=6, path=tmpdir)
+
+        expected = get_dendrogram(correct_rmsd_array, "average")
+        observed = load_linkage(rmsd_file, "average")
+        assert (observed == expected).all()
+        linkage_f = Path(tmpdir, "linkage_average.npz")
+        assert linkage_f.exists()
+
+        # the saved linkage is used
+        with np.load(linkage_f) as saved:
+            np.savez(linkage_f, linkage=saved["linkage"] + 1,
+                     matrix=saved["matrix"])
+        assert (load_linkage(rmsd_file, "average") == expected + 1).all()
+        assert (load_linkage(rmsd_file, "single")
+                == get_dendrogram(correct_rmsd_array, "single")).all()
+
+        # a new matrix invalidates the saved linkage
+        np.save(matrix_f, correct_rmsd_array[::-1])
+        os.utime(matrix_f, ns=(0, 0))
+        expected = get_dendrogram(correct_rmsd_array[::-1], "average")
+        assert (load_linkage(rmsd_file, "average") == expected).all()
+
+        # the matrix given is used instead of reading it again
+        expected = get_dendrogram(correct_rmsd_array, "complete")
+        observed = load_linkage(rmsd_file, "complete", correct_rmsd_array)
+        assert (observed == expected).all()
+
+
 def test_read_matrix_input(correct_rmsd_vec):
     """Test wrong input to read_matrix."""
     rmsd_vec = correct_rmsd_vec
@@ -318,6 +385,20 @@ def test_get_cluster_center(correct_rmsd_array):
     assert obs_clt_center == exp_clt_center
 
 
+def test_get_cluster_center_blocks():
+    """Test the cluster center does not depend on the blocks."""
+    rng = np.random.default_rng(0)
+    n_obs = 60
+    rmsd_matrix = rng.uniform(1.0, 10.0, n_obs * (n_obs - 1) // 2)
+    square = squareform(rmsd_matrix)
+    npw = np.sort(rng.choice(n_obs, 25, replace=False))
+    expected = npw[np.argmin(square[np.ix_(npw, npw)].sum(axis=1))]
+    for block_size in (1, 7, 2**22):
+        observed = get_cluster_center(npw, n_obs, rmsd_matrix, block_size)
+        assert observed == expected
+    assert get_cluster_center([5], n_obs, rmsd_matrix) == 5
+
+
 def test_cond_index():
     """Test cond_index function."""
     n_obs = 10
@@ -1,18 +1,35 @@
 """Test the rmsdmatrix module."""
 import os
+import tempfile
 from pathlib import Path
 
 import numpy as np
 import pytest
 
+from haddock.libs.libalign import batch_rmsd
+from haddock.libs.libio import working_directory
 from haddock.libs.libontology import PDBFile
 from haddock.modules.analysis.rmsdmatrix import DEFAULT_CONFIG as rmsd_pars
 from haddock.modules.analysis.rmsdmatrix import HaddockModule
 from haddock.modules.analysis.rmsdmatrix.rmsd import (
     RMSD,
     RMSDJob,
+    coords_hash,
+    create_matrix,
+    fill_from_matrix,
+    find_matrix,
     get_pair,
+    load_model_coords,
     rmsd_dispatcher,
+    save_matrix_models,
+    write_matrix_text,
+    )
+from haddock.modules.analysis.rmsdmatrix.tiled import (
+    RMSDTile,
+    get_tile_size,
+    get_tiles,
+    prepare_tiles,
+    tiles_key,
     )
 
 from . import golden_data
@@ -93,20 +110,84 @@ def test_overall_rmsd(input_protdna_models):
 
     ls = os.listdir()
 
-    assert "rmsd.matrix" in ls
+    assert "rmsd.npy" in ls
+
+    assert "rmsd.matrix" not in ls
 
     assert "rmsd_matrix.json" in ls
 
     # check correct rmsd matrix
+    rmsd_matrix = np.load("rmsd.npy")
+
+    np.testing.assert_allclose(rmsd_matrix, [2.257], atol=0.001)
+
+    assert "rmsd_models.json" in ls
+
+    for fname in ("rmsd.npy", "rmsd_models.json", "rmsd_matrix.json",
+                  "io.json"):
+        os.unlink(Path(fname))
+
+
+def test_overall_rmsd_text(input_protdna_models):
+    """Test the text export of the rmsd matrix."""
+    rmsd_module = HaddockModule(
+        order=2,
+        path=Path("2_rmsdmatrix"),
+        initial_params=rmsd_pars
+        )
+    rmsd_module.params["matrix_text"] = True
+    rmsd_module.previous_io.output = input_protdna_models
+    rmsd_module._run()
+
     rmsd_matrix = open("rmsd.matrix").read()
-    
+
     expected_rmsd_matrix = "1 2 2.257" + os.linesep
 
     assert rmsd_matrix == expected_rmsd_matrix
 
-    os.unlink(Path("rmsd.matrix"))
-    os.unlink(Path("rmsd_matrix.json"))
-    os.unlink(Path("io.json"))
+    for fname in ("rmsd.npy", "rmsd.matrix", "rmsd_models.json",
+                  "rmsd_matrix.json", "io.json"):
+        os.unlink(Path(fname))
+
+
+def test_RMSD_matrix_file(input_protdna_models):
+    """Test cores writing to their slice of the binary matrix."""
+    models = input_protdna_models * 2
+    _, *coords = load_model_coords(models)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        matrix_f = Path(tmpdir, "rmsd.npy")
+        create_matrix(matrix_f, 6)
+        for core, (npairs, ref, mod, offset) in enumerate(
+                [(4, 0, 1, 0), (2, 1, 3, 4)]):
+            rmsd_obj = RMSD(
+                models,
+                core=core,
+                npairs=npairs,
+                start_ref=ref,
+                start_mod=mod,
+                output_name=f"rmsd_{core}.matrix",
+                path=Path(tmpdir),
+                coords=coords,
+                matrix_file=matrix_f,
+                offset=offset,
+                )
+            rmsd_obj.run()
+            rmsd_obj.output()
+        matrix = np.load(matrix_f)
+        assert os.listdir(tmpdir) == ["rmsd.npy"]
+
+    expected_rmsd = [2.257, 0.0, 2.257, 2.257, 0.0, 2.257]
+    np.testing.assert_allclose(matrix, expected_rmsd, atol=0.001)
+
+
+def test_write_matrix_text():
+    """Test the text form of a condensed matrix."""
+    matrix = np.array([1.0, 2.5, 3.1234])
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output_f = Path(tmpdir, "rmsd.matrix")
+        write_matrix_text(matrix, 3, output_f, chunk_size=2)
+        observed = output_f.read_text().split(os.linesep)
+    assert observed == ["1 2 1.000", "1 3 2.500", "2 3 3.123", ""]
 
 
 def test_RMSD_class(input_protdna_models):
@@ -129,6 +210,47 @@ def test_RMSD_class(input_protdna_models):
     np.testing.assert_allclose(rmsd_obj.data, expected_data, atol=0.001)
 
 
+def test_RMSD_preloaded(input_protdna_models):
+    """Test the RMSD class with coordinates loaded beforehand."""
+    models = input_protdna_models * 2
+    _, *coords = load_model_coords(models)
+    assert coords[0].shape[:2] == coords[1].shape
+    rmsd_obj = RMSD(
+        models,
+        core=0,
+        npairs=6,
+        start_ref=0,
+        start_mod=1,
+        output_name="rmsd_0.matrix",
+        path=Path("."),
+        coords=coords,
+        )
+    rmsd_obj.run()
+
+    expected_rmsd = [2.257, 0.0, 2.257, 2.257, 0.0, 2.257]
+    np.testing.assert_allclose(rmsd_obj.data[:, 2], expected_rmsd, atol=0.001)
+
+
+def test_RMSD_missing_atoms(input_protdna_models):
+    """Test pairs of models with different atoms."""
+    _, xyz, mask = load_model_coords(input_protdna_models)
+    mask[1, :10] = False
+    rmsd_obj = RMSD(
+        input_protdna_models,
+        core=0,
+        npairs=1,
+        start_ref=0,
+        start_mod=1,
+        output_name="rmsd_0.matrix",
+        path=Path("."),
+        coords=(xyz, mask),
+        )
+    rmsd_obj.run()
+
+    expected_rmsd = batch_rmsd(xyz[1, 10:], xyz[0, 10:])
+    np.testing.assert_allclose(rmsd_obj.data[0, 2], expected_rmsd, atol=1e-6)
+
+
 def test_RMSD_filter_resdic(input_protdna_models):
     """Test filter_resdic."""
     params = {"resdic_A": [1, 2, 3], "resdic_B": [4, 5, 6]}
@@ -174,3 +296,166 @@ def test_RMSDJob(input_protdna_models):
     assert job.rmsd_obj == rmsd_obj
 
     assert job.output == job_f
+
+
+def test_get_tiles():
+    """Test the tiles cover each pair once."""
+    nmodels = 7
+    tiles = get_tiles(nmodels, tile_size=3)
+    assert tiles[0] == ((0, 3), (0, 3))
+    assert len(tiles) == 5
+    offsets = []
+    for rows, cols in tiles:
+        tile = RMSDTile(Path("."), nmodels, rows, cols)
+        for _, start, end, offset in tile.segments():
+            offsets.extend(range(offset, offset + end - start))
+    assert sorted(offsets) == list(range(nmodels * (nmodels - 1) // 2))
+
+
+def test_get_tile_size():
+    """Test the size of tiles within a memory budget."""
+    assert get_tile_size(1000, memory=96, ncores=1) == 1048
+    assert get_tile_size(1000, memory=96, ncores=4) == 262
+    assert get_tile_size(10 ** 9, memory=64, ncores=1) == 1
+
+
+def test_tiled_matrix(input_protdna_models):
+    """Test the tiled matrix matches the in-memory one and resumes."""
+    models = input_protdna_models * 3
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = prepare_tiles(models, Path(tmpdir))
+        assert path.name == tiles_key(models)
+        assert tiles_key(models, {"A": [1]}) != path.name
+        tiles = [
+            RMSDTile(path, len(models), rows, cols)
+            for rows, cols in get_tiles(len(models), tile_size=4)
+            ]
+        for tile in tiles:
+            tile.run()
+        matrix = np.load(Path(path, "rmsd.npy"), mmap_mode="r+")
+        ref, mod = np.triu_indices(len(models), k=1)
+        expected = np.where((mod - ref) % 2, 2.257, 0.0)
+        np.testing.assert_allclose(matrix, expected, atol=0.001)
+
+        # a calculation with the same models resumes from missing values
+        matrix[:3] = -1
+        matrix[-3:] = np.nan
+        matrix.flush()
+        assert prepare_tiles(models, Path(tmpdir)) == path
+        for tile in tiles:
+            tile.run()
+        matrix = np.load(Path(path, "rmsd.npy"))
+        assert (matrix[:3] == -1).all()
+        np.testing.assert_allclose(matrix[3:], expected[3:], atol=0.001)
+
+
+def test_overall_rmsd_tiled(input_protdna_models):
+    """Test the rmsdmatrix module above max_models."""
+    rmsd_module = HaddockModule(
+        order=2,
+        path=Path("2_rmsdmatrix"),
+        initial_params=rmsd_pars
+        )
+    rmsd_module.params["max_models"] = 1
+    rmsd_module.previous_io.output = input_protdna_models
+    rmsd_module._run()
+
+    rmsd_matrix = np.load("rmsd.npy")
+
+    np.testing.assert_allclose(rmsd_matrix, [2.257], atol=0.001)
+
+    assert not Path("rmsd_tiles").exists()
+
+    for fname in ("rmsd.npy", "rmsd_models.json", "rmsd_matrix.json",
+                  "io.json"):
+        os.unlink(Path(fname))
+
+
+def test_coords_hash(input_protdna_models):
+    """Test models are identified by their coordinates."""
+    _, xyz, mask = load_model_coords(input_protdna_models * 2)
+    hashes = [coords_hash(xyz[n], mask[n]) for n in range(4)]
+    assert hashes[0] == hashes[2]
+    assert hashes[0] != hashes[1]
+    mask[2, 0] = False
+    assert coords_hash(xyz[2], mask[2]) != hashes[0]
+
+
+def test_fill_from_matrix():
+    """Test values are copied for the pairs of shared models."""
+    # models a, b, c and d
+    old_matrix = np.array([1.0, 2.0, 3.0, 4.0, 5.0, 6.0])
+    old_hashes = ["a", "b", "c", "d"]
+    # d, new, b, a
+    matrix = np.full(6, np.nan)
+    copied = fill_from_matrix(matrix, ["d", "e", "b", "a"], old_matrix,
+                              old_hashes)
+    assert copied == 3
+    np.testing.assert_array_equal(
+        matrix,
+        [np.nan, 5.0, 3.0, np.nan, np.nan, 1.0],
+        )
+
+
+def test_find_matrix():
+    """Test the matrix sharing the most models is found."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        folders = []
+        for i, (selection, hashes) in enumerate([
+                ("sel", ["a", "b"]),
+                ("sel", ["a", "b", "c"]),
+                ("other", ["a", "b", "c", "d"]),
+                ]):
+            folder = Path(tmpdir, str(i))
+            folder.mkdir()
+            create_matrix(Path(folder, "rmsd.npy"), 1)
+            save_matrix_models(
+                Path(folder, "rmsd_models.json"),
+                selection,
+                hashes,
+                )
+            folders.append(folder)
+        found = find_matrix(folders, "sel", ["a", "b", "c", "d"])
+        assert found == (Path(folders[1], "rmsd.npy"), ["a", "b", "c"])
+        assert find_matrix(folders, "sel", ["a", "e"]) is None
+
+
+@pytest.mark.parametrize("max_models", [10000, 1])
+def test_extend_matrix(input_protdna_models, max_models):
+    """Test a matrix is extended with new models."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        Path(tmpdir, "data").mkdir()
+        # a third model, translated
+        lines = Path(golden_data, "protdna_complex_1.pdb").read_text()
+        new_lines = []
+        for line in lines.splitlines():
+            if line.startswith("ATOM"):
+                x = float(line[30:38]) + 1.0
+                line = f"{line[:30]}{x:8.3f}{line[38:]}"
+            new_lines.append(line)
+        new_model = Path(tmpdir, "protdna_complex_3.pdb")
+        new_model.write_text(os.linesep.join(new_lines) + os.linesep)
+        new_models = input_protdna_models + [
+            PDBFile(new_model, path=tmpdir, score=0.0),
+            ]
+
+        for step, models in enumerate([input_protdna_models, new_models]):
+            step_path = Path(tmpdir, f"{step}_rmsdmatrix")
+            step_path.mkdir()
+            rmsd_module = HaddockModule(
+                order=step,
+                path=step_path,
+                initial_params=rmsd_pars
+                )
+            rmsd_module.params["max_models"] = max_models
+            rmsd_module.previous_io.output = models
+            with working_directory(step_path):
+                rmsd_module._run()
+            if step == 0:
+                # the value is copied, not calculated again
+                matrix = np.load(Path(step_path, "rmsd.npy"), mmap_mode="r+")
+                matrix[0] = 9.0
+                matrix.flush()
+
+        matrix = np.load(Path(tmpdir, "1_rmsdmatrix", "rmsd.npy"))
+    np.testing.assert_allclose(matrix, [9.0, 0.0, 2.257], atol=0.001)